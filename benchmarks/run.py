@@ -0,0 +1,532 @@
+"""Benchmark harness, that drives concurrent load through the proxy server in front of a stub filebrowser server.
+
+>>> Benchmarks
+
+See Also:
+    - The stub, the proxy and the load driver run in separate processes, so that they don't compete for one core.
+    - Each scenario is run with a warmup, followed by the measured requests.
+    - Results are saved as JSON, and compared against a previous run with ``--compare``
+
+Examples:
+    >>> python benchmarks/run.py --requests 2000 --concurrency 32
+    >>> python benchmarks/run.py --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import dataclasses
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(BENCHMARKS)
+# Size of the video ranges requested by a player, and the upload chunks sent by the tus client
+RANGE_SIZE = 512 * 1024
+CHUNK_SIZE = 1024 * 1024
+CHUNK = os.urandom(CHUNK_SIZE)
+# Token sent by the clients, so that the requests are scoped to a session like filebrowser's frontend
+TOKEN = "benchmark"
+
+
+@dataclasses.dataclass
+class Scenario:
+    """Load profile of a single endpoint.
+
+    >>> Scenario
+
+    """
+
+    name: str
+    method: str
+    # Builds the path and extra headers for the nth request
+    build: Callable[[int], Tuple[str, Dict[str, str]]]
+    content: bytes | None = None
+
+
+SCENARIOS = (
+    # Directory listings of a handful of large folders, which are coalesced when they are requested at once
+    Scenario("listing", "GET", lambda n: (f"/api/resources/bench/folder-{n % 8}/", {})),
+    # Thumbnails of a gallery, scrolled through by the clients
+    Scenario(
+        "thumbnail",
+        "GET",
+        lambda n: (f"/api/preview/thumb/bench/file-{n % 256:05d}.jpg", {}),
+    ),
+    # Video playback, seeking to random positions
+    Scenario(
+        "video",
+        "GET",
+        lambda n: (
+            "/api/raw/bench/video.mp4",
+            {
+                "range": f"bytes={(start := random.randrange(0, 63 * CHUNK_SIZE))}-{start + RANGE_SIZE - 1}"
+            },
+        ),
+    ),
+    # Resumable uploads, sent in chunks
+    Scenario(
+        "upload",
+        "PATCH",
+        lambda n: (
+            f"/api/tus/bench/upload-{n % 16}.bin",
+            {
+                "tus-resumable": "1.0.0",
+                "upload-offset": str(n // 16 * CHUNK_SIZE),
+                "content-type": "application/offset+octet-stream",
+            },
+        ),
+        CHUNK,
+    ),
+    # Static frontend assets, loaded on every page load
+    Scenario(
+        "static",
+        "GET",
+        lambda n: ("/static/js/app.js", {"accept-encoding": "br, gzip"}),
+    ),
+)
+
+
+def free_port() -> int:
+    """Finds a free port on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss(pid: int) -> int | None:
+    """Gets the resident set size of a process and all its descendants.
+
+    See Also:
+        Reads from ``/proc``, so the size is only available on Linux.
+
+    Args:
+        pid: Process ID.
+
+    Returns:
+        int:
+        Returns the resident set size in bytes.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            size = next(
+                int(line.split()[1]) * 1024
+                for line in file
+                if line.startswith("VmRSS:")
+            )
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            children = [int(child) for child in file.read().split()]
+    except (OSError, StopIteration):
+        return None
+    return size + sum(rss(child) or 0 for child in children)
+
+
+def peak_rss(pid: int, stop: threading.Event, interval: float = 0.1) -> int | None:
+    """Samples the resident set size of a process and all its descendants, until stopped.
+
+    Args:
+        pid: Process ID.
+        stop: Event to stop sampling.
+        interval: Interval in seconds between the samples.
+
+    Returns:
+        int:
+        Returns the largest resident set size in bytes.
+    """
+    peak = None
+    while True:
+        if (size := rss(pid)) is not None:
+            peak = max(peak or 0, size)
+        if stop.wait(interval):
+            return peak
+
+
+def wait_until_ready(url: str, timeout: float = 30) -> None:
+    """Waits for a server to respond to its health endpoint.
+
+    Args:
+        url: Health endpoint of the server.
+        timeout: Time in seconds to wait for.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} didn't respond within {timeout} seconds")
+
+
+def start_stub(port: int, workdir: str) -> subprocess.Popen:
+    """Starts the stub filebrowser server.
+
+    Args:
+        port: Port to listen on.
+        workdir: Directory for the logs.
+
+    Returns:
+        subprocess.Popen:
+        Returns the process of the stub server.
+    """
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "stub:app",
+            "--app-dir",
+            BENCHMARKS,
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(workdir, "stub.log"), "w"),
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/health")
+    return process
+
+
+def start_proxy(
+    port: int, stub_port: int, workdir: str, args: argparse.Namespace
+) -> subprocess.Popen:
+    """Starts the proxy server in front of the stub server.
+
+    See Also:
+        The proxy runs in a clean working directory, so that no ``.proxy.env`` from the repository is picked up.
+
+    Args:
+        port: Port for the proxy to listen on.
+        stub_port: Port of the stub server.
+        workdir: Working directory of the proxy server.
+        args: Command line arguments.
+
+    Returns:
+        subprocess.Popen:
+        Returns the process of the proxy server.
+    """
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key.lower() not in ("secrets_path", "env_file")
+    }
+    env.update(
+        ROOT=workdir,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        WORKERS=str(args.workers),
+        PYTHONPATH=os.pathsep.join(filter(None, (args.source, env.get("PYTHONPATH")))),
+        # A rate limit that is never hit, so that every request runs through the rate limiter
+        RATE_LIMIT=json.dumps({"max_requests": 10_000_000, "seconds": 1}),
+    )
+    for extra in args.env:
+        key, _, value = extra.partition("=")
+        env[key] = value
+    log_config = {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {"default": {"format": "%(asctime)s %(levelname)s %(message)s"}},
+        "handlers": {
+            "file": {
+                "class": "logging.FileHandler",
+                "filename": os.path.join(workdir, "proxy.log"),
+                "formatter": "default",
+            }
+        },
+        "loggers": {"proxy": {"handlers": ["file"], "level": args.log_level}},
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import json, sys\n"
+            "from pyfilebrowser.proxy.server import proxy_server\n"
+            "proxy_server(sys.argv[1], json.loads(sys.argv[2]))",
+            f"http://127.0.0.1:{stub_port}",
+            json.dumps(log_config),
+        ],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=open(os.path.join(workdir, "proxy.err"), "w"),
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/health")
+    return process
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Gets the value at a percentile of the sorted values, using the nearest rank."""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def drive(
+    base_url: str, scenario: Scenario, requests: int, concurrency: int
+) -> dict:
+    """Drives concurrent load for a scenario.
+
+    Args:
+        base_url: URL of the server under test.
+        scenario: Scenario to run.
+        requests: Number of requests to send.
+        concurrency: Number of requests in flight at any time.
+
+    Returns:
+        dict:
+        Returns the throughput and the latency percentiles of the scenario.
+    """
+    latencies = []
+    errors = 0
+    received = 0
+    counter = iter(range(requests))
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        """Sends requests until the counter is exhausted."""
+        nonlocal errors, received
+        for n in counter:
+            path, headers = scenario.build(n)
+            start = time.perf_counter()
+            try:
+                response = await client.request(
+                    scenario.method,
+                    path,
+                    headers={"x-auth": TOKEN, **headers},
+                    content=scenario.content,
+                )
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            received += len(response.content)
+            if response.status_code >= 400:
+                errors += 1
+
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "throughput_mbps": round(received / elapsed / 1_048_576, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+    }
+
+
+def run(
+    base_url: str, args: argparse.Namespace, process: subprocess.Popen | None = None
+) -> dict:
+    """Runs all the selected scenarios against a server.
+
+    Args:
+        base_url: URL of the server under test.
+        args: Command line arguments.
+        process: Process of the proxy server, to sample its memory usage.
+
+    Returns:
+        dict:
+        Returns the results of each scenario, along with the memory usage.
+    """
+    results = {"scenarios": {}}
+    stop = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    if process:
+        results["rss_idle_bytes"] = rss(process.pid)
+        sampler = executor.submit(peak_rss, process.pid, stop)
+    for scenario in SCENARIOS:
+        if args.scenarios and scenario.name not in args.scenarios:
+            continue
+        asyncio.run(
+            drive(
+                base_url,
+                scenario,
+                max(args.requests // 10, args.concurrency),
+                args.concurrency,
+            )
+        )
+        results["scenarios"][scenario.name] = result = asyncio.run(
+            drive(base_url, scenario, args.requests, args.concurrency)
+        )
+        print(
+            f"{scenario.name:>10}: {result['throughput_rps']:>9} req/s {result['throughput_mbps']:>8} MB/s "
+            f"p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  errors {result['errors']}"
+        )
+    stop.set()
+    executor.shutdown()
+    if process:
+        results["rss_peak_bytes"] = sampler.result()
+        results["rss_bytes"] = rss(process.pid)
+    return results
+
+
+def commit(source: str) -> str | None:
+    """Gets the commit hash of the checkout that is benchmarked, to tag the results with."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=source,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous: dict, tolerance: float) -> List[str]:
+    """Compares the results against a previous run.
+
+    Args:
+        current: Results of the current run.
+        previous: Results of the previous run.
+        tolerance: Fraction by which the throughput may drop, or the p99 latency may rise.
+
+    Returns:
+        List[str]:
+        Returns the regressions, if any.
+    """
+    regressions = []
+    for name, result in current["proxy"]["scenarios"].items():
+        if not (before := previous.get("proxy", {}).get("scenarios", {}).get(name)):
+            continue
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s"
+            )
+        if before["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p99 {before['p99_ms']} -> {result['p99_ms']} ms"
+            )
+    return regressions
+
+
+def main() -> int:
+    """Runs the benchmarks, and saves the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--requests", type=int, default=2_000, help="requests per scenario"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="requests in flight"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="workers of the proxy server"
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs="*",
+        help=f"subset of {[scenario.name for scenario in SCENARIOS]}",
+    )
+    parser.add_argument(
+        "--env", nargs="*", default=[], help="extra proxy settings as KEY=VALUE"
+    )
+    parser.add_argument(
+        "--log-level", default="INFO", help="log level of the proxy server"
+    )
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="also run against the stub server directly",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(
+            BENCHMARKS, "results", time.strftime("%Y%m%d-%H%M%S.json")
+        ),
+        help="file to save the results to",
+    )
+    parser.add_argument(
+        "--compare", help="results of a previous run to compare against"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed regression, as a fraction"
+    )
+    parser.add_argument(
+        "--source",
+        type=os.path.abspath,
+        default=REPOSITORY,
+        help="checkout of the repository to benchmark, defaults to the one with the harness",
+    )
+    args = parser.parse_args()
+
+    random.seed(0)
+    stub_port, proxy_port = free_port(), free_port()
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit(args.source),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "compare")
+        },
+    }
+    with tempfile.TemporaryDirectory(prefix="pyfb-bench-") as workdir:
+        stub = start_stub(stub_port, workdir)
+        proxy = None
+        try:
+            if args.baseline:
+                print("stub server (baseline)")
+                results["baseline"] = run(f"http://127.0.0.1:{stub_port}", args)
+            proxy = start_proxy(proxy_port, stub_port, workdir, args)
+            print(f"proxy server with {args.workers} worker(s)")
+            results["proxy"] = run(f"http://127.0.0.1:{proxy_port}", args, proxy)
+            if rss_bytes := results["proxy"]["rss_bytes"]:
+                print(
+                    f"proxy rss: {(results['proxy']['rss_idle_bytes'] or 0) / 1_048_576:.1f} MB idle, "
+                    f"{(results['proxy']['rss_peak_bytes'] or 0) / 1_048_576:.1f} MB peak, "
+                    f"{rss_bytes / 1_048_576:.1f} MB after the load"
+                )
+        finally:
+            for process in (proxy, stub):
+                if process:
+                    process.terminate()
+                    process.wait(timeout=10)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+    print(f"results saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+        if any(
+            previous.get("config", {}).get(key) != results["config"][key]
+            for key in ("requests", "concurrency", "workers", "env")
+        ):
+            print(f"warning: {args.compare} was run with a different load profile")
+        if regressions := compare(results, previous, args.tolerance):
+            print("regressions:\n  " + "\n  ".join(regressions))
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Stub filebrowser server, that emulates the endpoints the proxy is benchmarked against.
+
+>>> Stub
+
+See Also:
+    - Responses are generated once on startup, so that the stub's own cost stays constant across the runs.
+    - Run as ``python -m uvicorn stub:app --app-dir benchmarks``
+"""
+
+import hashlib
+import json
+import os
+from http import HTTPStatus
+
+from fastapi import FastAPI, Request, Response
+
+# Number of items in each directory listing, that yields a JSON body of about 1 MB
+LISTING_SIZE = int(os.environ.get("STUB_LISTING_SIZE", 8_000))
+# Size of the virtual video file in bytes, which is served in ranges
+VIDEO_SIZE = 64 * 1024 * 1024
+# Size of each thumbnail in bytes
+THUMBNAIL_SIZE = 24 * 1024
+
+app = FastAPI()
+LISTING = json.dumps(
+    {
+        "path": "/bench",
+        "name": "bench",
+        "isDir": True,
+        "numDirs": 0,
+        "numFiles": LISTING_SIZE,
+        "items": [
+            {
+                "path": f"/bench/file-{index:05d}.jpg",
+                "name": f"file-{index:05d}.jpg",
+                "size": index * 1024,
+                "extension": ".jpg",
+                "modified": "2024-01-01T00:00:00Z",
+                "mode": 420,
+                "isDir": False,
+                "isSymlink": False,
+                "type": "image",
+            }
+            for index in range(LISTING_SIZE)
+        ],
+    }
+).encode()
+LISTING_ETAG = f'"{hashlib.md5(LISTING).hexdigest()}"'
+THUMBNAIL = os.urandom(THUMBNAIL_SIZE)
+# Repeating pattern of 1 MB, so that any range of up to 2 MB is a slice of the window
+VIDEO_PATTERN = bytes(range(256)) * 4096
+VIDEO_WINDOW = VIDEO_PATTERN * 3
+STATIC = b"console.log('filebrowser');\n" * 4096
+# Uploads in progress, along with their offsets
+UPLOADS = {}
+
+
+@app.get("/health")
+async def health() -> dict:
+    """Health endpoint, that is probed by the proxy."""
+    return {"status": "OK"}
+
+
+@app.get("/static/{path:path}")
+async def static(path: str) -> Response:
+    """Static frontend asset."""
+    return Response(
+        STATIC, media_type="application/javascript", headers={"etag": '"static"'}
+    )
+
+
+@app.get("/api/resources/{path:path}")
+async def resources(path: str) -> Response:
+    """Directory listing of a large folder."""
+    return Response(
+        LISTING, media_type="application/json", headers={"etag": LISTING_ETAG}
+    )
+
+
+@app.get("/api/preview/thumb/{path:path}")
+async def thumbnail(path: str) -> Response:
+    """Thumbnail of an image."""
+    return Response(
+        THUMBNAIL,
+        media_type="image/jpeg",
+        headers={"etag": f'"{path}"', "cache-control": "private"},
+    )
+
+
+@app.api_route("/api/raw/{path:path}", methods=["GET", "HEAD"])
+async def raw(path: str, request: Request) -> Response:
+    """Video file, that supports byte ranges like filebrowser's raw endpoint."""
+    headers = {"accept-ranges": "bytes", "etag": '"video"'}
+    # Browsers always request a range for video, so the first megabyte is served otherwise
+    byte_range = request.headers.get("range", "bytes=0-1048575")
+    start, _, end = byte_range.removeprefix("bytes=").partition("-")
+    start = int(start)
+    # Like most servers, open-ended ranges are served in parts
+    end = min(
+        int(end) if end else VIDEO_SIZE - 1,
+        VIDEO_SIZE - 1,
+        start + 2 * len(VIDEO_PATTERN) - 1,
+    )
+    offset = start % len(VIDEO_PATTERN)
+    stop = offset + end - start + 1
+    body = VIDEO_WINDOW[offset:stop]
+    return Response(
+        body,
+        status_code=HTTPStatus.PARTIAL_CONTENT.value,
+        media_type="video/mp4",
+        headers={**headers, "content-range": f"bytes {start}-{end}/{VIDEO_SIZE}"},
+    )
+
+
+@app.post("/api/tus/{path:path}")
+async def tus_create(path: str) -> Response:
+    """Creates an upload, like filebrowser's tus endpoint."""
+    UPLOADS[path] = 0
+    return Response(
+        status_code=HTTPStatus.CREATED.value, headers={"tus-resumable": "1.0.0"}
+    )
+
+
+@app.patch("/api/tus/{path:path}")
+async def tus_patch(path: str, request: Request) -> Response:
+    """Receives a chunk of an upload, and discards it after counting its bytes."""
+    offset = int(request.headers.get("upload-offset", 0))
+    async for chunk in request.stream():
+        offset += len(chunk)
+    UPLOADS[path] = offset
+    return Response(
+        status_code=HTTPStatus.NO_CONTENT.value,
+        headers={"tus-resumable": "1.0.0", "upload-offset": str(offset)},
+    )
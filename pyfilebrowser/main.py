@@ -4,7 +4,6 @@ import multiprocessing
 import os
 import signal
 import socket
-import subprocess
 import threading
 import time
 import warnings
@@ -17,7 +16,7 @@ import yaml
 
 from pyfilebrowser.modals import models, settings
 from pyfilebrowser.proxy import proxy_server, proxy_settings
-from pyfilebrowser.squire import download, steward, struct
+from pyfilebrowser.squire import download, steward, struct, supervisor
 
 
 class FileBrowser:
@@ -59,6 +58,8 @@ class FileBrowser:
         # Reset to stdout, so the log output stream can be controlled with custom logging
         self.env.config_settings.server.log = models.Log.stdout
         self.proxy_engine: multiprocessing.Process | None = None
+        # Binary that is running in the foreground, to forward the shutdown signals to
+        self.foreground: supervisor.Supervisor | None = None
         self.proxy = kwargs.get("proxy") or steward.get_env(
             "pyfb_proxy", convert_to=bool
         )
@@ -66,9 +67,30 @@ class FileBrowser:
         assert self.proxy is None or isinstance(
             self.proxy, bool
         ), f"\n\tproxy flag should be a boolean value, received {type(self.proxy).__name__!r}"
+        self.auto_socket()
         self.shutdown_flag = threading.Event()
         self.is_docker = os.path.isfile(os.path.join("/", ".dockerenv"))
 
+    def auto_socket(self) -> None:
+        """Listens on a unix domain socket next to the database, when the proxy is enabled without a socket.
+
+        See Also:
+            - The proxy connects to the server through the socket, without a TCP hop or a port to keep free.
+            - Servers with TLS settings, and platforms without unix domain sockets keep listening on the port.
+        """
+        server = self.env.config_settings.server
+        path = os.path.abspath(download.executable.filebrowser_socket)
+        if (
+            self.proxy
+            and not server.socket
+            and not (server.tlsKey or server.tlsCert)
+            and hasattr(socket, "AF_UNIX")
+            # Unix domain socket paths are limited to 104 bytes on macOS, and 108 on linux
+            and len(path) < 104
+        ):
+            self.logger.info("Listening on the unix domain socket %s", path)
+            server.socket = path
+
     def register_signal_handlers(self) -> None:
         """Register signals (cross-platform) to handle graceful shutdown on various levels."""
         # Ctrl+C / KeyboardInterrupt
@@ -76,21 +98,48 @@ class FileBrowser:
         # Service stop / kill
         signal.signal(signal.SIGTERM, self.handle_shutdown)
 
-    def cleanup(self, log: bool = True) -> None:
-        """Removes the config and proxy database."""
+    def cleanup(self, log: bool = True, keep_database: bool = False) -> None:
+        """Removes the config, proxy database and the server's stale unix domain socket.
+
+        Args:
+            log: Boolean flag to log the files that are removed.
+            keep_database: Boolean flag to retain the server's database, along with its fingerprint.
+        """
         self.unlink()
+        # A stale socket from a previous run prevents the server from listening on it again
+        if (server_socket := self.env.config_settings.server.socket) and os.path.exists(
+            server_socket
+        ):
+            os.remove(server_socket)
         steward.delete(
             (
                 steward.fileio.users,
                 steward.fileio.config,
                 proxy_settings.database,
-                download.executable.filebrowser_db,
+                # Sidecar files of the database in WAL mode, which are left behind if the proxy didn't exit cleanly
+                *(
+                    sidecar
+                    for suffix in ("-wal", "-shm")
+                    if os.path.isfile(sidecar := proxy_settings.database + suffix)
+                ),
+                *(
+                    ()
+                    if keep_database
+                    else (
+                        download.executable.filebrowser_db,
+                        download.executable.filebrowser_fingerprint,
+                    )
+                ),
             ),
             logger=self.logger if log else None,
         )
 
     def exit_process(self) -> None:
-        """Deletes the database file, and all the subtitles that were created by this application."""
+        """Deletes the database file, and all the subtitles that were created by this application.
+
+        See Also:
+            The database is retained with ``fast_restart``, to be reused by the next start when nothing changed.
+        """
         if self.proxy_engine:
             self.proxy_engine.join(timeout=3)  # Gracefully terminate the proxy server
             for i in range(1, 6):
@@ -108,7 +157,7 @@ class FileBrowser:
                     f"Failed to terminate daemon process PID: [{self.proxy_engine.pid}] within 5 attempts",
                     RuntimeWarning,
                 )
-        self.cleanup()
+        self.cleanup(keep_database=self.settings.fast_restart)
 
     def run_subprocess(
         self,
@@ -118,47 +167,33 @@ class FileBrowser:
     ) -> None:
         """Run ``filebrowser`` commands as subprocess.
 
+        See Also:
+            Shutdown signals received while the binary is running, are forwarded to it.
+
         Args:
             arguments: Arguments to pass to the binary.
             failed_msg: Failure message in case of bad return code.
             stdout: Boolean flag to show/hide standard output.
         """
-        command = os.path.join(os.getcwd(), download.executable.filebrowser_bin)
-        if arguments:
-            arguments.insert(0, "")
-            command += " ".join(arguments)
-        process = subprocess.Popen(
-            command,
-            shell=True,
-            universal_newlines=True,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        self.foreground = supervisor.Supervisor(self.logger, arguments, stdout)
+        self.logger.debug("Initiated filebrowser [PID: %d]", self.foreground.pid)
         try:
-            if stdout:
-                # noinspection PyTypeChecker
-                for line in process.stdout:
-                    self.logger.info(steward.remove_prefix(line))
-            process.wait()
-            # noinspection PyTypeChecker
-            for line in process.stderr:
-                self.logger.warning(steward.remove_prefix(line))
-            assert process.returncode == 0, (
-                failed_msg or f"filebrowser returned an exit code {process.returncode}"
-            )
+            returncode = self.foreground.wait()
         except KeyboardInterrupt:
-            if process.poll() is None:
-                # noinspection PyTypeChecker
-                for line in process.stdout:
-                    self.logger.info(steward.remove_prefix(line))
-                process.terminate()
+            self.foreground.stop()
             raise
+        finally:
+            self.foreground = None
+        assert returncode == 0, (
+            failed_msg or f"filebrowser returned an exit code {returncode}"
+        )
 
     def create_users(self) -> None:
         """Creates the JSON file(s) for user profiles."""
         final_settings = []
         for idx, profile in enumerate(self.env.user_profiles):
+            # Copied, so that the profiles hold the plain text passwords for the next start
+            profile = profile.model_copy(deep=True)
             if profile.perm:
                 self.logger.info("Setting custom permissions for: %s", profile.username)
                 self.logger.debug(profile.perm.model_dump_json())
@@ -225,7 +260,11 @@ class FileBrowser:
         return base_settings
 
     def create_config(self) -> None:
-        """Creates the JSON file for configuration."""
+        """Creates the JSON file for configuration.
+
+        See Also:
+            Idempotent, so that the config can be rendered for the fingerprint and again when it is imported.
+        """
         if self.proxy:
             self.env.config_settings.settings.authMethod = "json"
         # noinspection PyUnresolvedReferences
@@ -279,11 +318,55 @@ class FileBrowser:
             False,
         )
 
+    def fingerprint_content(self) -> bytes:
+        """Gets the content that decides whether the database can be reused.
+
+        See Also:
+            - Includes the rendered configuration file (with the extra settings), and the user profiles.
+            - Includes the size and modified time of the binary, so that an upgrade imports everything again.
+
+        Returns:
+            bytes:
+            Returns the content to fingerprint.
+        """
+        with open(steward.fileio.config, "rb") as file:
+            content = [file.read()]
+        content.extend(
+            profile.model_dump_json().encode() for profile in self.env.user_profiles
+        )
+        stat = os.stat(download.executable.filebrowser_bin)
+        content.append(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return b"\n".join(content)
+
+    def reusable(self, content: bytes) -> bool:
+        """Checks whether the database from the previous run can be reused.
+
+        Args:
+            content: Content to fingerprint, from ``fingerprint_content``
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate whether the database was created with the same settings.
+        """
+        if not (
+            self.settings.fast_restart
+            and os.path.isfile(download.executable.filebrowser_db)
+            and os.path.isfile(download.executable.filebrowser_fingerprint)
+        ):
+            return False
+        with open(download.executable.filebrowser_fingerprint) as file:
+            return steward.validate_fingerprint(content, file.read().strip())
+
     def background_tasks(self) -> None:
-        """Initiates the proxy engine and subtitles' format conversion as background tasks."""
+        """Initiates the proxy engine and subtitles' format conversion as background tasks.
+
+        See Also:
+            When the server listens on a unix domain socket, the proxy connects to it without a TCP hop.
+        """
+        server = self.env.config_settings.server
         # noinspection PyTypeChecker
-        assert proxy_settings.port != int(
-            self.env.config_settings.server.port
+        assert server.socket or proxy_settings.port != int(
+            server.port
         ), f"\n\tProxy server can't run on the same port [{proxy_settings.port}] as the server!!"
         # This is to check if the port is available, before starting the proxy server in a dedicated process
         # If not for this, the proxy server will fail to initiate in the child process and become unmanageable
@@ -301,12 +384,19 @@ class FileBrowser:
         if proxy_settings.debug:
             log_config = struct.update_log_level(log_config, logging.DEBUG)
         # noinspection HttpUrlsUsage
+        # Daemonic processes are not allowed to have children, so proxy with multiple workers can't be a daemon
         self.proxy_engine = multiprocessing.Process(
             target=proxy_server,
-            daemon=True,
+            daemon=proxy_settings.workers == 1,
             args=(
-                f"http://{self.env.config_settings.server.address}:{self.env.config_settings.server.port}",
+                # Host of the URL is only used for the host header, when connected through the socket
+                (
+                    "http://localhost"
+                    if server.socket
+                    else f"http://{server.address}:{server.port}"
+                ),
                 log_config,
+                os.path.abspath(server.socket) if server.socket else None,
             ),
         )
         # noinspection PyUnresolvedReferences
@@ -367,6 +457,8 @@ class FileBrowser:
                 self.logger.debug(f"frame.{atr}: {getattr(frame, atr)}")
         self.logger.info("Received signal %d, setting shutdown flag", signum)
         self.shutdown_flag.set()
+        if self.foreground:
+            self.foreground.send_signal(signum)
 
     def start_service(self) -> None:
         """Starts the filebrowser server as a service with graceful shutdown handling."""
@@ -382,22 +474,46 @@ class FileBrowser:
             self.exit_process()
 
     def start_server(self) -> None:
-        """Starts the filebrowser server as a regular script with automatic restarts."""
-        self.cleanup(False)
+        """Starts the filebrowser server as a regular script with automatic restarts.
+
+        See Also:
+            With ``fast_restart``, the config and users are imported only when they changed since the previous run.
+        """
+        self.cleanup(False, keep_database=True)
         if not os.path.isfile(download.executable.filebrowser_bin):
             download.binary(logger=self.logger, github=self.github)
-        self.import_config()
-        self.import_users()
+        self.create_config()
+        content = self.fingerprint_content()
+        if self.reusable(content):
+            self.logger.info(
+                "Settings are unchanged, reusing %s", download.executable.filebrowser_db
+            )
+        else:
+            steward.delete(
+                (
+                    download.executable.filebrowser_db,
+                    download.executable.filebrowser_fingerprint,
+                )
+            )
+            self.import_config()
+            self.import_users()
+            if self.settings.fast_restart:
+                with open(download.executable.filebrowser_fingerprint, "w") as file:
+                    file.write(steward.fingerprint(content))
         self.link()
         steward.delete((steward.fileio.users, steward.fileio.config))
         if self.proxy:
             self.background_tasks()
         for idx in range(self.settings.restart + 1):
             idx += 1
+            if self.shutdown_flag.is_set():
+                break
             self.logger.info("Initiating filebrowser API")
             try:
                 self.run_subprocess()
             except AssertionError as error:
+                if self.shutdown_flag.is_set():
+                    break
                 if self.settings.restart > idx:
                     self.logger.error(error)
                     self.logger.info("Attempt #%d failed, restarting server", idx)
@@ -15,12 +15,15 @@ class ServerSettings(PydanticEnvConfig):
     >>> ServerSettings
 
         - **symlinks** - List of symlinks to be created in the root directory. Accepts file or directory paths.
+        - **fast_restart** - Reuse the database on restarts, when the config, users and extra settings are unchanged.
 
     """
 
     # 0 to 10 attempts
     restart: int = Field(0, le=10, ge=0)
     symlinks: Optional[List[DirectoryPath | FilePath]] = []
+    # Changes made at runtime are retained across the restarts, until the settings change
+    fast_restart: bool = False
 
     class Config:
         """Environment variables configuration."""
@@ -0,0 +1,491 @@
+"""Module for the in-memory caches of filebrowser's static frontend assets and the validators of API responses.
+
+>>> Cache
+
+"""
+
+import asyncio
+import collections
+import gzip
+import hashlib
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from typing import Dict, MutableMapping, Tuple
+
+import httpx
+from fastapi import Request, Response
+
+from pyfilebrowser.proxy import settings, squire, state, upstream
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOGGER = logging.getLogger("proxy")
+# Assets smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1_024
+# Content-codings of the variants, in the order of preference
+ENCODINGS = ("br", "gzip", "identity")
+# Upstream headers that are retained in the cached entry
+RETAINED_HEADERS = ("content-type", "cache-control", "last-modified")
+# API routes whose validators are cached, to answer the conditional requests
+VALIDATED_ROUTES = ("/api/resources/", "/api/preview/", "/api/raw/")
+# Methods that may modify the files, and invalidate the validators
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# API routes of the directory listings, which are served without validators by the upstream server
+LISTING_ROUTES = ("/api/resources/",)
+
+
+def compress(body: bytes, content_type: str) -> Dict[str, bytes]:
+    """Compresses the body of an asset, if the media type compresses well.
+
+    See Also:
+        Uses the same moderate levels as the on-the-fly compression, since the assets are compressed on demand.
+
+    Args:
+        body: Complete body of the asset.
+        content_type: Media type of the asset.
+
+    Returns:
+        Dict[str, bytes]:
+        Returns the compressed variants, keyed on their content-coding.
+    """
+    variants = {}
+    if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(
+        settings.COMPRESSIBLE_TYPES
+    ):
+        if brotli:
+            variants["br"] = brotli.compress(
+                body, quality=settings.env_config.compression.brotli_quality
+            )
+        variants["gzip"] = gzip.compress(
+            body, compresslevel=settings.env_config.compression.gzip_level, mtime=0
+        )
+    return variants
+
+
+class Entry:
+    """Cached asset, along with its pre-compressed variants.
+
+    >>> Entry
+
+    """
+
+    __slots__ = (
+        "upstream_etag",
+        "etag",
+        "headers",
+        "variants",
+        "encodings",
+        "size",
+        "expiry",
+    )
+
+    def __init__(
+        self, response: httpx.Response, body: bytes, variants: Dict[str, bytes]
+    ):
+        """Instantiates the object.
+
+        Args:
+            response: Response object from the upstream server.
+            body: Complete body of the response.
+            variants: Compressed variants of the body, keyed on their content-coding.
+        """
+        self.upstream_etag = response.headers.get("etag")
+        if self.upstream_etag and not self.upstream_etag.startswith("W/"):
+            self.etag = self.upstream_etag
+        else:
+            self.etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self.headers = {
+            key: response.headers[key]
+            for key in RETAINED_HEADERS
+            if key in response.headers
+        }
+        self.headers.setdefault(
+            "cache-control",
+            f"public, max-age={settings.env_config.static_cache.max_age}",
+        )
+        self.variants: Dict[str, bytes] = {"identity": body, **variants}
+        self.encodings = tuple(
+            encoding for encoding in ENCODINGS if encoding in self.variants
+        )
+        self.size = sum(len(variant) for variant in self.variants.values())
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Extends the time until which the asset is served without revalidation."""
+        self.expiry = time.monotonic() + settings.env_config.static_cache.ttl
+
+    def variant_etag(self, encoding: str) -> str:
+        """Gets the strong ETag of an encoded variant, since each representation must have a unique ETag.
+
+        Args:
+            encoding: Content-coding of the variant.
+
+        Returns:
+            str:
+            Returns the ETag for the variant.
+        """
+        if encoding == "identity":
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+    def respond(self, request: Request) -> Response:
+        """Constructs the response for a request, negotiating the encoding and the conditional headers.
+
+        Args:
+            request: The incoming request object.
+
+        Returns:
+            Response:
+            Returns a ``200`` response with the negotiated variant, or a ``304`` response if the client is up-to-date.
+        """
+        encoding = (
+            squire.negotiate_encoding(
+                request.headers.get("accept-encoding", ""), self.encodings
+            )
+            or "identity"
+        )
+        etag = self.variant_etag(encoding)
+        headers = {**self.headers, "etag": etag, "vary": "accept-encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match == "*" or etag in (
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        ):
+            return Response(status_code=HTTPStatus.NOT_MODIFIED.value, headers=headers)
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+        return Response(content=self.variants[encoding], headers=headers)
+
+
+class StaticCache:
+    """LRU cache of static assets, bounded by the total size in bytes.
+
+    >>> StaticCache
+
+    See Also:
+        - Requests are served within a single event loop, so the cache doesn't need a lock.
+        - Each worker holds its own cache, as the assets are immutable between filebrowser releases.
+    """
+
+    def __init__(self, max_size: int):
+        """Instantiates the object.
+
+        Args:
+            max_size: Maximum size in bytes of all the cached assets.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.entries: collections.OrderedDict[str, Entry] = collections.OrderedDict()
+
+    def get(self, path: str) -> Entry | None:
+        """Get the entry for a path, and mark it as recently used.
+
+        Args:
+            path: Request path of the asset.
+
+        Returns:
+            Entry:
+            Returns the cached entry, if present.
+        """
+        if entry := self.entries.get(path):
+            self.entries.move_to_end(path)
+        return entry
+
+    def put(self, path: str, entry: Entry) -> None:
+        """Stores an entry, evicting the least recently used entries until the cache fits within its size.
+
+        Args:
+            path: Request path of the asset.
+            entry: Entry to store.
+        """
+        if previous := self.entries.pop(path, None):
+            self.size -= previous.size
+        self.entries[path] = entry
+        self.size += entry.size
+        while self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+
+store = StaticCache(settings.env_config.static_cache.max_size)
+
+
+def cacheable(request: Request) -> bool:
+    """Checks if a request is for a static asset, that can be served from the cache.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the request is cacheable.
+    """
+    return (
+        store.max_size > 0
+        and request.method == "GET"
+        and request.url.path.startswith("/static/")
+        and "range" not in request.headers
+    )
+
+
+def lookup(request: Request, headers: MutableMapping[str, str]) -> Response | None:
+    """Serves a request from the cache if the asset is fresh, or prepares the upstream request to fill the cache.
+
+    Args:
+        request: The incoming request object.
+        headers: Headers for the upstream request, that are modified in place on a cache miss.
+
+    Returns:
+        Response:
+        Returns the response from the cache, if the asset is cached and fresh.
+    """
+    entry = store.get(request.url.path)
+    if entry and entry.expiry > time.monotonic():
+        return entry.respond(request)
+    # Conditional headers from the client are answered by the cache, and the upstream must return the full body
+    headers.pop("if-none-match", None)
+    headers.pop("if-modified-since", None)
+    headers["accept-encoding"] = "identity"
+    if entry and entry.upstream_etag:
+        headers["if-none-match"] = entry.upstream_etag
+
+
+async def fill(request: Request, server_response: httpx.Response) -> Response | None:
+    """Stores the upstream response in the cache, and serves the request from the cache.
+
+    See Also:
+        - Responses that are not ``200`` or ``304``, too large, personalized or marked as ``no-store`` are not cached.
+        - The upstream response is left untouched when it is not cached, so it can be streamed as usual.
+
+    Args:
+        request: The incoming request object.
+        server_response: Response object from the upstream server, sent with ``stream=True``.
+
+    Returns:
+        Response:
+        Returns the response from the cache, if the upstream response was cached or revalidated.
+    """
+    path = request.url.path
+    if server_response.status_code == HTTPStatus.NOT_MODIFIED.value:
+        if entry := store.get(path):
+            await server_response.aclose()
+            entry.refresh()
+            LOGGER.debug("Revalidated %s in static cache", path)
+            return entry.respond(request)
+        return
+    cache_control = server_response.headers.get("cache-control", "").lower()
+    if (
+        server_response.status_code != HTTPStatus.OK.value
+        or "no-store" in cache_control
+        or "private" in cache_control
+        or "set-cookie" in server_response.headers
+        or "content-encoding" in server_response.headers
+        or not server_response.headers.get("content-length", "").isdigit()
+        or int(server_response.headers["content-length"])
+        > settings.env_config.static_cache.max_entry_size
+    ):
+        return
+    try:
+        body = await server_response.aread()
+    finally:
+        await server_response.aclose()
+    # Upstream servers without an ETag send the full body on every revalidation, which is mostly unchanged
+    if (entry := store.get(path)) and entry.variants["identity"] == body:
+        entry.refresh()
+        LOGGER.debug("Revalidated %s in static cache, with an unchanged body", path)
+        return entry.respond(request)
+    # Compression is CPU bound, so it runs in a thread to keep the event loop serving the other requests
+    variants = await asyncio.to_thread(
+        compress, body, server_response.headers.get("content-type", "")
+    )
+    entry = Entry(server_response, body, variants)
+    store.put(path, entry)
+    LOGGER.debug(
+        "Cached %s [%s] in static cache, %d bytes in use",
+        path,
+        ", ".join(entry.variants),
+        store.size,
+    )
+    return entry.respond(request)
+
+
+# Validators of the API responses, keyed on the auth scope and the URL
+validators = state.TTLCache(
+    maxsize=settings.env_config.validator_cache.max_entries,
+    ttl=settings.env_config.validator_cache.ttl,
+)
+
+
+def validatable(request: Request) -> bool:
+    """Checks if a request is for a file, a preview or a directory listing, whose validators can be cached.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the validators of the response can be cached.
+    """
+    return (
+        validators.ttl > 0
+        and request.method == "GET"
+        and request.url.path.startswith(VALIDATED_ROUTES)
+        and "range" not in request.headers
+    )
+
+
+def validator_key(request: Request) -> Tuple[str, str, str]:
+    """Gets the key for the validators of a request, scoped to the session that made the request.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        Tuple[str, str, str]:
+        Returns a tuple of the auth scope, path and query string.
+    """
+    return squire.auth_scope(request), request.url.path, request.url.query
+
+
+async def tag(request: Request, response: httpx.Response) -> None:
+    """Gives a directory listing, which has no validators, a strong ``ETag`` from the hash of its body.
+
+    See Also:
+        - The body is read into memory, since the ``ETag`` has to be sent before the body.
+        - Bodies that are larger than ``max_listing_size`` are not tagged, and are streamed as usual.
+
+    Args:
+        request: The incoming request object.
+        response: Response object from the upstream server, sent with ``stream=True``.
+    """
+    headers = response.headers
+    if (
+        not request.url.path.startswith(LISTING_ROUTES)
+        or response.status_code != HTTPStatus.OK.value
+        or "etag" in headers
+        or "last-modified" in headers
+        or "content-encoding" in headers
+        or not settings.env_config.validator_cache.max_listing_size
+    ):
+        return
+    body = await upstream.buffer(
+        response, settings.env_config.validator_cache.max_listing_size
+    )
+    if body is not None:
+        headers["etag"] = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def remember(
+    request: Request, response: httpx.Response
+) -> Tuple[str | None, str | None]:
+    """Stores the validators of an upstream response, that was fetched with ``GET``.
+
+    Args:
+        request: The incoming request object.
+        response: Response object from the upstream server.
+
+    Returns:
+        Tuple[str | None, str | None]:
+        Returns a tuple of the ``ETag`` and ``Last-Modified`` headers, that are ``None`` if the response has none.
+    """
+    if response.status_code in (HTTPStatus.OK.value, HTTPStatus.NOT_MODIFIED.value):
+        validator = response.headers.get("etag"), response.headers.get("last-modified")
+    else:
+        # Remembers the absence of validators as well, so the upstream server isn't asked again within the ttl
+        validator = None, None
+    validators.set(validator_key(request), validator)
+    return validator
+
+
+def not_modified(request: Request, etag: str | None, last_modified: str | None) -> bool:
+    """Evaluates the conditional headers of a request against the validators.
+
+    See Also:
+        ``If-Modified-Since`` is evaluated only when ``If-None-Match`` is absent, as per RFC 9110.
+
+    Args:
+        request: The incoming request object.
+        etag: ``ETag`` of the resource.
+        last_modified: ``Last-Modified`` of the resource.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the client's copy is up-to-date.
+    """
+    if if_none_match := request.headers.get("if-none-match"):
+        return bool(etag) and etag.removeprefix("W/") in (
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        )
+    if (
+        if_modified_since := request.headers.get("if-modified-since")
+    ) and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+                if_modified_since
+            )
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def revalidate(request: Request) -> Response | None:
+    """Answers a conditional request locally, using the cached validators.
+
+    See Also:
+        - Validators are learnt from the ``GET`` responses, so a request without them is sent to the upstream server.
+        - The ``ETag`` is echoed in the weak form, when the client holds the one weakened by the compression.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        Response:
+        Returns a ``304`` response, if the client's copy is up-to-date.
+    """
+    if (
+        "if-none-match" not in request.headers
+        and "if-modified-since" not in request.headers
+    ) or (validator := validators.get(validator_key(request))) is None:
+        return
+    etag, last_modified = validator
+    if not_modified(request, etag, last_modified):
+        if (
+            etag
+            and not etag.startswith("W/")
+            and f"W/{etag}"
+            in (
+                tag.strip()
+                for tag in request.headers.get("if-none-match", "").split(",")
+            )
+        ):
+            etag = f"W/{etag}"
+        return Response(
+            status_code=HTTPStatus.NOT_MODIFIED.value,
+            headers={
+                key: value
+                for key, value in (("etag", etag), ("last-modified", last_modified))
+                if value
+            },
+        )
+
+
+def invalidate(request: Request) -> None:
+    """Clears the cached validators when a request may modify the files.
+
+    See Also:
+        - A change to a file also changes the listing of its parent directories, so all the validators are cleared.
+        - Validators cached by the other workers expire within the ttl.
+
+    Args:
+        request: The incoming request object.
+    """
+    if (
+        request.method in UNSAFE_METHODS
+        and request.url.path.startswith("/api/")
+        and len(validators)
+    ):
+        validators.clear()
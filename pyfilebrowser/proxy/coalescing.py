@@ -0,0 +1,330 @@
+"""Module to coalesce the identical requests that are in flight at the same time, into a single upstream request.
+
+>>> Coalescing
+
+"""
+
+import asyncio
+import contextlib
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Set, Tuple
+
+import httpx
+from fastapi import Request
+
+from pyfilebrowser.proxy import settings, squire
+
+LOGGER = logging.getLogger("proxy")
+# Read-only routes that are requested by many clients at once, and whose responses depend only on the URL and session
+COALESCED_ROUTES = ("/api/resources/", "/api/preview/", "/static/")
+# Request headers that make a response specific to the client, which must not be shared with the other clients
+EXCLUSIVE_HEADERS = ("range", "if-none-match", "if-modified-since")
+# Request headers that a shared response may vary on, since they are part of the key
+KEYED_HEADERS = ("accept-encoding",)
+# Maximum number of chunks that a follower may lag behind the leader, before the leader waits for it
+BACKLOG = 16
+
+
+class Stats:
+    """Counters of the coalesced requests in the current worker.
+
+    >>> Stats
+
+    See Also:
+        - **leaders** - Requests that were sent to the upstream server.
+        - **followers** - Requests that waited on an identical request in flight.
+        - **fallbacks** - Followers that were sent to the upstream server, as the response could not be shared.
+    """
+
+    def __init__(self):
+        """Instantiates the object with the counters set to zero."""
+        self.leaders = 0
+        self.followers = 0
+        self.fallbacks = 0
+
+    @property
+    def ratio(self) -> float:
+        """Fraction of the coalescible requests that were answered without an upstream request of their own."""
+        total = self.leaders + self.followers
+        return (self.followers - self.fallbacks) / total if total else 0.0
+
+
+# Key of the requests, as a tuple of the auth scope, path, query string and the normalized accept-encoding
+Key = Tuple[str, str, str, str]
+# Requests in flight, keyed on the auth scope, the URL and the accepted encodings
+flights: Dict[Key, "Flight"] = {}
+# Leaders' streams that are read to the end for the followers, after the leader's client stopped reading
+drains: Set[asyncio.Task] = set()
+stats = Stats()
+
+
+class Flight:
+    """Upstream request in flight, whose response is teed to the identical requests that joined it.
+
+    >>> Flight
+
+    See Also:
+        - Followers join while the leader waits for the response headers, so they receive the body from its start.
+        - Each follower has a bounded backlog, so the leader is paced by the slowest follower instead of buffering.
+    """
+
+    def __init__(self, key: Key):
+        """Instantiates the object.
+
+        Args:
+            key: Key of the identical requests.
+        """
+        self.key = key
+        # Status code and raw headers of the response, the error from the upstream server, or None if it isn't shared
+        self.response: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.followers: List[asyncio.Queue] = []
+
+    def join(self) -> asyncio.Queue:
+        """Attaches a follower to the flight.
+
+        Returns:
+            asyncio.Queue:
+            Returns the queue that the chunks of the response are teed into.
+        """
+        queue = asyncio.Queue(maxsize=BACKLOG)
+        self.followers.append(queue)
+        return queue
+
+    def leave(self, queue: asyncio.Queue) -> None:
+        """Detaches a follower, and discards its backlog so that the leader is never blocked on it.
+
+        Args:
+            queue: Queue of the follower, from ``join``
+        """
+        with contextlib.suppress(ValueError):
+            self.followers.remove(queue)
+        while not queue.empty():
+            queue.get_nowait()
+
+    def land(self) -> None:
+        """Stops the identical requests from joining the flight, once the response headers are received."""
+        if flights.get(self.key) is self:
+            del flights[self.key]
+
+    async def publish(self, chunk: bytes | Exception | None) -> None:
+        """Tees a chunk of the response to the followers.
+
+        Args:
+            chunk: Chunk of the body, the error that interrupted it, or ``None`` at the end of the body.
+        """
+        for queue in list(self.followers):
+            await queue.put(chunk)
+
+
+class TeeStream(httpx.AsyncByteStream):
+    """Leader's response stream, that tees each chunk to the followers as the leader's client reads it.
+
+    >>> TeeStream
+
+    """
+
+    def __init__(self, flight: Flight, stream: httpx.AsyncByteStream):
+        """Instantiates the object.
+
+        Args:
+            flight: Flight that the followers joined.
+            stream: Original response stream.
+        """
+        self.flight = flight
+        self.stream = stream
+        self.iterator = aiter(stream)
+        self.finished = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Iterates over the original response stream, teeing each chunk before it is yielded."""
+        try:
+            async for chunk in self.iterator:
+                await self.flight.publish(chunk)
+                yield chunk
+        except httpx.HTTPError as error:
+            self.finished = True
+            await self.flight.publish(error)
+            raise
+        self.finished = True
+        await self.flight.publish(None)
+
+    async def drain(self) -> None:
+        """Reads the rest of the body for the followers, after the leader's client stopped reading it."""
+        try:
+            async for chunk in self.iterator:
+                if not self.flight.followers:
+                    return
+                await self.flight.publish(chunk)
+            await self.flight.publish(None)
+        except httpx.HTTPError as error:
+            await self.flight.publish(error)
+        finally:
+            await self.stream.aclose()
+
+    async def aclose(self) -> None:
+        """Closes the original response stream, unless the followers are still reading it."""
+        if self.finished or not self.flight.followers:
+            await self.stream.aclose()
+            return
+        # Runs in its own task, since the leader may be closing the stream from a cancelled task
+        task = asyncio.create_task(self.drain())
+        drains.add(task)
+        task.add_done_callback(drains.discard)
+
+
+class FollowerStream(httpx.AsyncByteStream):
+    """Follower's response stream, that reads the chunks teed by the leader.
+
+    >>> FollowerStream
+
+    """
+
+    def __init__(self, flight: Flight, queue: asyncio.Queue):
+        """Instantiates the object.
+
+        Args:
+            flight: Flight that the follower joined.
+            queue: Queue of the follower, from ``Flight.join``
+        """
+        self.flight = flight
+        self.queue = queue
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Iterates over the chunks teed by the leader, until the end of the body."""
+        while (chunk := await self.queue.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    async def aclose(self) -> None:
+        """Detaches the follower from the flight."""
+        self.flight.leave(self.queue)
+
+
+def flight_key(request: Request) -> Key | None:
+    """Gets the key to coalesce a request on, if the request can share its response with identical requests.
+
+    See Also:
+        ``accept-encoding`` is part of the key, since it is forwarded upstream and decides the encoding of the response.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        Key:
+        Returns a tuple of the auth scope, path, query string and the accepted encodings, or ``None`` if the request
+        cannot be coalesced.
+    """
+    if (
+        settings.env_config.coalescing.max_size
+        and request.method == "GET"
+        and request.url.path.startswith(COALESCED_ROUTES)
+        and not any(header in request.headers for header in EXCLUSIVE_HEADERS)
+    ):
+        return (
+            squire.auth_scope(request),
+            request.url.path,
+            request.url.query,
+            normalize(request.headers.get("accept-encoding", "")),
+        )
+
+
+def normalize(accept_encoding: str) -> str:
+    """Normalizes the ``accept-encoding`` header, so that the browsers' variations of the same value share a key.
+
+    Args:
+        accept_encoding: Raw ``accept-encoding`` header from the request.
+
+    Returns:
+        str:
+        Returns the codings in lowercase without whitespace, in sorted order.
+    """
+    return ",".join(
+        sorted(
+            coding
+            for coding in accept_encoding.lower().replace(" ", "").split(",")
+            if coding
+        )
+    )
+
+
+def shareable(response: httpx.Response) -> bool:
+    """Checks if a response can be teed to the identical requests.
+
+    See Also:
+        Responses that vary on the request headers outside the key, or that are larger than ``max_size`` are not shared.
+
+    Args:
+        response: Response object from the upstream server.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the response can be shared with the identical requests.
+    """
+    return (
+        not response.is_stream_consumed
+        and int(response.headers.get("content-length") or 0)
+        <= settings.env_config.coalescing.max_size
+        and all(
+            field.strip().lower() in KEYED_HEADERS
+            for field in response.headers.get("vary", "").split(",")
+            if field.strip()
+        )
+    )
+
+
+async def fetch(
+    key: Key, send: Callable[[], Awaitable[httpx.Response]]
+) -> httpx.Response:
+    """Sends a request to the upstream server, unless an identical request is already in flight.
+
+    See Also:
+        - The first request is sent upstream, and its response is teed to the identical requests that arrive before
+          the response headers. The first request's client is never held back, unless a follower lags behind.
+        - Errors from the upstream server are shared as well, so that a struggling server isn't hit by all of them.
+        - Followers send their own request, when the response is too large to share or the first request was cancelled.
+
+    Args:
+        key: Key of the request, from ``flight_key``.
+        send: Function to send the request to the upstream server.
+
+    Returns:
+        httpx.Response:
+        Returns the response object from the upstream server, or a response that reads the teed chunks.
+    """
+    if (flight := flights.get(key)) is not None:
+        stats.followers += 1
+        queue = flight.join()
+        # Shielded, so that a client disconnecting doesn't cancel the flight for everyone else
+        try:
+            response = await asyncio.shield(flight.response)
+        except BaseException:
+            flight.leave(queue)
+            raise
+        if isinstance(response, httpx.RequestError):
+            flight.leave(queue)
+            raise response
+        if response is not None:
+            status_code, headers = response
+            return httpx.Response(
+                status_code, headers=headers, stream=FollowerStream(flight, queue)
+            )
+        flight.leave(queue)
+        stats.fallbacks += 1
+        return await send()
+    flight = Flight(key)
+    flights[key] = flight
+    stats.leaders += 1
+    try:
+        response = await send()
+        if shareable(response):
+            response.stream = TeeStream(flight, response.stream)
+            flight.response.set_result((response.status_code, response.headers.raw))
+        return response
+    except httpx.RequestError as error:
+        flight.response.set_result(error)
+        raise
+    finally:
+        if not flight.response.done():
+            flight.response.set_result(None)
+        flight.land()
@@ -0,0 +1,241 @@
+"""Module to compress the responses on-the-fly, while they are streamed to the client.
+
+>>> Compression
+
+"""
+
+import asyncio
+import zlib
+from http import HTTPStatus
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Tuple
+
+import httpx
+from fastapi import Request
+
+from pyfilebrowser.proxy import settings, squire
+
+# Size in bytes of the batches that the chunks are coalesced into, before they are compressed in a thread
+BATCH_SIZE = 65_536
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipEncoder:
+    """Streaming encoder for ``gzip`` content-coding.
+
+    >>> GzipEncoder
+
+    """
+
+    def __init__(self):
+        """Instantiates the object with a compressor, that writes the gzip header and trailer."""
+        self.compressor = zlib.compressobj(
+            settings.env_config.compression.gzip_level,
+            zlib.DEFLATED,
+            16 + zlib.MAX_WBITS,
+        )
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compresses a chunk, and returns the compressed data that is ready so far."""
+        return self.compressor.compress(chunk)
+
+    def flush(self) -> bytes:
+        """Returns the remaining compressed data, and finishes the stream."""
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    """Streaming encoder for ``br`` content-coding.
+
+    >>> BrotliEncoder
+
+    """
+
+    def __init__(self):
+        """Instantiates the object with a compressor."""
+        self.compressor = brotli.Compressor(
+            quality=settings.env_config.compression.brotli_quality
+        )
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compresses a chunk, and returns the compressed data that is ready so far."""
+        return self.compressor.process(chunk)
+
+    def flush(self) -> bytes:
+        """Returns the remaining compressed data, and finishes the stream."""
+        return self.compressor.finish()
+
+
+class ZstdEncoder:
+    """Streaming encoder for ``zstd`` content-coding.
+
+    >>> ZstdEncoder
+
+    """
+
+    def __init__(self):
+        """Instantiates the object with a compressor."""
+        self.compressor = zstandard.ZstdCompressor(
+            level=settings.env_config.compression.zstd_level
+        ).compressobj()
+
+    def compress(self, chunk: bytes) -> bytes:
+        """Compresses a chunk, and returns the compressed data that is ready so far."""
+        return self.compressor.compress(chunk)
+
+    def flush(self) -> bytes:
+        """Returns the remaining compressed data, and finishes the stream."""
+        return self.compressor.flush()
+
+
+ENCODERS: Dict[str, Callable[[], GzipEncoder | BrotliEncoder | ZstdEncoder]] = {
+    settings.Encoding.gzip: GzipEncoder,
+    settings.Encoding.br: BrotliEncoder,
+    settings.Encoding.zstd: ZstdEncoder,
+}
+# Content-codings that are configured, and whose packages are installed
+AVAILABLE = tuple(
+    str(encoding)
+    for encoding in settings.env_config.compression.encodings
+    if (encoding != settings.Encoding.br or brotli)
+    and (encoding != settings.Encoding.zstd or zstandard)
+)
+
+
+def negotiate(request: Request, server_response: httpx.Response) -> str | None:
+    """Decides if a response should be compressed, and with which content-coding.
+
+    See Also:
+        - Only complete (``200``) responses with a compressible media type, and of at least ``min_size`` are compressed.
+        - Responses that are already encoded, or that support byte ranges are forwarded as-is.
+
+    Args:
+        request: The incoming request object.
+        server_response: Response object from the upstream server.
+
+    Returns:
+        str:
+        Returns the negotiated content-coding, or ``None`` when the response should not be compressed.
+    """
+    headers = server_response.headers
+    if (
+        not AVAILABLE
+        or request.method == "HEAD"
+        or server_response.status_code != HTTPStatus.OK.value
+        or "content-encoding" in headers
+        or headers.get("accept-ranges", "none") != "none"
+        or not headers.get("content-type", "").startswith(settings.COMPRESSIBLE_TYPES)
+        or int(
+            headers.get("content-length") or settings.env_config.compression.min_size
+        )
+        < settings.env_config.compression.min_size
+    ):
+        return
+    return squire.negotiate_encoding(
+        request.headers.get("accept-encoding", ""), AVAILABLE
+    )
+
+
+async def compress(
+    content: AsyncGenerator[bytes, None], encoding: str
+) -> AsyncIterator[bytes]:
+    """Compresses a stream of chunks.
+
+    See Also:
+        - Chunks are coalesced into batches of ``BATCH_SIZE``, so that the encoder isn't called for every small chunk.
+        - Batches are compressed in a thread, since a multi-MB listing takes tens of milliseconds to compress.
+        - Responses smaller than a batch are compressed within the event loop, where a thread would cost more.
+
+    Args:
+        content: Stream of chunks to compress.
+        encoding: Content-coding to compress with.
+
+    Yields:
+        bytes:
+        Yields the compressed chunks.
+    """
+    encoder = ENCODERS[encoding]()
+    chunks = []
+    size = 0
+    batched = False
+    try:
+        async for chunk in content:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= BATCH_SIZE:
+                batched = True
+                batch = b"".join(chunks)
+                chunks.clear()
+                size = 0
+                if compressed := await asyncio.to_thread(encoder.compress, batch):
+                    yield compressed
+        # The encoder holds back the data of the previous batches until it is flushed
+        if batched:
+            yield await asyncio.to_thread(finish, encoder, b"".join(chunks))
+        else:
+            yield finish(encoder, b"".join(chunks))
+    finally:
+        # Closes the upstream stream as well, when the client disconnects mid-stream
+        await content.aclose()
+
+
+def finish(encoder: GzipEncoder | BrotliEncoder | ZstdEncoder, chunk: bytes) -> bytes:
+    """Compresses the last chunk, and finishes the stream.
+
+    Args:
+        encoder: Encoder of the stream.
+        chunk: Last chunk of the stream, which may be empty.
+
+    Returns:
+        bytes:
+        Returns the remaining compressed data.
+    """
+    return encoder.compress(chunk) + encoder.flush()
+
+
+def encode_headers(
+    headers: List[Tuple[bytes, bytes]], encoding: str
+) -> List[Tuple[bytes, bytes]]:
+    """Adjusts the response headers for a compressed body.
+
+    See Also:
+        - ``content-length`` is dropped, since the compressed size is unknown until the stream ends.
+        - A strong ``etag`` is weakened, since the compressed bytes differ from the upstream representation.
+        - ``accept-encoding`` is merged into the upstream's ``vary``, unless it is already listed.
+
+    Args:
+        headers: Raw response headers, with lowercase names.
+        encoding: Content-coding the body is compressed with.
+
+    Returns:
+        List[Tuple[bytes, bytes]]:
+        Returns the raw response headers for the compressed body.
+    """
+    varied = {
+        field.strip().lower()
+        for key, value in headers
+        if key == b"vary"
+        for field in value.split(b",")
+    }
+    vary = not varied & {b"accept-encoding", b"*"}
+    encoded = [(b"content-encoding", encoding.encode())]
+    for key, value in headers:
+        if key == b"content-length":
+            continue
+        if key == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        if key == b"vary" and vary:
+            value += b", accept-encoding"
+            vary = False
+        encoded.append((key, value))
+    if vary:
+        encoded.append((b"vary", b"accept-encoding"))
+    return encoded
@@ -4,13 +4,23 @@
 
 """
 
+import asyncio
+import logging
+import queue
 import sqlite3
-from typing import List, Tuple
+import threading
+import time
+from functools import cached_property
+from typing import Dict, List, Tuple
 
 from pydantic import FilePath
 
 from pyfilebrowser.proxy import settings
 
+LOGGER = logging.getLogger("proxy")
+# Time in seconds between the refreshes of the ban table from the database, to pick up the other workers' changes
+REFRESH_INTERVAL = 2
+
 
 class Database:
     """Creates a connection to the Database using sqlite3.
@@ -20,15 +30,27 @@ class Database:
     """
 
     def __init__(self, datastore: FilePath | str, timeout: int = 10):
-        """Instantiates the class ``Database`` to create a connection and a cursor.
+        """Instantiates the class ``Database`` to connect lazily, so that importing the module creates no files.
 
         Args:
             datastore: Name of the database file.
             timeout: Timeout for the connection to database.
         """
-        self.connection = sqlite3.connect(
-            database=datastore, check_same_thread=False, timeout=timeout
+        self.lock = threading.Lock()
+        self.datastore = datastore
+        self.timeout = timeout
+
+    @cached_property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database, that is created on first use."""
+        connection = sqlite3.connect(
+            database=self.datastore, check_same_thread=False, timeout=self.timeout
         )
+        with connection:
+            # WAL mode allows the workers to read, while another one is writing
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
 
     def create_table(self, table_name: str, columns: List[str] | Tuple[str]) -> None:
         """Creates the table with the required columns.
@@ -37,7 +59,7 @@ class Database:
             table_name: Name of the table that has to be created.
             columns: List of columns that has to be created.
         """
-        with self.connection:
+        with self.lock, self.connection:
             cursor = self.connection.cursor()
             # Use f-string or %s as table names cannot be parametrized
             cursor.execute(
@@ -46,12 +68,102 @@ class Database:
 
 
 database = Database(settings.env_config.database)
-database.create_table("auth_errors", ["host", "block_until"])
+
+# In-memory ban table, that serves all the lookups on the hot path
+bans: Dict[str, int] = {}
+# Bans (and unbans, as None) made by this worker, that the database is yet to agree with
+pending: Dict[str, int | None] = {}
+# Queue of pending writes, that are written through to the database by a background thread
+writes: queue.Queue[Tuple[str, Tuple] | None] = queue.Queue()
+
+
+def write_through() -> None:
+    """Writes the queued statements to the database, until a ``None`` is received."""
+    while (task := writes.get()) is not None:
+        statement, parameters = task
+        try:
+            with database.lock, database.connection:
+                database.connection.execute(statement, parameters)
+        except sqlite3.Error as error:
+            LOGGER.error("Failed to write to auth database: %s", error)
+
+
+def start() -> threading.Thread:
+    """Creates the table, loads the unexpired bans from the database, and starts the background writer.
+
+    Returns:
+        threading.Thread:
+        Returns the writer thread.
+    """
+    database.create_table(
+        "auth_errors", ["host TEXT PRIMARY KEY", "block_until INTEGER NOT NULL"]
+    )
+    records = load()
+    bans.update(records)
+    LOGGER.debug("Loaded %d ban(s) from auth database", len(records))
+    writer = threading.Thread(target=write_through, daemon=True)
+    writer.start()
+    return writer
+
+
+def stop(writer: threading.Thread) -> None:
+    """Flushes the pending writes and stops the background writer.
+
+    Args:
+        writer: Writer thread returned by ``start``
+    """
+    writes.put(None)
+    writer.join(timeout=5)
+
+
+def load() -> Dict[str, int]:
+    """Loads the unexpired bans from the database.
+
+    Returns:
+        Dict[str, int]:
+        Returns the epoch time until when each host address should be blocked.
+    """
+    with database.lock:
+        return dict(
+            database.connection.execute(
+                "SELECT host, block_until FROM auth_errors WHERE block_until > (?)",
+                (int(time.time()),),
+            ).fetchall()
+        )
+
+
+async def refresh() -> None:
+    """Refreshes the ban table from the database at regular intervals, until cancelled.
+
+    See Also:
+        - The database is read in a thread, so that the event loop never waits on it.
+        - Changes made by this worker are kept over the database, until they are written through.
+    """
+    while True:
+        await asyncio.sleep(REFRESH_INTERVAL)
+        try:
+            records = await asyncio.to_thread(load)
+        except sqlite3.Error as error:
+            LOGGER.error("Failed to refresh the bans from auth database: %s", error)
+            continue
+        for host, block_until in list(pending.items()):
+            if records.get(host) == block_until:
+                pending.pop(host, None)
+            elif block_until is None:
+                records.pop(host, None)
+            else:
+                records[host] = block_until
+        bans.clear()
+        bans.update(records)
 
 
 def get_record(host: str) -> int | None:
     """Gets blocked epoch time for a particular host.
 
+    See Also:
+        - Looks up only the in-memory ban table, so that the hot path never waits on the database.
+        - Bans made by other workers are picked up by the background refresh of the ban table.
+
     Args:
         host: Host address.
 
@@ -59,29 +171,38 @@ def get_record(host: str) -> int | None:
         int:
         Returns the epoch time until when the host address should be blocked.
     """
-    with database.connection:
-        cursor = database.connection.cursor()
-        state = cursor.execute(
-            "SELECT block_until FROM auth_errors WHERE host=(?)", (host,)
-        ).fetchone()
-    if state and state[0]:
-        return state[0]
+    return bans.get(host)
+
+
+def forbidden(host: str) -> int | None:
+    """Checks if a host is forbidden due to repeated login failures.
+
+    Args:
+        host: Host address.
+
+    Returns:
+        int:
+        Returns the epoch time until when the host address is forbidden, if it is forbidden right now.
+    """
+    if (block_until := get_record(host)) and block_until > time.time():
+        return block_until
 
 
 def put_record(host: str, block_until: int) -> None:
-    """Inserts blocked epoch time for a particular host.
+    """Inserts or updates blocked epoch time for a particular host.
 
     Args:
         host: Host address.
         block_until: Epoch time until when the host address should be blocked.
     """
-    with database.connection:
-        cursor = database.connection.cursor()
-        cursor.execute(
-            "INSERT INTO auth_errors (host, block_until) VALUES (?,?)",
+    bans[host] = pending[host] = block_until
+    writes.put(
+        (
+            "INSERT INTO auth_errors (host, block_until) VALUES (?,?) "
+            "ON CONFLICT (host) DO UPDATE SET block_until = excluded.block_until",
             (host, block_until),
         )
-        database.connection.commit()
+    )
 
 
 def remove_record(host: str) -> None:
@@ -90,7 +211,28 @@ def remove_record(host: str) -> None:
     Args:
         host: Host address.
     """
-    with database.connection:
-        cursor = database.connection.cursor()
-        cursor.execute("DELETE FROM auth_errors WHERE host=(?)", (host,))
-        database.connection.commit()
+    bans.pop(host, None)
+    pending[host] = None
+    writes.put(("DELETE FROM auth_errors WHERE host=(?)", (host,)))
+
+
+def purge() -> None:
+    """Removes the expired bans from the in-memory ban table and the database.
+
+    See Also:
+        Triggered repeatedly at given intervals as a background task.
+    """
+    now = int(time.time())
+    # Snapshot of the ban table, since the request handlers may modify it while this runs in the timer's thread
+    for host in [
+        host for host, block_until in list(bans.items()) if block_until <= now
+    ]:
+        bans.pop(host, None)
+    # Bans that expired before they were written through, are of no use to keep over the database
+    for host in [
+        host
+        for host, block_until in list(pending.items())
+        if block_until and block_until <= now
+    ]:
+        pending.pop(host, None)
+    writes.put(("DELETE FROM auth_errors WHERE block_until <= (?)", (now,)))
@@ -0,0 +1,148 @@
+"""Module for the proxy server's firewall, that matches the request's host against the allowed origins.
+
+>>> Firewall
+
+"""
+
+import functools
+import ipaddress
+from typing import Dict, FrozenSet, Iterable, Set
+
+from pyfilebrowser.proxy import settings
+
+# Marks the end of a wildcard's suffix in the trie, since a hostname label can never be empty
+TERMINAL = ""
+
+
+def is_rule(origin: str) -> bool:
+    """Checks if an origin is a wildcard or a CIDR range, instead of an exact hostname.
+
+    Args:
+        origin: Origin as validated by the env config.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the origin is a rule.
+    """
+    return origin.startswith("*.") or "/" in origin
+
+
+def allowed_origins() -> FrozenSet[str]:
+    """Gathers the exact hostnames that are allowed, including the host's own addresses.
+
+    Returns:
+        FrozenSet[str]:
+        Returns an immutable snapshot of the allowed hostnames.
+    """
+    return frozenset(
+        origin for origin in settings.env_config.origins if not is_rule(origin)
+    ) | frozenset(settings.allowance())
+
+
+class Matcher:
+    """Compiled matcher for the wildcard and CIDR origins.
+
+    >>> Matcher
+
+    See Also:
+        - Wildcards are stored in a trie of reversed hostname labels, so a lookup walks one label at a time.
+        - CIDR ranges are grouped by prefix length, so a lookup is one masked hash lookup per distinct length.
+        - Recent decisions are cached, so repeated requests from the same host skip the lookup altogether.
+    """
+
+    def __init__(self, rules: Iterable[str], cache_size: int = 4096):
+        """Instantiates the object to compile the rules.
+
+        Args:
+            rules: Wildcards like ``*.example.com`` and CIDR ranges like ``10.0.0.0/8``
+            cache_size: Maximum number of decisions to cache.
+        """
+        self.rules = tuple(rules)
+        self.suffixes: Dict[str, dict] = {}
+        self.networks: Dict[int, Dict[int, Set[int]]] = {4: {}, 6: {}}
+        for rule in self.rules:
+            if rule.startswith("*."):
+                node = self.suffixes
+                for label in reversed(rule[2:].split(".")):
+                    node = node.setdefault(label, {})
+                node[TERMINAL] = {}
+            else:
+                network = ipaddress.ip_network(rule)
+                self.networks[network.version].setdefault(network.prefixlen, set()).add(
+                    int(network.network_address)
+                    >> (network.max_prefixlen - network.prefixlen)
+                )
+        self.allowed = functools.lru_cache(maxsize=cache_size)(self.match)
+
+    def __bool__(self) -> bool:
+        """Checks if there are any rules to match against."""
+        return bool(self.rules)
+
+    def match_suffix(self, hostname: str) -> bool:
+        """Checks if a hostname is a subdomain of any of the wildcards.
+
+        Args:
+            hostname: Hostname to match.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the hostname matches.
+        """
+        node = self.suffixes
+        for label in reversed(hostname.split(".")):
+            if TERMINAL in node:
+                return True
+            if (node := node.get(label)) is None:
+                return False
+        return False
+
+    def match_network(self, hostname: str) -> bool:
+        """Checks if a hostname is an IP address within any of the CIDR ranges.
+
+        Args:
+            hostname: Hostname to match.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the hostname matches.
+        """
+        try:
+            address = ipaddress.ip_address(hostname)
+        except ValueError:
+            return False
+        value = int(address)
+        return any(
+            value >> (address.max_prefixlen - prefixlen) in networks
+            for prefixlen, networks in self.networks[address.version].items()
+        )
+
+    def match(self, hostname: str) -> bool:
+        """Checks if a hostname matches any of the rules.
+
+        Args:
+            hostname: Hostname to match.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the hostname is allowed.
+        """
+        hostname = hostname.lower().rstrip(".")
+        return self.match_suffix(hostname) or self.match_network(hostname)
+
+
+matcher = Matcher(filter(is_rule, settings.env_config.origins))
+
+
+def allowed(hostname: str) -> bool:
+    """Checks if a hostname is allowed, either as an exact origin or through the rules.
+
+    Args:
+        hostname: Hostname of the request's base URL.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate if the hostname is allowed.
+    """
+    return hostname in settings.session.allowed_origins or bool(
+        matcher and matcher.allowed(hostname)
+    )
@@ -1,18 +1,32 @@
-import difflib
+import functools
 import logging
+import math
 import time
 from datetime import datetime, timedelta
 from http import HTTPStatus
+from typing import AsyncIterator, Dict
 
 import httpx
 from fastapi import HTTPException, Request, Response
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from starlette.datastructures import Headers
 
-from pyfilebrowser.proxy import database, settings, squire, templates
+from pyfilebrowser.proxy import (
+    cache,
+    coalescing,
+    compression,
+    database,
+    firewall,
+    metrics,
+    settings,
+    squire,
+    state,
+    templates,
+    timing,
+    upstream,
+)
 
 LOGGER = logging.getLogger("proxy")
-CLIENT = httpx.Client()
-DIFFER = difflib.Differ()
 
 epoch = lambda: int(time.time())  # noqa: E731
 
@@ -26,23 +40,12 @@ def refresh_allowed_origins() -> None:
         - | The background task runs only when the env vars, ``private_ip`` or ``public_ip`` is set to True,
           | as they are the only dynamic values.
     """
-    allowed_origins = set()
-    allowed_origins.update(settings.env_config.origins)
-    allowed_origins.update(settings.allowance())
-
-    # Extract elements that are only in one of the sets
-    if difference := [
-        item
-        for item in list(
-            DIFFER.compare(
-                sorted(settings.session.allowed_origins), sorted(allowed_origins)
-            )
-        )
-        if item.startswith("- ") or item.startswith("+ ")
-    ]:
-        LOGGER.warning("Changes in allowed origins: %s", difference)
-
-    settings.session.allowed_origins.clear()
+    allowed_origins = firewall.allowed_origins()
+    if added := allowed_origins - settings.session.allowed_origins:
+        LOGGER.warning("Origins added to the allowed origins: %s", sorted(added))
+    if removed := settings.session.allowed_origins - allowed_origins:
+        LOGGER.warning("Origins removed from the allowed origins: %s", sorted(removed))
+    # A single rebind is atomic, so the request handlers see either the old or the new snapshot, never an empty one
     settings.session.allowed_origins = allowed_origins
     LOGGER.debug(
         "Refreshed allowed origins. Next refresh - %s",
@@ -75,41 +78,82 @@ async def handle_auth_error(request: Request) -> None:
     Args:
         request: The incoming request object.
     """
-    if settings.session.auth_counter.get(request.client.host):
-        settings.session.auth_counter[request.client.host] += 1
+    # Auth counter is retained for 1 month or until the server restarts
+    attempt = state.store.increment("auth_counter", request.client.host, 2_592_000)
+    LOGGER.warning("Failed auth, attempt #%d for %s", attempt, request.client.host)
+    if attempt >= 10:
+        # Block the host address for 1 month or until the server restarts
+        until = epoch() + 2_592_000
         LOGGER.warning(
-            "Failed auth, attempt #%d for %s",
-            settings.session.auth_counter[request.client.host],
+            "%s is blocked until %s",
             request.client.host,
+            datetime.fromtimestamp(until).strftime("%c"),
+        )
+    elif attempt > 3:
+        # Allows up to 3 failed login attempts
+        minutes = await incrementer(attempt)
+        until = epoch() + minutes * 60
+        LOGGER.warning(
+            "%s is blocked (for %d minutes) until %s",
+            request.client.host,
+            minutes,
+            datetime.fromtimestamp(until).strftime("%c"),
         )
-        if settings.session.auth_counter[request.client.host] >= 10:
-            # Block the host address for 1 month or until the server restarts
-            until = epoch() + 2_592_000
-            LOGGER.warning(
-                "%s is blocked until %s",
-                request.client.host,
-                datetime.fromtimestamp(until).strftime("%c"),
-            )
-            database.remove_record(request.client.host)
-            database.put_record(request.client.host, until)
-        elif settings.session.auth_counter[request.client.host] > 3:
-            # Allows up to 3 failed login attempts
-            settings.session.forbid.add(request.client.host)
-            minutes = await incrementer(
-                settings.session.auth_counter[request.client.host]
-            )
-            until = epoch() + minutes * 60
-            LOGGER.warning(
-                "%s is blocked (for %d minutes) until %s",
-                request.client.host,
-                minutes,
-                datetime.fromtimestamp(until).strftime("%c"),
-            )
-            database.remove_record(request.client.host)
-            database.put_record(request.client.host, until)
     else:
-        LOGGER.warning("Failed auth, attempt #1 for %s", request.client.host)
-        settings.session.auth_counter[request.client.host] = 1
+        return
+    metrics.BANS.inc()
+    # Ban is shared with the other workers through the database, which they refresh their ban tables from
+    database.put_record(request.client.host, until)
+
+
+async def stream_response(server_response: httpx.Response) -> AsyncIterator[bytes]:
+    """Streams the raw response body from the upstream server, chunk by chunk.
+
+    Args:
+        server_response: Response object from the upstream server, sent with ``stream=True``.
+
+    Yields:
+        bytes:
+        Yields the raw (un-decoded) chunks of the response body.
+    """
+    try:
+        async for chunk in server_response.aiter_raw():
+            yield chunk
+    except httpx.HTTPError as error:
+        LOGGER.error("Failed to stream the response: %s", error)
+    finally:
+        await server_response.aclose()
+
+
+async def forward(
+    proxy_request: Request,
+    headers: Dict[str, str],
+    body: AsyncIterator[bytes] | None,
+) -> httpx.Response:
+    """Forwards a request to the upstream server, and opens its circuit if it fails to connect.
+
+    Args:
+        proxy_request: The incoming request object.
+        headers: Headers for the upstream request.
+        body: Stream of the request body, ``None`` for requests without a body.
+
+    Returns:
+        httpx.Response:
+        Returns the streamed response from the upstream server.
+    """
+    # noinspection PyTypeChecker
+    upstream_request = upstream.server.client.build_request(
+        method=proxy_request.method,
+        url=upstream.server.url + proxy_request.url.path,
+        headers=headers,
+        params=dict(proxy_request.query_params),
+        content=body,
+    )
+    try:
+        return await upstream.server.send(upstream_request)
+    except httpx.ConnectError as error:
+        upstream.server.failed(error)
+        raise
 
 
 async def proxy_engine(proxy_request: Request) -> Response:
@@ -121,96 +165,151 @@ async def proxy_engine(proxy_request: Request) -> Response:
     Returns:
         Response: The response object with the forwarded content and headers.
     """
+    timer = timing.current.get()
+    if settings.env_config.rate_limit:
+        timer.mark("rate_limit")
     if browser_warning := squire.log_connection(proxy_request):
         return browser_warning
+    timer.mark("agent")
     # Since host header can be overridden, always check with base_url
-    if proxy_request.base_url.hostname not in settings.session.allowed_origins:
+    if not firewall.allowed(proxy_request.base_url.hostname):
         LOGGER.warning(
-            "%s is blocked by firewall, since it is not set in allowed origins %s",
+            "%s is blocked by firewall, since it is not set in allowed origins %s or rules %s",
             proxy_request.base_url,
             settings.session.allowed_origins,
+            firewall.matcher.rules,
         )
         raise HTTPException(
             status_code=HTTPStatus.FORBIDDEN.value,
             detail=f"{proxy_request.base_url!r} is not allowed",
         )
-    if (
-        proxy_request.client.host in settings.session.forbid
-    ):  # placeholder list, to avoid DB search for every request
-        # Get timestamp until which the host has to be forbidden
-        if (
-            timestamp := database.get_record(proxy_request.client.host)
-        ) and timestamp > epoch():
-            LOGGER.warning(
-                "%s is forbidden until %s due to repeated login failures",
-                proxy_request.client.host,
-                datetime.fromtimestamp(timestamp).strftime("%c"),
-            )
-            raise HTTPException(
-                status_code=HTTPStatus.FORBIDDEN.value,
-                detail=f"{proxy_request.client.host!r} is not allowed",
-            )
+    timer.mark("firewall")
+    # Timestamp until which the host has to be forbidden, looked up in memory without touching the database
+    if timestamp := database.forbidden(proxy_request.client.host):
+        metrics.FORBIDDEN.inc()
+        LOGGER.warning(
+            "%s is forbidden until %s due to repeated login failures",
+            proxy_request.client.host,
+            datetime.fromtimestamp(timestamp).strftime("%c"),
+        )
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN.value,
+            detail=f"{proxy_request.client.host!r} is not allowed",
+        )
+    timer.mark("ban")
     # following condition prevents long videos from spamming the logs
-    if settings.session.info.get(proxy_request.client.host) != proxy_request.url.path:
-        settings.session.info[proxy_request.client.host] = proxy_request.url.path
+    if squire.CLIENTS.get(proxy_request.client.host) != proxy_request.url.path:
+        squire.CLIENTS.set(proxy_request.client.host, proxy_request.url.path)
         LOGGER.info("%s %s", proxy_request.method, proxy_request.url.path)
     cookie = ""
     try:
-        headers = dict(proxy_request.headers)
-        body = await proxy_request.body()
-        # noinspection PyTypeChecker
-        server_response = CLIENT.request(
-            method=proxy_request.method,
-            url=settings.destination.url + proxy_request.url.path,
-            headers=headers,
-            cookies=proxy_request.cookies,
-            params=dict(proxy_request.query_params),
-            data=body,
-        )
-        if proxy_request.url.path == "/api/login":
-            if server_response.status_code == 403:
-                await handle_auth_error(proxy_request)
-            elif (
-                proxy_request.client in settings.session.forbid
-                or settings.session.auth_counter.get(proxy_request.client.host)
-            ):
-                LOGGER.debug(
-                    "Removing %s from forbidden list", proxy_request.client.host
-                )
-                settings.session.forbid.discard(proxy_request.client.host)
+        headers = {
+            key: value
+            for key, value in proxy_request.headers.items()
+            if key not in settings.HOP_BY_HOP_HEADERS
+        }
+        if "range" in headers:
+            # Byte ranges must map onto the file as stored, and not onto a compressed representation of it
+            headers["accept-encoding"] = "identity"
+        # Static assets are served from memory, and fetched from the upstream server only when missing or stale
+        if (static := cache.cacheable(proxy_request)) and (
+            cached := cache.lookup(proxy_request, headers)
+        ):
+            return cached
+        timer.mark("cache")
+        # Fails fast while the circuit is open, instead of waiting on a connection that is bound to fail
+        if not upstream.server.healthy:
+            LOGGER.debug(
+                "%s is unavailable, skipping %s",
+                upstream.server,
+                proxy_request.url.path,
+            )
+            return HTMLResponse(
+                headers={
+                    "Cache-Control": "no-store",
+                    "Retry-After": str(
+                        math.ceil(
+                            settings.env_config.health_check.interval
+                            or upstream.COOLDOWN
+                        )
+                    ),
+                },
+                content=templates.service_unavailable(),
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE.value,
+            )
+        # Revalidations of files and directory listings are answered without transferring the body again
+        if (validated := cache.validatable(proxy_request)) and (
+            not_modified := cache.revalidate(proxy_request)
+        ):
+            return not_modified
+        timer.mark("revalidate")
+        # Requests without a body (GET, HEAD etc.) should not be sent with a chunked transfer-encoding
+        if "content-length" in headers or "transfer-encoding" in proxy_request.headers:
+            body = proxy_request.stream()
+        else:
+            body = None
+        send = functools.partial(forward, proxy_request, headers, body)
+        # Identical requests in flight share a single upstream response, instead of each fetching their own
+        if flight := coalescing.flight_key(proxy_request):
+            server_response = await coalescing.fetch(flight, send)
+        else:
+            server_response = await send()
+        timer.mark("upstream")
+        # Anything that fails before the body is handed over to the client, must return the connection to the pool
+        try:
+            if validated:
+                await cache.tag(proxy_request, server_response)
+                cache.remember(proxy_request, server_response)
+                # Conditional requests are answered with the validators that were just learnt
+                if not_modified := cache.revalidate(proxy_request):
+                    await server_response.aclose()
+                    return not_modified
+            else:
+                cache.invalidate(proxy_request)
+            if proxy_request.url.path == "/api/login":
+                if server_response.status_code == 403:
+                    await handle_auth_error(proxy_request)
+                elif database.get_record(proxy_request.client.host) or state.store.get(
+                    "auth_counter", proxy_request.client.host
+                ):
+                    LOGGER.debug(
+                        "Resetting auth counter [%d] for %s to null",
+                        state.store.delete("auth_counter", proxy_request.client.host)
+                        or 0,
+                        proxy_request.client.host,
+                    )
 
+                    LOGGER.debug("Removing %s from auth DB", proxy_request.client.host)
+                    database.remove_record(host=proxy_request.client.host)
+            if server_response.status_code == HTTPStatus.PARTIAL_CONTENT.value:
                 LOGGER.debug(
-                    "Resetting auth counter [%d] for %s to null",
-                    settings.session.auth_counter.pop(proxy_request.client.host, 0),
-                    proxy_request.client.host,
+                    "Partial content for %s: %s",
+                    proxy_request.url.path,
+                    server_response.headers.get("content-range"),
                 )
-
-                LOGGER.debug("Removing %s from auth DB", proxy_request.client.host)
-                database.remove_record(host=proxy_request.client.host)
-        content_type = server_response.headers.get("content-type", "")
-        # The "text/javascript" MIME type was used by convention until RFC 4329 -https://www.rfc-editor.org/rfc/rfc4329
-        # attempted to replace it with application/javascript, hence this check is necessary.
-        if "text" in content_type or "javascript" in content_type:
-            # Having the "Content-Length" header results in: net::ERR_CONTENT_LENGTH_MISMATCH while streaming videos
-            # There will be a discrepancy between the "Content-Length" header and the actual content being sent.
-            # Since the content is served via VideoJS plugin, the GO API sends a StreamingResponse with chunked encoding
-            # which doesn't rely on the "Content-Length" header, so removing it is more suitable
-            # Reference TransactionID: 06f4d0a3-8a4f-4a3a-bee6-2dd382567532
-            LOGGER.debug(
-                "Removed 'content-length' header [%s] for the 'content-type' %s",
-                server_response.headers.pop("content-length", "N/A"),
-                content_type,
+            if static and (cached := await cache.fill(proxy_request, server_response)):
+                return cached
+            content = stream_response(server_response)
+            # Raw bytes are streamed as-is, so "content-length" and "content-encoding" headers remain accurate
+            response_headers = [
+                (key.lower(), value)
+                for key, value in server_response.headers.raw
+                if key.lower().decode("latin-1") not in settings.HOP_BY_HOP_HEADERS
+            ]
+            # Uncompressed text responses like directory listings are compressed, while they are streamed
+            if encoding := compression.negotiate(proxy_request, server_response):
+                content = compression.compress(content, encoding)
+                response_headers = compression.encode_headers(
+                    response_headers, encoding
+                )
+            proxy_response = StreamingResponse(
+                content=content,
+                status_code=server_response.status_code,
+                headers=Headers(raw=response_headers),
             )
-            content = server_response.text
-        else:
-            content = server_response.content
-        server_response.headers.pop("content-encoding", None)
-        proxy_response = Response(
-            content=content,
-            status_code=server_response.status_code,
-            headers=server_response.headers,
-            media_type=content_type,
-        )
+        except BaseException:
+            await server_response.aclose()
+            raise
         if cookie == "set":
             proxy_response.set_cookie(key="pyproxy", value="on")
         if cookie == "delete":
@@ -0,0 +1,404 @@
+"""Module for the proxy server's metrics, exported in the Prometheus text format.
+
+>>> Metrics
+
+"""
+
+import abc
+import bisect
+import secrets
+import time
+from http import HTTPStatus
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from fastapi import HTTPException, Request, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from pyfilebrowser.proxy import (
+    cache,
+    coalescing,
+    database,
+    firewall,
+    settings,
+    squire,
+    templates,
+)
+
+# Upper bounds in seconds of the latency buckets, that span from a cached asset to a slow archive download
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Maximum number of route classes to label the requests with, since the paths are chosen by the clients
+MAX_ROUTES = 64
+# Media type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+Labels = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    """Escapes a label value for the text exposition format."""
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def series(
+    name: str, labelnames: Tuple[str, ...], labels: Labels, extra: str = ""
+) -> str:
+    """Formats the name and labels of a time series.
+
+    Args:
+        name: Name of the metric.
+        labelnames: Names of the labels.
+        labels: Values of the labels, in the same order as the names.
+        extra: Pre-formatted label to append, like the bucket's upper bound.
+
+    Returns:
+        str:
+        Returns the name of the series, like ``name{label="value"}``
+    """
+    pairs = [f'{key}="{escape(value)}"' for key, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+
+class Metric(abc.ABC):
+    """Base class for a metric with a set of labels.
+
+    >>> Metric
+
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """Instantiates the object and registers it for the export.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text of the metric.
+            labelnames: Names of the labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Yields the samples of the metric in the text exposition format."""
+
+    def render(self) -> str:
+        """Renders the metric, along with its help text and type."""
+        return "\n".join(
+            (
+                f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.kind}",
+                *self.samples(),
+            )
+        )
+
+
+class Counter(Metric):
+    """Monotonically increasing counter.
+
+    >>> Counter
+
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """Instantiates the object with no samples."""
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """Increments the counter for a set of labels.
+
+        Args:
+            labels: Values of the labels.
+            amount: Amount to increment by.
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        """Yields the value for each set of labels."""
+        for labels, value in self.values.items():
+            yield f"{series(self.name, self.labelnames, labels)} {value:g}"
+
+
+class Histogram(Metric):
+    """Histogram of observations, counted into cumulative buckets.
+
+    >>> Histogram
+
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = BUCKETS,
+    ):
+        """Instantiates the object with no samples.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text of the metric.
+            labelnames: Names of the labels.
+            buckets: Upper bounds of the buckets, in ascending order.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # Each set of labels holds the count per bucket (plus one for +Inf), and the sum of the observations
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Records an observation for a set of labels.
+
+        Args:
+            value: Observed value.
+            labels: Values of the labels.
+        """
+        if (state := self.values.get(labels)) is None:
+            state = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        # Counts are stored per bucket, and accumulated only when exported
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1][0] += value
+
+    def samples(self) -> Iterable[str]:
+        """Yields the cumulative buckets, sum and count for each set of labels."""
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket = series(
+                    self.name + "_bucket", self.labelnames, labels, f'le="{bound}"'
+                )
+                yield f"{bucket} {cumulative}"
+            yield f"{series(self.name + '_sum', self.labelnames, labels)} {total[0]:g}"
+            yield f"{series(self.name + '_count', self.labelnames, labels)} {cumulative}"
+
+
+class Collected(Metric):
+    """Metric whose samples are collected from the current state, when the metrics are exported.
+
+    >>> Collected
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...],
+        collect: Callable[[], Iterable[Tuple[Labels, float]]],
+        kind: str = "gauge",
+    ):
+        """Instantiates the object.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text of the metric.
+            labelnames: Names of the labels.
+            collect: Function that returns the values of the labels and the sample, for each series.
+            kind: Type of the metric, ``gauge`` or ``counter``
+        """
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        """Yields the samples that are collected from the current state."""
+        for labels, value in self.collect():
+            yield f"{series(self.name, self.labelnames, labels)} {value:g}"
+
+
+REGISTRY: List[Metric] = []
+
+REQUESTS = Counter(
+    "proxy_requests_total", "Requests served by the proxy.", ("route", "status")
+)
+REQUEST_DURATION = Histogram(
+    "proxy_request_duration_seconds",
+    "Time to serve a request, until the response body is sent.",
+    ("route", "status"),
+)
+RESPONSE_BYTES = Counter(
+    "proxy_response_bytes_total",
+    "Bytes of the response bodies sent to the clients.",
+    ("route",),
+)
+UPSTREAM_CONNECT = Histogram(
+    "proxy_upstream_connect_seconds",
+    "Time to open a new connection to the upstream server.",
+)
+UPSTREAM_TTFB = Histogram(
+    "proxy_upstream_ttfb_seconds",
+    "Time until the upstream server returns the response headers.",
+)
+UPSTREAM_DURATION = Histogram(
+    "proxy_upstream_duration_seconds",
+    "Time until the upstream response body is consumed or closed.",
+)
+UPSTREAM_BYTES = Counter(
+    "proxy_upstream_bytes_total",
+    "Bytes of the response bodies received from the upstream server.",
+)
+RATE_LIMITED = Counter(
+    "proxy_rate_limited_total", "Requests rejected by a rate limit.", ("limit",)
+)
+FORBIDDEN = Counter(
+    "proxy_forbidden_total",
+    "Requests rejected from hosts that are forbidden due to repeated login failures.",
+)
+BANS = Counter(
+    "proxy_bans_total", "Hosts that were forbidden due to repeated login failures."
+)
+Collected(
+    "proxy_template_renders_total",
+    "Error and warning pages served by the proxy, by whether the rendered page was cached.",
+    ("cache",),
+    lambda: (
+        (("hit",), templates.templates.render_template.cache_info().hits),
+        (("miss",), templates.templates.render_template.cache_info().misses),
+    ),
+    kind="counter",
+)
+Collected(
+    "proxy_coalesced_requests_total",
+    "Coalescible requests, by whether they were sent upstream or waited on an identical request.",
+    ("role",),
+    lambda: (
+        (("leader",), coalescing.stats.leaders),
+        (("follower",), coalescing.stats.followers),
+        (("fallback",), coalescing.stats.fallbacks),
+    ),
+    kind="counter",
+)
+Collected(
+    "proxy_static_cache_bytes",
+    "Bytes of the static assets held in the cache, including their compressed variants.",
+    (),
+    lambda: (((), cache.store.size),),
+)
+
+
+# Route classes that are labelled so far
+ROUTES = set()
+
+
+def route_label(path: str) -> str:
+    """Gets the route class of a request path to label it with, bounding the number of series.
+
+    Args:
+        path: Request path.
+
+    Returns:
+        str:
+        Returns the route class, or ``other`` once the maximum number of route classes are labelled.
+    """
+    route = squire.route_class(path)
+    if route not in ROUTES:
+        if len(ROUTES) >= MAX_ROUTES:
+            return "other"
+        ROUTES.add(route)
+    return route
+
+
+def status_class(status: int) -> str:
+    """Reduces a status code to its class like ``2xx``, to bound the number of series."""
+    return f"{status // 100}xx"
+
+
+class Instrumentation:
+    """ASGI middleware that measures each request, including the ones answered by the dependencies and caches.
+
+    >>> Instrumentation
+
+    """
+
+    def __init__(self, app: ASGIApp):
+        """Instantiates the object.
+
+        Args:
+            app: ASGI application to wrap.
+        """
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serves a request, while counting the status and bytes of the response.
+
+        Args:
+            scope: Connection scope.
+            receive: Function to receive the messages from the client.
+            send: Function to send the messages to the client.
+        """
+        if scope["type"] != "http" or scope["path"] == settings.env_config.metrics_path:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        # Status is set to 500, until the response starts
+        status = 500
+        size = 0
+
+        async def instrumented(message: Message) -> None:
+            """Inspects the messages sent to the client."""
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, instrumented)
+        finally:
+            route = route_label(scope["path"])
+            labels = route, status_class(status)
+            REQUESTS.inc(*labels)
+            REQUEST_DURATION.observe(time.perf_counter() - start, *labels)
+            RESPONSE_BYTES.inc(route, amount=size)
+
+
+def export(request: Request) -> Response:
+    """Exports the metrics in the Prometheus text format.
+
+    See Also:
+        - The metrics are served only to the allowed origins, and never to the forbidden hosts.
+        - With ``metrics_token`` set, the metrics are served only to the scrapers that send it as a bearer token.
+        - The metrics are refused with multiple workers, so this worker's metrics are the proxy's metrics.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        Response:
+        Returns the metrics of the proxy server.
+    """
+    if not firewall.allowed(request.base_url.hostname):
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN.value,
+            detail=f"{request.base_url!r} is not allowed",
+        )
+    if database.forbidden(request.client.host):
+        FORBIDDEN.inc()
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN.value,
+            detail=f"{request.client.host!r} is not allowed",
+        )
+    if settings.env_config.metrics_token and not secrets.compare_digest(
+        request.headers.get("authorization", "").encode(),
+        f"Bearer {settings.env_config.metrics_token}".encode(),
+    ):
+        raise HTTPException(
+            status_code=HTTPStatus.UNAUTHORIZED.value,
+            detail="metrics require a bearer token",
+            headers={"www-authenticate": "Bearer"},
+        )
+    return Response(
+        content="\n".join(metric.render() for metric in REGISTRY) + "\n",
+        media_type=CONTENT_TYPE,
+        headers={"cache-control": "no-store"},
+    )
@@ -2,10 +2,11 @@ import logging
 import math
 import time
 from http import HTTPStatus
+from typing import List
 
 from fastapi import HTTPException, Request
 
-from pyfilebrowser.proxy import settings
+from pyfilebrowser.proxy import metrics, settings, squire, state
 
 LOGGER = logging.getLogger("proxy")
 
@@ -27,10 +28,19 @@ class RateLimiter:
         Attributes:
             max_requests: Maximum requests to allow in a given time frame.
             seconds: Number of seconds after which the cache is set to expire.
+            key: Strategy to identify the requester.
+            route: Path prefix the rate limit applies to.
         """
         self.max_requests = rps.max_requests
         self.seconds = rps.seconds
-        self.start_time = time.time()
+        self.key = rps.key
+        self.route = rps.route
+        # Routes are matched on a path segment boundary, so that "/api/raw" doesn't match "/api/rawfoo"
+        self.prefix = self.route.rstrip("/") + "/" if self.route else None
+        # Each rate limit gets its own namespace, so that the limits don't share counters
+        self.namespace = (
+            f"rps:{self.max_requests}/{self.seconds}:{self.key}:{self.route or '*'}"
+        )
         self.exception = HTTPException(
             status_code=HTTPStatus.TOO_MANY_REQUESTS.value,
             detail=HTTPStatus.TOO_MANY_REQUESTS.phrase,
@@ -47,23 +57,50 @@ class RateLimiter:
         Raises:
             429: Too many requests.
         """
+        path = request.url.path
+        if self.route and not (path == self.route or path.startswith(self.prefix)):
+            return
         if forwarded := request.headers.get("x-forwarded-for"):
-            identifier = forwarded.split(",")[0]
+            client = forwarded.split(",")[0]
+        else:
+            client = request.client.host
+        if self.key == settings.RateLimitKey.route:
+            identifiers = [client + ":" + squire.route_class(path)]
+        elif self.key == settings.RateLimitKey.user and (
+            scope := squire.auth_scope(request)
+        ):
+            # Tokens are not verified by the proxy, so a session is always counted along with its client,
+            # and a client cannot escape the limit by sending a different token with each request
+            identifiers = [client, f"session:{scope}"]
         else:
-            identifier = request.client.host
-        identifier += ":" + request.url.path
+            identifiers = [client]
+        if not self.admitted(identifiers, time.time()):
+            metrics.RATE_LIMITED.inc(self.namespace)
+            raise self.exception
 
-        current_time = time.time()
+    def admitted(self, identifiers: List[str], current_time: float) -> bool:
+        """Counts a request against the sliding windows of its identifiers, unless any of them exceeded the limit.
 
-        # Reset if the time window has passed
-        if current_time - self.start_time > self.seconds:
-            settings.session.rps[identifier] = 1
-            self.start_time = current_time
+        See Also:
+            - Sliding window counter: the previous window's count is weighted by its overlap with the sliding window.
+            - Rejected requests are not counted, so that a client is let in again as soon as the window slides.
 
-        if settings.session.rps.get(identifier):
-            if settings.session.rps[identifier] >= self.max_requests:
-                raise self.exception
-            else:
-                settings.session.rps[identifier] += 1
-        else:
-            settings.session.rps[identifier] = 1
+        Args:
+            identifiers: Identifiers of the requester.
+            current_time: Time of the request.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the request is admitted.
+        """
+        window = int(current_time // self.seconds)
+        return state.store.admit(
+            self.namespace,
+            [
+                (f"{identifier}@{window}", f"{identifier}@{window - 1}")
+                for identifier in identifiers
+            ],
+            1 - (current_time % self.seconds) / self.seconds,
+            self.max_requests,
+            self.seconds * 2,
+        )
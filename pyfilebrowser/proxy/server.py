@@ -1,12 +1,28 @@
+import asyncio
 import contextlib
 import logging.config
+import os
+from typing import AsyncIterator
 
 import uvicorn
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute
+from uvicorn.supervisors import Multiprocess
 
-from pyfilebrowser.proxy import main, rate_limit, repeated_timer, settings
+from pyfilebrowser.proxy import (
+    coalescing,
+    database,
+    firewall,
+    main,
+    metrics,
+    rate_limit,
+    repeated_timer,
+    settings,
+    state,
+    timing,
+    upstream,
+)
 
 
 class ProxyServer(uvicorn.Server):
@@ -26,59 +42,202 @@ class ProxyServer(uvicorn.Server):
             logger: Server's original logger.
 
         See Also:
-            - Initiates a background task to refresh the allowed origins at given interval.
+            - Runs the server in the current process when a single worker is requested.
+            - Runs a supervisor process that spawns and monitors the workers, when more than one worker is requested.
         """
-        uvicorn_error = logging.getLogger("uvicorn.error")
-        uvicorn_error.disabled = True
-        uvicorn_error.propagate = False
-        uvicorn_access = logging.getLogger("uvicorn.access")
-        uvicorn_access.disabled = True
-        uvicorn_access.propagate = False
         assert logger.name == "proxy"
-        timer = None
-        if settings.env_config.origin_refresh and (
-            settings.env_config.allow_private_ip or settings.env_config.allow_public_ip
-        ):
-            timer = repeated_timer.RepeatedTimer(
-                function=main.refresh_allowed_origins,
-                interval=settings.env_config.origin_refresh,
-            )
-            logger.info(
-                "Initiating the background task '%s' with interval %d seconds",
-                timer.function.__name__,
-                timer.interval.real,
-            )
-            timer.start()
         try:
-            self.run()
+            if self.config.workers > 1:
+                sock = self.config.bind_socket()
+                Multiprocess(config=self.config, sockets=[sock]).run()
+            else:
+                self.run()
         except KeyboardInterrupt:
-            if timer:
-                logger.info(
-                    "Stopping the background task '%s'", timer.function.__name__
-                )
-                timer.stop()
+            logger.info("Proxy service interrupted")
         finally:
             logger.info("Proxy service terminated")
 
 
-def proxy_server(server: str, log_config: dict) -> None:
+def disable_uvicorn_logging() -> None:
+    """Disables uvicorn's default loggers, since the proxy logs all the connection information."""
+    uvicorn_error = logging.getLogger("uvicorn.error")
+    uvicorn_error.disabled = True
+    uvicorn_error.propagate = False
+    uvicorn_access = logging.getLogger("uvicorn.access")
+    uvicorn_access.disabled = True
+    uvicorn_access.propagate = False
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Prepares each worker on startup, and releases its resources on shutdown.
+
+    See Also:
+        - Creates the shared connection pool within the event loop that serves the requests.
+        - Loads the allowed origins, unless they were already loaded by the parent process.
+        - Initiates a background task to refresh the allowed origins at given interval.
+        - Initiates background tasks to purge the expired keys from the session state and the expired bans.
+        - Loads the bans from the database, and starts writing through the changes to the database.
+        - Initiates a background task to refresh the bans from the database, to pick up the other workers' bans.
+        - Initiates a background task to probe the health of the server at given interval.
+        - Logs the ratio of the coalesced requests, and the summary of the timings on shutdown.
+    """
+    logger = logging.getLogger("proxy")
+    disable_uvicorn_logging()
+    settings.destination.url = os.environ[settings.DESTINATION_ENV]
+    settings.destination.socket = os.environ.get(settings.DESTINATION_SOCKET_ENV)
+    if not settings.session.allowed_origins:
+        settings.session.allowed_origins = firewall.allowed_origins()
+    timer = None
+    if settings.env_config.origin_refresh and (
+        settings.env_config.allow_private_ip or settings.env_config.allow_public_ip
+    ):
+        timer = repeated_timer.RepeatedTimer(
+            function=main.refresh_allowed_origins,
+            interval=settings.env_config.origin_refresh,
+        )
+        logger.info(
+            "Initiating the background task '%s' with interval %d seconds",
+            timer.function.__name__,
+            timer.interval.real,
+        )
+        timer.start()
+    purgers = [
+        repeated_timer.RepeatedTimer(function=function, interval=state.PURGE_INTERVAL)
+        for function in (state.purge, database.purge)
+    ]
+    for purger in purgers:
+        purger.start()
+    writer = database.start()
+    refresher = asyncio.create_task(database.refresh())
+    upstream.server = upstream.Upstream(
+        settings.destination.url, settings.destination.socket
+    )
+    monitor = None
+    if settings.env_config.health_check.interval:
+        monitor = asyncio.create_task(upstream.server.monitor())
+    try:
+        yield
+    finally:
+        refresher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await refresher
+        if monitor:
+            monitor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await monitor
+        await upstream.server.client.aclose()
+        if coalescing.stats.followers:
+            logger.info(
+                "Coalesced %d of %d requests [%.1f%%] into an identical request in flight",
+                coalescing.stats.followers - coalescing.stats.fallbacks,
+                coalescing.stats.leaders + coalescing.stats.followers,
+                coalescing.stats.ratio * 100,
+            )
+        for phase, (median, p99) in timing.summary().items():
+            logger.info("Timing for '%s': p50 %.3fs, p99 %.3fs", phase, median, p99)
+        for purger in purgers:
+            purger.stop()
+        database.stop(writer)
+        if timer:
+            logger.info("Stopping the background task '%s'", timer.function.__name__)
+            timer.stop()
+
+
+def create_app() -> FastAPI:
+    """Application factory to create the proxy app, for each worker.
+
+    See Also:
+        - Adds the rate limit dependency, per the user's selection.
+        - Adds CORS Middleware settings.
+        - Adds the metrics route and the middleware to measure the requests, when a metrics path is set.
+        - Times the phases of each request, when timing is enabled.
+
+    Returns:
+        FastAPI:
+        Returns the FastAPI application object.
+    """
+    logger = logging.getLogger("proxy")
+    dependencies = []
+    for each_rate_limit in settings.env_config.rate_limit:
+        logger.info("Adding rate limit: %s", each_rate_limit)
+        dependencies.append(
+            Depends(dependency=rate_limit.RateLimiter(each_rate_limit).init)
+        )
+    routes = []
+    if settings.env_config.metrics_path:
+        # Registered ahead of the catch-all route, so that the metrics are not proxied to the server
+        routes.append(
+            APIRoute(
+                path=settings.env_config.metrics_path,
+                endpoint=metrics.export,
+                methods=["GET"],
+                include_in_schema=False,
+            )
+        )
+    routes.append(
+        APIRoute(
+            path="/{_:path}",
+            endpoint=main.proxy_engine,
+            methods=settings.ALLOWED_METHODS,
+            dependencies=dependencies,
+        )
+    )
+    app = FastAPI(routes=routes, lifespan=lifespan)
+    # noinspection PyTypeChecker
+    app.add_middleware(
+        CORSMiddleware,
+        # Wildcards and CIDR ranges are enforced by the firewall, and cannot be expressed as CORS origins
+        allow_origins=[
+            origin
+            for origin in settings.env_config.origins
+            if not firewall.is_rule(origin)
+        ],
+        allow_credentials=True,
+        allow_methods=settings.ALLOWED_METHODS,
+        allow_headers=settings.ALLOWED_HEADERS,
+        expose_headers=settings.EXPOSED_HEADERS,
+        max_age=300,  # maximum time in seconds for browsers to cache CORS responses
+    )
+    if settings.env_config.timing.enabled:
+        # Wraps the route's dependencies, so that the time spent in the rate limits is a phase of its own
+        app.add_middleware(timing.Timing)
+    if settings.env_config.metrics_path:
+        # Outermost middleware, so that the requests rejected by CORS are measured as well
+        app.add_middleware(metrics.Instrumentation)
+    return app
+
+
+def proxy_server(
+    server: str,
+    log_config: dict,
+    socket: str | None = None,
+) -> None:
     """Triggers the proxy engine in parallel.
 
     Args:
         server: Server URL that has to be proxied.
         log_config: Server's logger object.
+        socket: Unix domain socket of the server, to connect without a TCP hop.
 
     See Also:
         - Creates a logging configuration similar to the main logger.
-        - Adds the rate limit dependency, per the user's selection.
-        - Adds CORS Middleware settings, and loads the uvicorn config.
+        - Loads the uvicorn config with an app factory, so that each worker creates its own app.
+        - The server URL and socket are shared with the workers through environment variables.
     """
     logging.config.dictConfig(log_config)
     logger = logging.getLogger("proxy")
+    disable_uvicorn_logging()
 
-    settings.destination.url = server
-    settings.session.allowed_origins.update(settings.env_config.origins)
-    settings.session.allowed_origins.update(settings.allowance())
+    os.environ[settings.DESTINATION_ENV] = server
+    if socket:
+        os.environ[settings.DESTINATION_SOCKET_ENV] = socket
+        logger.info(
+            "Connecting to the server through the unix domain socket %s", socket
+        )
+    else:
+        os.environ.pop(settings.DESTINATION_SOCKET_ENV, None)
+    settings.session.allowed_origins = firewall.allowed_origins()
 
     # noinspection HttpUrlsUsage
     logger.info(
@@ -90,38 +249,25 @@ def proxy_server(server: str, log_config: dict) -> None:
     logger.warning(
         "\n\n%s\n\nONLY CONNECTIONS FROM THE FOLLOWING ORIGINS WILL BE ALLOWED\n\t- %s\n\n%s\n",
         "".join("*" for _ in range(80)),
-        "\n\t- ".join(settings.session.allowed_origins),
+        "\n\t- ".join([*settings.session.allowed_origins, *firewall.matcher.rules]),
         "".join("*" for _ in range(80)),
     )
-    dependencies = []
-    for each_rate_limit in settings.env_config.rate_limit:
-        logger.info("Adding rate limit: %s", each_rate_limit)
-        dependencies.append(
-            Depends(dependency=rate_limit.RateLimiter(each_rate_limit).init)
+    if (
+        settings.env_config.workers > 1
+        and settings.env_config.session_backend == settings.SessionBackend.memory
+    ):
+        logger.warning(
+            "Session state is not shared between %d workers with '%s' backend, "
+            "auth counters and rate limits will be tracked separately by each worker",
+            settings.env_config.workers,
+            settings.env_config.session_backend,
         )
-    app = FastAPI(
-        routes=[
-            APIRoute(
-                path="/{_:path}",
-                endpoint=main.proxy_engine,
-                methods=settings.ALLOWED_METHODS,
-                dependencies=dependencies,
-            )
-        ],
-    )
-    # noinspection PyTypeChecker
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=settings.env_config.origins,
-        allow_credentials=True,
-        allow_methods=settings.ALLOWED_METHODS,
-        allow_headers=settings.ALLOWED_HEADERS,
-        max_age=300,  # maximum time in seconds for browsers to cache CORS responses
-    )
     proxy_config = uvicorn.Config(
+        app=f"{__name__}:{create_app.__name__}",
+        factory=True,
         host=settings.env_config.host,
         port=settings.env_config.port,
         workers=settings.env_config.workers,
-        app=app,
+        log_config=log_config,
     )
     ProxyServer(config=proxy_config).run_in_parallel(logger)
@@ -1,20 +1,34 @@
+import ipaddress
 import os
 import pathlib
-import re
 import socket
 import string
-from typing import Dict, List, Set
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from enum import StrEnum
+from typing import Callable, Dict, FrozenSet, List, Tuple
 
 import requests
-from pydantic import BaseModel, Field, FilePath, HttpUrl, PositiveInt, field_validator
+from pydantic import (
+    BaseModel,
+    Field,
+    FilePath,
+    HttpUrl,
+    NonNegativeFloat,
+    NonNegativeInt,
+    PositiveFloat,
+    PositiveInt,
+    field_validator,
+    model_validator,
+)
 
 from pyfilebrowser.modals import models
 from pyfilebrowser.modals.pydantic_config import PydanticEnvConfig
 
-# noinspection LongLine
-IP_REGEX = re.compile(
-    r"""^(?:(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9][0-9]|[0-9])\.){3}(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9][0-9]|[0-9])$"""  # noqa: E501
-)
+# Environment variable to share the upstream server's URL with all the workers
+DESTINATION_ENV = "PYFB_PROXY_DESTINATION"
+# Environment variable to share the upstream server's unix domain socket with all the workers
+DESTINATION_SOCKET_ENV = "PYFB_PROXY_DESTINATION_SOCKET"
 ALLOWED_METHODS = ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "HEAD"]
 ALLOWED_HEADERS = [
     "content-length",
@@ -46,31 +60,121 @@ ALLOWED_HEADERS = [
     "x-auth",
     "x-forwarded-host",
 ]
+# Response headers that the browser should be allowed to read for cross-origin (ranged) media requests
+EXPOSED_HEADERS = [
+    "accept-ranges",
+    "content-length",
+    "content-range",
+]
+
+# Headers that are meaningful only for a single transport-level connection, and must not be forwarded
+HOP_BY_HOP_HEADERS = (
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+)
+# Media types that compress well, anything else (video, images, archives etc.) is already compressed
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "image/svg+xml",
+    "font/ttf",
+    "font/otf",
+)
+
+
+def _text(response: requests.Response) -> str:
+    """Extracts the IP address from a plain text response."""
+    return response.text.strip()
+
+
+def _json(response: requests.Response) -> str:
+    """Extracts the IP address from a JSON response."""
+    return response.json()["origin"].strip()
+
+
+PUBLIC_IP_ENDPOINTS = {
+    "https://checkip.amazonaws.com/": _text,
+    "https://api.ipify.org/": _text,
+    "https://ipinfo.io/ip/": _text,
+    "https://v4.ident.me/": _text,
+    "https://httpbin.org/ip": _json,
+    "https://myip.dnsomatic.com/": _text,
+}
+# Public IP address and the epoch time until which it can be reused
+public_ip_cache: Dict[str, Tuple[str, float]] = {}
+
+
+def _resolve(
+    url: str, parser: Callable[[requests.Response], str], timeout: float
+) -> str | None:
+    """Gets the public IP address from a single endpoint.
+
+    Args:
+        url: Endpoint that responds with the public IP address.
+        parser: Function to extract the IP address from the response.
+        timeout: Timeout for the request in seconds.
+
+    Returns:
+        str:
+        Returns the IP address, if the endpoint responded with a valid one.
+    """
+    try:
+        with requests.get(url, timeout=timeout) as response:
+            response.raise_for_status()
+            return str(ipaddress.ip_address(parser(response)))
+    except (requests.RequestException, ValueError, KeyError, TypeError):
+        return
+
+
+def public_ip_address(
+    endpoints: Dict[str, Callable[[requests.Response], str]] = None,
+    timeout: float = 3,
+    ttl: float = 30,
+) -> str | None:
+    """Gets public IP address of the host by racing different endpoints concurrently.
 
+    Args:
+        endpoints: Mapping of endpoints to the functions that extract the IP address from their responses.
+        timeout: Deadline in seconds for the first valid response from any endpoint.
+        ttl: Time in seconds to reuse the resolved IP address.
 
-def public_ip_address() -> str:
-    """Gets public IP address of the host using different endpoints.
+    See Also:
+        - The first valid IPv4 or IPv6 address wins, and the remaining requests are abandoned.
+        - The resolved IP address is cached, so that the cold start and the origin refresh don't repeat the lookup.
 
     Returns:
         str:
         Public IP address.
     """
-    opt1 = lambda fa: fa.text.strip()  # noqa: E731
-    opt2 = lambda fa: fa.json()["origin"].strip()  # noqa: E731
-    mapping = {
-        "https://checkip.amazonaws.com/": opt1,
-        "https://api.ipify.org/": opt1,
-        "https://ipinfo.io/ip/": opt1,
-        "https://v4.ident.me/": opt1,
-        "https://httpbin.org/ip": opt2,
-        "https://myip.dnsomatic.com/": opt1,
-    }
-    for url, func in mapping.items():
-        try:
-            with requests.get(url) as response:
-                return IP_REGEX.findall(func(response))[0]
-        except (requests.RequestException, re.error, IndexError):
-            continue
+    if (cached := public_ip_cache.get("address")) and cached[1] > time.time():
+        return cached[0]
+    endpoints = endpoints or PUBLIC_IP_ENDPOINTS
+    executor = ThreadPoolExecutor(
+        max_workers=len(endpoints), thread_name_prefix="public_ip"
+    )
+    futures = [
+        executor.submit(_resolve, url, parser, timeout)
+        for url, parser in endpoints.items()
+    ]
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            if ip_address := future.result():
+                public_ip_cache["address"] = (ip_address, time.time() + ttl)
+                return ip_address
+    except TimeoutError:
+        pass
+    finally:
+        # Don't wait for the slower endpoints, their requests are bound by the same timeout
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 def private_ip_address() -> str | None:
@@ -115,24 +219,59 @@ class Destination(BaseModel):
 
     >>> Destination
 
+    See Also:
+        - **url** - URL of the upstream server.
+        - **socket** - Unix domain socket of the upstream server, the ``url`` is then used only for the host header.
     """
 
     url: HttpUrl
+    socket: str | None = None
 
 
 class Session(BaseModel):
-    """Object to store session information.
+    """Object to store session information that is local to each worker.
 
     >>> Session
 
+    See Also:
+        - Auth counters and rate limits are stored in the session state backend instead.
+        - Forbidden hosts are stored in the database, and refreshed into an in-memory table in the ``database`` module.
+        - Recently seen clients are stored in a bounded cache, in the ``squire`` module.
+        - Allowed origins are an immutable snapshot, that is replaced as a whole when refreshed.
+    """
+
+    allowed_origins: FrozenSet[str] = frozenset()
+
+
+class SessionBackend(StrEnum):
+    """Enum for the session state backends.
+
+    >>> SessionBackend
+
+    See Also:
+        - ``memory`` keeps the session state within the process, which is suitable only for a single worker.
+        - ``sqlite`` stores the session state in the proxy's database, which is shared by all the workers.
     """
 
-    auth_counter: Dict[str, int] = {}
-    forbid: Set[str] = set()
+    memory: str = "memory"
+    sqlite: str = "sqlite"
 
-    info: Dict[str, str] = {}
-    rps: Dict[str, int] = {}
-    allowed_origins: Set[str] = set()
+
+class RateLimitKey(StrEnum):
+    """Enum for the strategies to identify the requester for rate limiting.
+
+    >>> RateLimitKey
+
+    See Also:
+        - ``client`` counts all the requests from a client together.
+        - ``route`` counts the requests from a client separately for each route class, like ``/api/raw``
+        - ``user`` counts the requests by the session's auth token as well as by the client, so that a session is
+          limited across clients, while a client can't reset its limit with a new token.
+    """
+
+    client: str = "client"
+    route: str = "route"
+    user: str = "user"
 
 
 class RateLimit(BaseModel):
@@ -140,10 +279,154 @@ class RateLimit(BaseModel):
 
     >>> RateLimit
 
+    See Also:
+        - **max_requests** - Maximum requests to allow in the given time frame.
+        - **seconds** - Time frame in seconds.
+        - **key** - Strategy to identify the requester.
+        - **route** - Path the rate limit applies to along with its sub-paths, like ``/api/resources``.
+          Applies to all paths if not set.
     """
 
     max_requests: PositiveInt
     seconds: PositiveInt
+    key: RateLimitKey = RateLimitKey.client
+    route: str | None = None
+
+
+class Pool(BaseModel):
+    """Object to store the connection pool settings for the upstream server.
+
+    >>> Pool
+
+    See Also:
+        - All the requests are forwarded to a single upstream server, so the limits are effectively per-host.
+        - **max_connections** - Maximum number of concurrent connections to the upstream server.
+        - **max_keepalive_connections** - Maximum number of idle connections to keep alive in the pool.
+        - **keepalive_expiry** - Time in seconds after which an idle connection is closed.
+        - **timeout** - Time in seconds to wait for the upstream server to connect, read or write.
+    """
+
+    max_connections: PositiveInt = 100
+    max_keepalive_connections: PositiveInt = 20
+    keepalive_expiry: PositiveFloat = 5.0
+    timeout: PositiveFloat = 5.0
+
+
+class HealthCheck(BaseModel):
+    """Object to store the settings for probing the health of the upstream server.
+
+    >>> HealthCheck
+
+    See Also:
+        - **interval** - Time in seconds between the probes. Setting it to ``0`` disables the probes.
+        - **timeout** - Time in seconds to wait for a probe's response.
+        - **failures** - Number of consecutive failed probes, after which the server's circuit is opened.
+        - **path** - Path of the health endpoint in the upstream server.
+    """
+
+    interval: NonNegativeFloat = 2.0
+    timeout: PositiveFloat = 1.0
+    failures: PositiveInt = 2
+    path: str = "/health"
+
+
+class StaticCache(BaseModel):
+    """Object to store the settings for the cache of filebrowser's static frontend assets.
+
+    >>> StaticCache
+
+    See Also:
+        - **max_size** - Maximum size in bytes of all the cached assets, including the compressed variants.
+        - **max_entry_size** - Maximum size in bytes of a single asset to cache. Larger assets are streamed as-is.
+        - **ttl** - Time in seconds to serve an asset from memory, before revalidating it with the upstream server.
+        - **max_age** - Time in seconds for the browsers to cache an asset, when the upstream server doesn't set it.
+        - Setting ``max_size`` to ``0`` disables the cache.
+    """
+
+    max_size: NonNegativeInt = 52_428_800
+    max_entry_size: PositiveInt = 5_242_880
+    ttl: PositiveInt = 300
+    max_age: NonNegativeInt = 3_600
+
+
+class ValidatorCache(BaseModel):
+    """Object to store the settings for the cache of validators (``ETag`` and ``Last-Modified``) of the API responses.
+
+    >>> ValidatorCache
+
+    See Also:
+        - **ttl** - Time in seconds to answer the conditional requests locally, without contacting the upstream server.
+        - **max_entries** - Maximum number of responses to track the validators for.
+        - **max_listing_size** - Maximum size in bytes of a directory listing to hash into an ``ETag``.
+        - Setting ``ttl`` to ``0`` disables the cache, and ``max_listing_size`` to ``0`` streams the listings untagged.
+    """
+
+    ttl: NonNegativeInt = 10
+    max_entries: PositiveInt = 10_000
+    max_listing_size: NonNegativeInt = 4_194_304
+
+
+class Coalescing(BaseModel):
+    """Object to store the settings for coalescing the identical requests that are in flight at the same time.
+
+    >>> Coalescing
+
+    See Also:
+        - **max_size** - Maximum ``content-length`` of a response in bytes, that is shared with the identical requests.
+        - Setting ``max_size`` to ``0`` disables coalescing.
+    """
+
+    max_size: NonNegativeInt = 2_097_152
+
+
+class Timing(BaseModel):
+    """Object to store the settings for timing the phases of each request.
+
+    >>> Timing
+
+    See Also:
+        - **enabled** - Records the time spent in each phase of the requests.
+        - **slow_threshold** - Time in seconds until the response headers, above which a request is logged as slow.
+        - **buffer_size** - Number of recent requests to retain the timings for.
+    """
+
+    enabled: bool = False
+    slow_threshold: PositiveFloat = 1.0
+    buffer_size: PositiveInt = 1_024
+
+
+class Encoding(StrEnum):
+    """Enum for the content-codings to compress the responses with.
+
+    >>> Encoding
+
+    See Also:
+        - ``br`` and ``zstd`` require the optional packages ``brotli`` and ``zstandard`` respectively.
+    """
+
+    br: str = "br"
+    zstd: str = "zstd"
+    gzip: str = "gzip"
+
+
+class Compression(BaseModel):
+    """Object to store the settings for compressing the responses on-the-fly.
+
+    >>> Compression
+
+    See Also:
+        - **encodings** - Content-codings to offer, in the order of preference. An empty list disables compression.
+        - **min_size** - Minimum size in bytes of a response to compress. Responses of unknown size are compressed.
+        - **gzip_level** - Compression level for ``gzip``, between 1 and 9.
+        - **brotli_quality** - Compression quality for ``br``, between 0 and 11.
+        - **zstd_level** - Compression level for ``zstd``, between 1 and 22.
+    """
+
+    encodings: List[Encoding] = [Encoding.br, Encoding.zstd, Encoding.gzip]
+    min_size: NonNegativeInt = 1_024
+    gzip_level: int = Field(6, ge=1, le=9)
+    brotli_quality: int = Field(4, ge=0, le=11)
+    zstd_level: int = Field(3, ge=1, le=22)
 
 
 class EnvConfig(PydanticEnvConfig):
@@ -156,12 +439,24 @@ class EnvConfig(PydanticEnvConfig):
         - **port**: The port number for the server.
         - **workers**: The number of worker processes for handling requests.
         - **debug**: Enable or disable debug mode.
-        - **origins**: A list of allowed origins for CORS.
+        - **origins**: A list of allowed origins, wildcards and CIDR ranges for the firewall and CORS.
         - **database**: The path to the database file.
         - **allow_public_ip**: Allow access from public IP address.
         - **allow_private_ip**: Allow access from private IP address.
         - **origin_refresh**: Time interval to refresh allowed origins.
         - **rate_limit**: Rate limiting settings for incoming requests.
+        - **pool**: Connection pool settings for the upstream server.
+        - **health_check**: Settings to probe the health of the upstream server.
+        - **session_backend**: Backend to store the auth counters and rate limits.
+        - **session_capacity**: Maximum number of keys to track per session state, with ``memory`` backend.
+        - **static_cache**: Cache settings for filebrowser's static frontend assets.
+        - **validator_cache**: Cache settings for the validators of files, previews and directory listings.
+        - **coalescing**: Settings to share a single upstream response with the identical requests in flight.
+        - **compression**: Settings to compress the responses on-the-fly.
+        - **metrics_path**: Path to serve the metrics on, in the Prometheus text format. Requires a single worker.
+          Served on the proxy's own listener, so any allowed origin can read them unless ``metrics_token`` is set.
+        - **metrics_token**: Bearer token that the scrapers must send, to read the metrics.
+        - **timing**: Settings to time the phases of each request, and to log the slow requests.
         - **unsupported_browsers**: List of unsupported browsers.
         - **warn_page**: Path to the custom warning page HTML file.
         - **error_page**: Path to the custom error page HTML file.
@@ -171,12 +466,23 @@ class EnvConfig(PydanticEnvConfig):
     port: PositiveInt = 8000
     workers: PositiveInt = 1
     debug: bool = False
-    origins: List[HttpUrl] = []
+    origins: List[str] = []
     database: str = Field("auth.db", pattern=".*.db$")
     allow_public_ip: bool = False
     allow_private_ip: bool = False
     origin_refresh: PositiveInt | None = None
     rate_limit: RateLimit | List[RateLimit] = []
+    pool: Pool = Pool()
+    health_check: HealthCheck = HealthCheck()
+    session_backend: SessionBackend | None = None
+    session_capacity: PositiveInt = 100_000
+    static_cache: StaticCache = StaticCache()
+    validator_cache: ValidatorCache = ValidatorCache()
+    coalescing: Coalescing = Coalescing()
+    compression: Compression = Compression()
+    metrics_path: str | None = Field(None, pattern="^/")
+    metrics_token: str | None = None
+    timing: Timing = Timing()
     unsupported_browsers: str | List[str] = ["Chrome"]
     warn_page: FilePath = os.path.join(
         pathlib.PosixPath(__file__).parent, "templates", "warn.html"
@@ -206,11 +512,22 @@ class EnvConfig(PydanticEnvConfig):
 
     # noinspection PyMethodParameters,PyUnusedLocal
     @field_validator("origins", mode="after", check_fields=True)
-    def parse_origins(cls, origins: List[HttpUrl]) -> List[str] | List:
-        """Validate origins' input as a URL, and stores only the host part of the URL."""
-        if origins:
-            return list(set([origin.host for origin in origins]))
-        return []
+    def parse_origins(cls, origins: List[str]) -> List[str] | List:
+        """Validate origins' input as a URL, a wildcard or a CIDR range, and stores only the host part of the URL."""
+        validated = set()
+        for origin in origins:
+            origin = origin.strip().lower()
+            if origin.startswith("*."):
+                # Validates the suffix as a hostname, by wrapping it in a URL
+                validated.add("*." + HttpUrl(f"http://{origin[2:]}").host)
+            elif "/" in origin and "://" not in origin:
+                try:
+                    validated.add(str(ipaddress.ip_network(origin, strict=False)))
+                except ValueError as error:
+                    raise ValueError(f"{origin!r} is not a valid CIDR range") from error
+            else:
+                validated.add(HttpUrl(origin).host)
+        return list(validated)
 
     # noinspection PyMethodParameters,PyUnusedLocal
     @field_validator("rate_limit", mode="after", check_fields=True)
@@ -222,6 +539,25 @@ class EnvConfig(PydanticEnvConfig):
             return rate_limit
         return [rate_limit]
 
+    @model_validator(mode="after")
+    def parse_session_backend(self) -> "EnvConfig":
+        """Defaults the session backend to sqlite when multiple workers are used, and memory otherwise."""
+        if self.session_backend is None:
+            if self.workers > 1:
+                self.session_backend = SessionBackend.sqlite
+            else:
+                self.session_backend = SessionBackend.memory
+        return self
+
+    @model_validator(mode="after")
+    def parse_metrics_path(self) -> "EnvConfig":
+        """Refuses the metrics with multiple workers, since each worker counts only the requests it served."""
+        if self.metrics_path and self.workers > 1:
+            raise ValueError(
+                "metrics_path requires a single worker, as the metrics are not aggregated across the workers"
+            )
+        return self
+
     class Config:
         """Environment variables configuration."""
 
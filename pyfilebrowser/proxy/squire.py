@@ -1,28 +1,57 @@
+import functools
+import hashlib
 import logging
 from http import HTTPStatus
+from typing import Tuple
 
 import user_agents
 from fastapi import Request
 from fastapi.responses import HTMLResponse
+from user_agents.parsers import UserAgent
 
-from pyfilebrowser.proxy import settings, templates
+from pyfilebrowser.proxy import settings, state, templates
 
 LOGGER = logging.getLogger("proxy")
+# Clients that were seen recently, along with the last path they requested
+CLIENTS = state.TTLCache(maxsize=settings.env_config.session_capacity, ttl=3_600)
+
+
+@functools.lru_cache(maxsize=1024)
+def classify(user_agent: str) -> Tuple[UserAgent | None, bool]:
+    """Parses a user agent string, and decides if the browser is unsupported.
+
+    See Also:
+        - Parsing runs through a heavy regex cascade, so the result is cached by the raw user agent string.
+        - Clients that rotate through many IP addresses usually share a handful of user agents.
+
+    Args:
+        user_agent: Raw user agent string from the request headers.
+
+    Returns:
+        Tuple[UserAgent | None, bool]:
+        Returns a tuple of the parsed user agent, and a boolean flag to indicate if the browser is unsupported.
+    """
+    try:
+        parsed = user_agents.parse(user_agent)
+    except Exception as error:
+        LOGGER.critical("Failed to parse user-agent: %s", error)
+        return None, False
+    return parsed, parsed.browser.family in settings.env_config.unsupported_browsers
 
 
 def log_connection(request: Request) -> HTMLResponse | None:
     """Logs the connection information and returns an HTML response if the browser is unsupported for video/audio.
 
     See Also:
-        - Only logs the first connection from a device.
+        - Only logs the first connection from a device, until it is idle for an hour.
         - This avoids multiple logs when same device is accessing different paths.
 
     Returns:
         HTMLResponse:
         Returns an HTML response if the browser is unsupported for video/audio rendering.
     """
-    if request.client.host not in settings.session.info:
-        settings.session.info[request.client.host] = None
+    if request.client.host not in CLIENTS:
+        CLIENTS.set(request.client.host, None)
         LOGGER.info(
             "Connection received from client-host: %s, host-header: %s, x-fwd-host: %s",
             request.client.host,
@@ -31,13 +60,93 @@ def log_connection(request: Request) -> HTMLResponse | None:
         )
         if user_agent := request.headers.get("user-agent"):
             LOGGER.info("User agent: %s", user_agent)
-            try:
-                parsed = user_agents.parse(user_agent)
-            except Exception as error:
-                LOGGER.critical("Failed to parse user-agent: %s", error)
-                return
-            if parsed.browser.family in settings.env_config.unsupported_browsers:
+            parsed, unsupported = classify(user_agent)
+            if unsupported:
                 return HTMLResponse(
                     content=templates.unsupported_browser(parsed),
                     status_code=HTTPStatus.OK.value,
                 )
+
+
+def route_class(path: str) -> str:
+    """Reduces a request path to its route class, like ``/api/resources`` or ``/static``.
+
+    Args:
+        path: Request path.
+
+    Returns:
+        str:
+        Returns the route class for the path.
+    """
+    parts = path.split("/", 4)
+    if len(parts) > 2 and parts[1] == "api":
+        return f"/api/{parts[2]}"
+    if len(parts) > 1 and parts[1]:
+        return f"/{parts[1]}"
+    return "/"
+
+
+def auth_token(request: Request) -> str | None:
+    """Gets the auth token that filebrowser's frontend sends in header, query parameter or cookie.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        str:
+        Returns the auth token (JWT) if present.
+    """
+    return (
+        request.headers.get("x-auth")
+        or request.query_params.get("auth")
+        or request.cookies.get("auth")
+    )
+
+
+def auth_scope(request: Request) -> str:
+    """Gets a digest of the auth token, to keep the responses that are cached for one session away from another.
+
+    See Also:
+        The token's signature is NOT verified by the proxy, so the scope must never be used to authorize a request.
+
+    Args:
+        request: The incoming request object.
+
+    Returns:
+        str:
+        Returns the digest of the auth token, or an empty string when the request is unauthenticated.
+    """
+    if token := auth_token(request):
+        return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+    return ""
+
+
+@functools.lru_cache(maxsize=256)
+def negotiate_encoding(accept_encoding: str, available: Tuple[str, ...]) -> str | None:
+    """Picks the content-coding preferred by the client, among the ones that are available.
+
+    See Also:
+        - Codings are ranked by their quality value, and then by the order of ``available`` to break ties.
+        - Browsers send a handful of distinct ``accept-encoding`` values, so the result is cached.
+
+    Args:
+        accept_encoding: Raw ``accept-encoding`` header from the request.
+        available: Content-codings that are available, in the order of preference.
+
+    Returns:
+        str:
+        Returns the negotiated content-coding, or ``None`` when none of them is acceptable.
+    """
+    weights = {}
+    for directive in accept_encoding.lower().split(","):
+        coding, _, params = directive.partition(";")
+        try:
+            weights[coding.strip()] = float(params.strip().removeprefix("q=") or 1)
+        except ValueError:
+            continue
+    candidates = [
+        (weights.get(coding, weights.get("*", 0)), -rank, coding)
+        for rank, coding in enumerate(available)
+    ]
+    if candidates and (best := max(candidates))[0] > 0:
+        return best[2]
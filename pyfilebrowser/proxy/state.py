@@ -0,0 +1,511 @@
+"""Module for session state that is shared between the proxy workers.
+
+>>> State
+
+"""
+
+import collections
+import contextlib
+import functools
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Hashable, Iterator, List, Tuple
+
+from pydantic import FilePath
+
+from pyfilebrowser.proxy import settings
+
+LOGGER = logging.getLogger("proxy")
+# Interval in seconds to purge the expired keys from the session state
+PURGE_INTERVAL = 60
+# Sentinel to distinguish a missing key from a key that is set to None
+MISSING = object()
+# Time in seconds to wait for the sqlite state while it is busy, since the requests wait on it in the event loop
+BUSY_TIMEOUT = 0.05
+
+
+class TTLCache:
+    """Bounded mapping, whose entries expire after a given time-to-live.
+
+    >>> TTLCache
+
+    See Also:
+        - Entries are kept in the order of their last update, so the oldest entry is evicted when at capacity.
+        - Expired entries are removed lazily on lookup, or in bulk with ``purge``.
+    """
+
+    def __init__(self, maxsize: int = 0, ttl: float | None = None):
+        """Instantiates the object.
+
+        Args:
+            maxsize: Maximum number of entries to hold, ``0`` for unbounded.
+            ttl: Default time-to-live in seconds for each entry, ``None`` to never expire.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: collections.OrderedDict[Hashable, tuple[Any, float | None]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        """Number of entries, including the ones that expired but not purged yet."""
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Checks if a key exists and hasn't expired yet."""
+        return self.get(key, MISSING) is not MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get the value for a key, if it exists and hasn't expired yet.
+
+        Args:
+            key: Key to look up.
+            default: Default value to return when the key doesn't exist.
+
+        Returns:
+            Any:
+            Returns the value for the key, or the default.
+        """
+        try:
+            value, expiry = self._data[key]
+        except KeyError:
+            return default
+        if expiry is not None and expiry <= time.time():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Set the value for a key, evicting the oldest entry when at capacity.
+
+        Args:
+            key: Key to store.
+            value: Value to store.
+            ttl: Time-to-live in seconds for this entry, defaults to the cache's time-to-live.
+        """
+        ttl = ttl or self.ttl
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        if self.maxsize and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def update(self, key: Hashable, value: Any) -> None:
+        """Update the value for an existing key, retaining its expiry.
+
+        Args:
+            key: Key to update.
+            value: Value to store.
+        """
+        self._data[key] = (value, self._data[key][1])
+        self._data.move_to_end(key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key and return its value.
+
+        Args:
+            key: Key to remove.
+            default: Default value to return when the key doesn't exist.
+
+        Returns:
+            Any:
+            Returns the value for the key, or the default.
+        """
+        value = self.get(key, default)
+        self._data.pop(key, None)
+        return value
+
+    def clear(self) -> None:
+        """Remove all the entries."""
+        self._data.clear()
+
+    def purge(self) -> int:
+        """Remove all the expired entries.
+
+        Returns:
+            int:
+            Returns the number of entries that were removed.
+        """
+        now = time.time()
+        expired = [
+            key
+            for key, (_, expiry) in self._data.items()
+            if expiry is not None and expiry <= now
+        ]
+        for key in expired:
+            self._data.pop(key, None)
+        return len(expired)
+
+
+class MemoryState:
+    """In-process session state, for a proxy server with a single worker.
+
+    >>> MemoryState
+
+    """
+
+    def __init__(self, capacity: int = 0):
+        """Instantiates the object with a lock, since the background tasks run in dedicated threads.
+
+        Args:
+            capacity: Maximum number of keys to track in each namespace, ``0`` for unbounded.
+        """
+        self.lock = threading.Lock()
+        self.namespaces: collections.defaultdict[str, TTLCache] = (
+            collections.defaultdict(lambda: TTLCache(maxsize=capacity))
+        )
+
+    def increment(self, namespace: str, key: str, ttl: float) -> int:
+        """Atomically increments the counter for a key, starting a new window when the previous one expired.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to increment.
+            ttl: Time-to-live in seconds for a new window.
+
+        Returns:
+            int:
+            Returns the counter value after the increment.
+        """
+        with self.lock:
+            cache = self.namespaces[namespace]
+            if value := cache.get(key):
+                # Retains the expiry of the current window
+                cache.update(key, value + 1)
+                return value + 1
+            cache.set(key, 1, ttl)
+            return 1
+
+    def admit(
+        self,
+        namespace: str,
+        windows: List[Tuple[str, str]],
+        weight: float,
+        limit: int,
+        ttl: float,
+    ) -> bool:
+        """Atomically counts a request against the sliding windows of its keys, unless any of them is at the limit.
+
+        Args:
+            namespace: Namespace of the keys.
+            windows: Keys of the current and the previous window, for each identifier of the requester.
+            weight: Weight of the previous window, by its overlap with the sliding window.
+            limit: Maximum number of requests in the sliding window.
+            ttl: Time-to-live in seconds for a new window.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the request was admitted, and counted.
+        """
+        with self.lock:
+            cache = self.namespaces[namespace]
+            if any(
+                (cache.get(previous) or 0) * weight + (cache.get(current) or 0) + 1
+                > limit
+                for current, previous in windows
+            ):
+                return False
+            for current, _ in windows:
+                if value := cache.get(current):
+                    cache.update(current, value + 1)
+                else:
+                    cache.set(current, 1, ttl)
+            return True
+
+    def get(self, namespace: str, key: str) -> int | None:
+        """Get the value for a key, if it hasn't expired yet.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to look up.
+
+        Returns:
+            int:
+            Returns the value for the key.
+        """
+        with self.lock:
+            return self.namespaces[namespace].get(key)
+
+    def put(self, namespace: str, key: str, value: int, ttl: float) -> None:
+        """Set the value for a key.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to store.
+            value: Value to store.
+            ttl: Time-to-live in seconds for the key.
+        """
+        with self.lock:
+            self.namespaces[namespace].set(key, value, ttl)
+
+    def delete(self, namespace: str, key: str) -> int | None:
+        """Delete a key.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to delete.
+
+        Returns:
+            int:
+            Returns the value of the deleted key.
+        """
+        with self.lock:
+            return self.namespaces[namespace].pop(key)
+
+    def purge(self) -> int:
+        """Remove all the expired keys.
+
+        Returns:
+            int:
+            Returns the number of keys that were removed.
+        """
+        with self.lock:
+            return sum(cache.purge() for cache in self.namespaces.values())
+
+
+def fail_open(default: Any) -> Callable[[Callable], Callable]:
+    """Creates a decorator that returns a default value, when the sqlite state is busy for longer than its timeout.
+
+    Args:
+        default: Value to return instead, which must let the request through.
+
+    Returns:
+        Callable[[Callable], Callable]:
+        Returns the decorator.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        """Wraps a method of the sqlite state."""
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs) -> Any:
+            """Calls the method, and falls back to the default value when the database is busy."""
+            try:
+                return method(*args, **kwargs)
+            except sqlite3.OperationalError as error:
+                LOGGER.warning(
+                    "Session state is unavailable for %s: %s", method.__name__, error
+                )
+                return default
+
+        return wrapper
+
+    return decorator
+
+
+class SQLiteState:
+    """Session state stored in a sqlite database, shared by all the workers of the proxy server.
+
+    >>> SQLiteState
+
+    See Also:
+        - The database runs in WAL mode, so that readers don't block the writer.
+        - Each statement runs in its own transaction, which makes increments atomic across processes.
+        - Statements wait only for a short busy timeout, after which they fail open instead of holding the event loop.
+    """
+
+    def __init__(self, datastore: FilePath | str, timeout: float = BUSY_TIMEOUT):
+        """Instantiates the object, which connects lazily so that importing the module creates no files.
+
+        Args:
+            datastore: Name of the database file.
+            timeout: Time in seconds to wait for the other threads and workers, while the database is busy.
+        """
+        self.lock = threading.Lock()
+        self.datastore = datastore
+        self.timeout = timeout
+
+    @functools.cached_property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database, along with the state table, that are created on first use."""
+        connection = sqlite3.connect(
+            database=self.datastore, check_same_thread=False, timeout=self.timeout
+        )
+        with connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS session_state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value INTEGER NOT NULL, expiry REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+        return connection
+
+    @contextlib.contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """Runs the statements in a transaction, waiting at most the timeout for the lock of this worker.
+
+        Args:
+            immediate: Takes the database's write lock upfront, for the statements that read before they write.
+
+        Raises:
+            sqlite3.OperationalError:
+            When the database is busy for longer than the timeout.
+        """
+        if not self.lock.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("session state is locked by another thread")
+        try:
+            with self.connection:
+                if immediate:
+                    self.connection.execute("BEGIN IMMEDIATE")
+                yield self.connection
+        finally:
+            self.lock.release()
+
+    @fail_open(0)
+    def increment(self, namespace: str, key: str, ttl: float) -> int:
+        """Atomically increments the counter for a key, starting a new window when the previous one expired.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to increment.
+            ttl: Time-to-live in seconds for a new window.
+
+        Returns:
+            int:
+            Returns the counter value after the increment.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            return connection.execute(
+                "INSERT INTO session_state (namespace, key, value, expiry) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET "
+                "value = CASE WHEN expiry <= ? THEN 1 ELSE value + 1 END, "
+                "expiry = CASE WHEN expiry <= ? THEN excluded.expiry ELSE expiry END "
+                "RETURNING value",
+                (namespace, key, now + ttl, now, now),
+            ).fetchone()[0]
+
+    @fail_open(True)
+    def admit(
+        self,
+        namespace: str,
+        windows: List[Tuple[str, str]],
+        weight: float,
+        limit: int,
+        ttl: float,
+    ) -> bool:
+        """Atomically counts a request against the sliding windows of its keys, unless any of them is at the limit.
+
+        See Also:
+            Windows are read and counted in a single immediate transaction, so that no two workers take the last slot.
+
+        Args:
+            namespace: Namespace of the keys.
+            windows: Keys of the current and the previous window, for each identifier of the requester.
+            weight: Weight of the previous window, by its overlap with the sliding window.
+            limit: Maximum number of requests in the sliding window.
+            ttl: Time-to-live in seconds for a new window.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate if the request was admitted, and counted.
+        """
+        now = time.time()
+        keys = [key for window in windows for key in window]
+        with self.transaction(immediate=True) as connection:
+            values = dict(
+                connection.execute(
+                    "SELECT key, value FROM session_state WHERE namespace=(?) AND expiry > (?) "
+                    f"AND key IN ({', '.join('?' * len(keys))})",
+                    (namespace, now, *keys),
+                ).fetchall()
+            )
+            if any(
+                values.get(previous, 0) * weight + values.get(current, 0) + 1 > limit
+                for current, previous in windows
+            ):
+                return False
+            connection.executemany(
+                "INSERT INTO session_state (namespace, key, value, expiry) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET "
+                "value = CASE WHEN expiry <= ? THEN 1 ELSE value + 1 END, "
+                "expiry = CASE WHEN expiry <= ? THEN excluded.expiry ELSE expiry END",
+                [(namespace, current, now + ttl, now, now) for current, _ in windows],
+            )
+            return True
+
+    @fail_open(None)
+    def get(self, namespace: str, key: str) -> int | None:
+        """Get the value for a key, if it hasn't expired yet.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to look up.
+
+        Returns:
+            int:
+            Returns the value for the key.
+        """
+        with self.transaction() as connection:
+            if state := connection.execute(
+                "SELECT value FROM session_state WHERE namespace=(?) AND key=(?) AND expiry > (?)",
+                (namespace, key, time.time()),
+            ).fetchone():
+                return state[0]
+
+    @fail_open(None)
+    def put(self, namespace: str, key: str, value: int, ttl: float) -> None:
+        """Set the value for a key.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to store.
+            value: Value to store.
+            ttl: Time-to-live in seconds for the key.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO session_state (namespace, key, value, expiry) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expiry = excluded.expiry",
+                (namespace, key, value, time.time() + ttl),
+            )
+
+    @fail_open(None)
+    def delete(self, namespace: str, key: str) -> int | None:
+        """Delete a key.
+
+        Args:
+            namespace: Namespace of the key.
+            key: Key to delete.
+
+        Returns:
+            int:
+            Returns the value of the deleted key.
+        """
+        with self.transaction() as connection:
+            if state := connection.execute(
+                "DELETE FROM session_state WHERE namespace=(?) AND key=(?) RETURNING value",
+                (namespace, key),
+            ).fetchone():
+                return state[0]
+
+    @fail_open(0)
+    def purge(self) -> int:
+        """Remove all the expired keys.
+
+        Returns:
+            int:
+            Returns the number of keys that were removed.
+        """
+        with self.transaction() as connection:
+            return connection.execute(
+                "DELETE FROM session_state WHERE expiry <= (?)", (time.time(),)
+            ).rowcount
+
+
+def purge() -> None:
+    """Removes the expired keys from the session state, to keep the memory/storage bounded.
+
+    See Also:
+        Triggered repeatedly at given intervals as a background task.
+    """
+    if purged := store.purge():
+        LOGGER.debug("Purged %d expired keys from the session state", purged)
+
+
+if settings.env_config.session_backend == settings.SessionBackend.sqlite:
+    store = SQLiteState(settings.env_config.database)
+else:
+    store = MemoryState(settings.env_config.session_capacity)
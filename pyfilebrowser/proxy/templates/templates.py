@@ -1,21 +1,70 @@
+import functools
+import os
 from http import HTTPStatus
 
 import jinja2
+from pydantic import FilePath
 from user_agents.parsers import UserAgent
 
 from pyfilebrowser.proxy import settings
 
+ENVIRONMENT = jinja2.Environment()
 
-def service_unavailable() -> str:
+
+@functools.lru_cache(maxsize=8)
+def compile_template(filepath: str, mtime: int) -> jinja2.Template:
+    """Compiles a jinja template from a file.
+
+    Args:
+        filepath: Path of the template file.
+        mtime: Modified time of the file in nanoseconds, so that the template is recompiled only when it changes.
+
+    Returns:
+        jinja2.Template:
+        Returns the compiled template.
+    """
+    with open(filepath) as file:
+        return ENVIRONMENT.from_string(file.read())
+
+
+@functools.lru_cache(maxsize=64)
+def render_template(filepath: str, mtime: int, **kwargs) -> bytes:
+    """Renders a compiled template, once for each set of parameters.
+
+    Args:
+        filepath: Path of the template file.
+        mtime: Modified time of the file in nanoseconds, so that the template is re-rendered only when it changes.
+
+    Returns:
+        bytes:
+        HTML content as encoded bytes.
+    """
+    return compile_template(filepath, mtime).render(**kwargs).encode()
+
+
+def render(filepath: FilePath, **kwargs) -> bytes:
+    """Renders a template file with the given parameters, reusing the cached content until the file is modified.
+
+    Args:
+        filepath: Path of the template file.
+
+    Returns:
+        bytes:
+        HTML content as encoded bytes.
+    """
+    filepath = str(filepath)
+    return render_template(filepath, os.stat(filepath).st_mtime_ns, **kwargs)
+
+
+def service_unavailable() -> bytes:
     """Constructs an error page using jina template for service unavailable.
 
     Returns:
-        str:
-        HTML content as string.
+        bytes:
+        HTML content as encoded bytes.
     """
-    with open(settings.env_config.error_page) as file:
-        error_template = file.read()
-    return jinja2.Template(error_template).render(
+    return render(
+        settings.env_config.error_page,
         title=HTTPStatus.SERVICE_UNAVAILABLE.phrase,
         summary=r"Unable to connect to the server ¯\_(ツ)_/¯",
         help="Nothing to do here!!\n\nSit back and relax while the server is napping.",
@@ -23,19 +72,18 @@ def service_unavailable() -> str:
     )
 
 
-def forbidden(origin: str) -> str:
+def forbidden(origin: str) -> bytes:
     """Constructs an error page using jina template for forbidden response.
 
     Args:
         origin: Origin that is forbidden.
 
     Returns:
-        str:
-        HTML content as string.
+        bytes:
+        HTML content as encoded bytes.
     """
-    with open(settings.env_config.error_page) as file:
-        error_template = file.read()
-    return jinja2.Template(error_template).render(
+    return render(
+        settings.env_config.error_page,
         title=HTTPStatus.FORBIDDEN.phrase,
         summary=HTTPStatus.FORBIDDEN.description,
         help=f"Requests from {origin!r} is not allowed",
@@ -43,19 +91,18 @@ def forbidden(origin: str) -> str:
     )
 
 
-def unsupported_browser(user_agent: UserAgent) -> str:
+def unsupported_browser(user_agent: UserAgent) -> bytes:
     """Constructs a warning page using jina template for unsupported browsers.
 
     Args:
         user_agent: User agent object.
 
     Returns:
-        str:
-        HTML content as string.
+        bytes:
+        HTML content as encoded bytes.
     """
-    with open(settings.env_config.warn_page) as file:
-        warn_template = file.read()
-    return jinja2.Template(warn_template).render(
+    return render(
+        settings.env_config.warn_page,
         browser_version=user_agent.browser.version_string,
         browser_name=user_agent.browser.family,
         recommendation="Firefox or Safari",
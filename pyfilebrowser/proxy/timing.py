@@ -0,0 +1,177 @@
+"""Module to time the phases of each request, and to log the slow requests.
+
+>>> Timing
+
+"""
+
+import collections
+import contextvars
+import logging
+import time
+from typing import Deque, Dict, List, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from pyfilebrowser.proxy import settings
+
+LOGGER = logging.getLogger("proxy")
+
+
+class Timer:
+    """Records the time spent in each phase of a request.
+
+    >>> Timer
+
+    """
+
+    __slots__ = ("method", "path", "start", "last", "phases")
+
+    def __init__(self, method: str, path: str):
+        """Instantiates the object, and starts the clock.
+
+        Args:
+            method: Method of the request.
+            path: Path of the request.
+        """
+        self.method = method
+        self.path = path
+        self.start = self.last = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        """Records the time since the previous mark, as the duration of a phase.
+
+        Args:
+            phase: Name of the phase that just ended.
+        """
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def header(self) -> str:
+        """Formats the phases as a ``Server-Timing`` header, with the durations in milliseconds."""
+        return ", ".join(
+            f"{phase};dur={duration * 1000:.3f}"
+            for phase, duration in (*self.phases, ("total", self.last - self.start))
+        )
+
+    def finish(self) -> None:
+        """Stores the timings in the ring buffer, and logs the request if it was slow."""
+        total = self.last - self.start
+        records.append((time.time(), self.method, self.path, total, tuple(self.phases)))
+        if total >= settings.env_config.timing.slow_threshold:
+            LOGGER.warning(
+                "Slow request %s %s took %.3fs [%s]",
+                self.method,
+                self.path,
+                total,
+                ", ".join(
+                    f"{phase}: {duration:.3f}s" for phase, duration in self.phases
+                ),
+            )
+
+
+class NullTimer:
+    """Timer that records nothing, so that the phases cost a no-op call when the timing is disabled.
+
+    >>> NullTimer
+
+    """
+
+    __slots__ = ()
+
+    def mark(self, phase: str) -> None:
+        """Ignores the phase."""
+
+
+NULL = NullTimer()
+# Timer of the request that is served in the current task
+current: contextvars.ContextVar[Timer | NullTimer] = contextvars.ContextVar(
+    "timer", default=NULL
+)
+# Timings of the recent requests, as a tuple of the timestamp, method, path, total and the phases
+# Appending to a bounded deque is atomic, so the buffer needs no lock
+records: Deque[Tuple[float, str, str, float, Tuple[Tuple[str, float], ...]]] = (
+    collections.deque(maxlen=settings.env_config.timing.buffer_size)
+)
+
+
+class Timing:
+    """ASGI middleware that times the phases of each request, from before the rate limits until the response headers.
+
+    >>> Timing
+
+    See Also:
+        - The timer is available to the endpoint and its dependencies through ``current``, to mark each phase.
+        - The timings are added as a ``Server-Timing`` header, when ``debug`` is enabled.
+        - The time to stream the response body is not included, as the headers are sent before the body.
+    """
+
+    def __init__(self, app: ASGIApp):
+        """Instantiates the object.
+
+        Args:
+            app: ASGI application to wrap.
+        """
+        self.app = app
+        self.debug = settings.env_config.debug
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serves a request with a timer, and finishes it when the response starts.
+
+        Args:
+            scope: Connection scope.
+            receive: Function to receive the messages from the client.
+            send: Function to send the messages to the client.
+        """
+        if scope["type"] != "http" or scope["path"] == settings.env_config.metrics_path:
+            await self.app(scope, receive, send)
+            return
+        timer = Timer(scope["method"], scope["path"])
+        started = False
+
+        async def timed(message: Message) -> None:
+            """Records the last phase, once the response headers are ready."""
+            nonlocal started
+            if message["type"] == "http.response.start" and not started:
+                started = True
+                timer.mark("response")
+                if self.debug:
+                    MutableHeaders(scope=message).append(
+                        "server-timing", timer.header()
+                    )
+                timer.finish()
+            await send(message)
+
+        token = current.set(timer)
+        try:
+            await self.app(scope, receive, timed)
+        finally:
+            current.reset(token)
+            # Requests that failed before their response started are recorded as well
+            if not started:
+                timer.mark("response")
+                timer.finish()
+
+
+def summary() -> Dict[str, Tuple[float, float]]:
+    """Summarizes the timings in the ring buffer.
+
+    Returns:
+        Dict[str, Tuple[float, float]]:
+        Returns the median and the 99th percentile in seconds, for each phase and the total.
+    """
+    durations: Dict[str, List[float]] = collections.defaultdict(list)
+    for *_, total, phases in records:
+        durations["total"].append(total)
+        for phase, duration in phases:
+            durations[phase].append(duration)
+    result = {}
+    for phase, values in durations.items():
+        values.sort()
+        result[phase] = (
+            values[len(values) // 2],
+            values[min(len(values) - 1, int(len(values) * 0.99))],
+        )
+    return result
@@ -0,0 +1,325 @@
+"""Module for the connection to the upstream filebrowser server, and its health.
+
+>>> Upstream
+
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import AsyncIterator, Awaitable, Callable, List
+
+import httpx
+
+from pyfilebrowser.proxy import metrics, settings
+
+LOGGER = logging.getLogger("proxy")
+# Time in seconds to fail fast after the server failed to connect, when the health probes are disabled
+COOLDOWN = 5
+# Trace events of the connection pool, when a new connection is opened
+CONNECT_STARTED = (
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+)
+CONNECT_COMPLETE = (
+    "connection.connect_tcp.complete",
+    "connection.connect_unix_socket.complete",
+)
+
+
+def connection_pool(socket: str | None = None) -> httpx.AsyncClient:
+    """Creates an asynchronous client with a shared connection pool for an upstream server.
+
+    See Also:
+        Connects to the upstream server over its unix domain socket when configured, and over TCP otherwise.
+
+    Args:
+        socket: Unix domain socket of the upstream server.
+
+    Returns:
+        httpx.AsyncClient:
+        Returns the async client object, configured with the pool limits from env vars.
+    """
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            uds=socket,
+            limits=httpx.Limits(
+                max_connections=settings.env_config.pool.max_connections,
+                max_keepalive_connections=settings.env_config.pool.max_keepalive_connections,
+                keepalive_expiry=settings.env_config.pool.keepalive_expiry,
+            ),
+        ),
+        timeout=settings.env_config.pool.timeout,
+    )
+
+
+class Upstream:
+    """Upstream server, along with its connection pool and the number of requests in flight.
+
+    >>> Upstream
+
+    """
+
+    def __init__(self, url: str, socket: str | None = None):
+        """Instantiates the object.
+
+        Args:
+            url: URL of the server.
+            socket: Unix domain socket of the server.
+        """
+        self.url = url
+        self.socket = socket
+        self.client = connection_pool(socket)
+        self.active = 0
+        self.connections = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    def __str__(self) -> str:
+        """Name of the server for logging."""
+        return f"upstream server [{self.socket or self.url}]"
+
+    @property
+    def healthy(self) -> bool:
+        """Checks if the server's circuit is closed, so that it can take requests."""
+        return self.down_until <= time.monotonic()
+
+    def failed(self, error: httpx.RequestError | str) -> None:
+        """Opens the server's circuit, to fail fast while it is unavailable.
+
+        See Also:
+            - The circuit is closed by the next successful health probe.
+            - When the health probes are disabled, the circuit is closed after a cooldown instead.
+
+        Args:
+            error: Error raised by the connection pool, or the reason the server is considered unavailable.
+        """
+        if self.healthy:
+            LOGGER.warning("%s is unavailable: %s", self, error)
+        if settings.env_config.health_check.interval:
+            self.down_until = math.inf
+        else:
+            self.down_until = time.monotonic() + COOLDOWN
+
+    def recovered(self) -> None:
+        """Closes the server's circuit, to forward the requests to it again."""
+        if not self.healthy:
+            LOGGER.info("%s is available again", self)
+        self.failures = 0
+        self.down_until = 0.0
+
+    async def probe(self) -> None:
+        """Probes the server's health endpoint, and opens or closes its circuit accordingly."""
+        try:
+            response = await self.client.get(
+                self.url + settings.env_config.health_check.path,
+                timeout=settings.env_config.health_check.timeout,
+                # Connections opened by the probes are reused by the requests, so they are counted as well
+                extensions=(
+                    {"trace": self.connect_timer()}
+                    if settings.env_config.metrics_path
+                    else None
+                ),
+            )
+        except httpx.HTTPError as error:
+            reason = f"{type(error).__name__}: {error}"
+        else:
+            if response.status_code < 500:
+                self.recovered()
+                return
+            reason = f"health check returned {response.status_code}"
+        self.failures += 1
+        if self.failures >= settings.env_config.health_check.failures:
+            self.failed(reason)
+
+    async def send(self, request: httpx.Request) -> httpx.Response:
+        """Sends a request to the server, and counts it as in flight until the response is closed.
+
+        Args:
+            request: Request to send.
+
+        Returns:
+            httpx.Response:
+            Returns the streamed response from the server.
+        """
+        self.active += 1
+        if settings.env_config.metrics_path:
+            request.extensions["trace"] = self.connect_timer()
+        start = time.perf_counter()
+        try:
+            response = await self.client.send(request, stream=True)
+        except BaseException:
+            self.active -= 1
+            raise
+        metrics.UPSTREAM_TTFB.observe(time.perf_counter() - start)
+        response.stream = ReleasingStream(response.stream, self, start)
+        return response
+
+    def connect_timer(self) -> Callable[[str, dict], Awaitable[None]]:
+        """Creates a trace callback for a request, that measures the time to open a new connection.
+
+        Returns:
+            Callable[[str, dict], Awaitable[None]]:
+            Returns the callback for the connection pool's ``trace`` extension.
+        """
+        started = 0.0
+
+        async def trace(event: str, _: dict) -> None:
+            """Observes the connection time, from the connection pool's trace events."""
+            nonlocal started
+            if event in CONNECT_STARTED:
+                started = time.perf_counter()
+            elif event in CONNECT_COMPLETE:
+                self.connections += 1
+                metrics.UPSTREAM_CONNECT.observe(time.perf_counter() - started)
+
+        return trace
+
+    async def monitor(self) -> None:
+        """Probes the health of the server at regular intervals, until cancelled."""
+        while True:
+            await self.probe()
+            await asyncio.sleep(settings.env_config.health_check.interval)
+
+
+class ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that releases the server's slot when it is closed, regardless of how it was consumed.
+
+    >>> ReleasingStream
+
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, upstream: Upstream, start: float):
+        """Instantiates the object.
+
+        Args:
+            stream: Original response stream.
+            upstream: Server the response came from.
+            start: Time when the request was sent, from ``time.perf_counter``
+        """
+        self.stream = stream
+        self.upstream = upstream
+        self.start = start
+        self.size = 0
+        self.released = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Iterates over the original response stream."""
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        """Closes the original response stream, and releases the server's slot."""
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                self.upstream.active -= 1
+                metrics.UPSTREAM_DURATION.observe(time.perf_counter() - self.start)
+                metrics.UPSTREAM_BYTES.inc(amount=self.size)
+
+
+class ReplayStream(httpx.AsyncByteStream):
+    """Response stream that replays the chunks that were already read, and continues with the rest of the stream.
+
+    >>> ReplayStream
+
+    """
+
+    def __init__(
+        self,
+        chunks: List[bytes],
+        iterator: AsyncIterator[bytes],
+        stream: httpx.AsyncByteStream,
+    ):
+        """Instantiates the object.
+
+        Args:
+            chunks: Chunks that were already read from the stream.
+            iterator: Iterator of the stream, positioned after the chunks.
+            stream: Original response stream.
+        """
+        self.chunks = chunks
+        self.iterator = iterator
+        self.stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Iterates over the chunks that were already read, followed by the rest of the stream."""
+        for chunk in self.chunks:
+            yield chunk
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def aclose(self) -> None:
+        """Closes the original response stream."""
+        await self.stream.aclose()
+
+
+async def buffer(response: httpx.Response, max_size: int) -> bytes | None:
+    """Reads the body of a streamed response into memory, up to a maximum size.
+
+    See Also:
+        - The response's stream is replaced, so that it can still be streamed to the client as usual.
+        - Bodies that are larger than ``max_size`` are not buffered, and the chunks that were read are replayed instead.
+
+    Args:
+        response: Response object from the upstream server, sent with ``stream=True``.
+        max_size: Maximum size of the body in bytes.
+
+    Returns:
+        bytes:
+        Returns the complete body, or ``None`` if it is larger than ``max_size``.
+    """
+    if int(response.headers.get("content-length") or 0) > max_size:
+        return
+    stream = response.stream
+    iterator = aiter(stream)
+    chunks = []
+    size = 0
+    try:
+        async for chunk in iterator:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_size:
+                response.stream = ReplayStream(chunks, iterator, stream)
+                return
+    except BaseException:
+        await stream.aclose()
+        raise
+    await stream.aclose()
+    body = b"".join(chunks)
+    response.stream = httpx.ByteStream(body)
+    return body
+
+
+server: Upstream | None = None
+
+
+metrics.Collected(
+    "proxy_upstream_active_requests",
+    "Requests in flight to the upstream server.",
+    (),
+    lambda: (((), server.active),) if server else (),
+)
+metrics.Collected(
+    "proxy_upstream_healthy",
+    "Whether the upstream server's circuit is closed.",
+    (),
+    lambda: (((), server.healthy),) if server else (),
+)
+metrics.Collected(
+    "proxy_upstream_connections_opened_total",
+    "Connections opened to the upstream server, which keep rising when the keep-alive connections are not reused.",
+    (),
+    lambda: (((), server.connections),) if server else (),
+    kind="counter",
+)
+metrics.Collected(
+    "proxy_upstream_max_connections",
+    "Maximum connections in the upstream server's connection pool.",
+    (),
+    lambda: (((), settings.env_config.pool.max_connections),),
+)
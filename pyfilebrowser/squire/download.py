@@ -84,6 +84,10 @@ class Executable(BaseModel):
         f"{filebrowser_os}-{filebrowser_arch}-filebrowser{filebrowser_dl_ext}"
     )
     filebrowser_db: str = f"{filebrowser_bin}.db"
+    # Fingerprint of the settings that were imported into the database
+    filebrowser_fingerprint: str = f"{filebrowser_db}.fingerprint"
+    # Unix domain socket that the server listens on, when the proxy is enabled without a socket
+    filebrowser_socket: str = f"{filebrowser_bin}.sock"
 
 
 executable = Executable()
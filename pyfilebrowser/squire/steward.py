@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import logging
 import os
 import re
@@ -13,6 +15,8 @@ from pyfilebrowser.modals import config, models, pydantic_config, users
 
 DATETIME_PATTERN = re.compile(r"^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2} ")
 LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+# Iterations of PBKDF2 for the fingerprints, since the content includes the users' passwords
+FINGERPRINT_ITERATIONS = 100_000
 
 
 def get_env(key: str, default: str = None, convert_to: Callable = None) -> str | None:
@@ -105,6 +109,41 @@ def validate_password(password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
 
 
+def fingerprint(content: bytes, salt: bytes | None = None) -> str:
+    """Returns a salted fingerprint for the given content, that doesn't reveal the secrets in it.
+
+    Args:
+        content: Content to fingerprint.
+        salt: Salt to use, generated randomly if not provided.
+
+    Returns:
+        str:
+        Fingerprint as the salt and the digest in hex, separated by a ``$``
+    """
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", content, salt, FINGERPRINT_ITERATIONS)
+    return f"{salt.hex()}${digest.hex()}"
+
+
+def validate_fingerprint(content: bytes, stored_fingerprint: str) -> bool:
+    """Validates whether the stored fingerprint matches the given content.
+
+    Args:
+        content: Content to fingerprint.
+        stored_fingerprint: Fingerprint that was stored previously.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate whether the content is unchanged.
+    """
+    salt, _, _ = stored_fingerprint.partition("$")
+    try:
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False
+    return hmac.compare_digest(fingerprint(content, salt), stored_fingerprint)
+
+
 def remove_trailing_underscore(dictionary: dict) -> dict:
     """Iterates through the dictionary and removes any key ending with an '_' underscore.
 
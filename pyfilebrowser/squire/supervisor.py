@@ -0,0 +1,148 @@
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+from typing import BinaryIO, List
+
+from pyfilebrowser.squire import download, steward
+
+# Matches the timestamp at the start of every line, so that a batch of lines is cleaned up in a single pass
+TIMESTAMP_PATTERN = re.compile(steward.DATETIME_PATTERN.pattern, re.MULTILINE)
+# Maximum bytes read from a pipe at once, all the complete lines in which are logged as a single record
+CHUNK_SIZE = 64 * 1024
+
+
+class Supervisor:
+    """Runs the filebrowser binary as a child process, and pumps its output into the logger.
+
+    >>> Supervisor
+
+    See Also:
+        - The binary is spawned without a shell, so that the signals reach the binary itself.
+        - Standard output and error are pumped by dedicated threads, so that neither of the pipes can fill up
+          and block the binary.
+        - Lines that are already in the pipe are logged together as one record, so that the logger keeps up
+          with the binary under high volume.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        arguments: List[str] | None = None,
+        stdout: bool = True,
+        prefix: str = "",
+    ):
+        """Instantiates the object and starts the binary.
+
+        Args:
+            logger: Logger to pump the output into.
+            arguments: Arguments to pass to the binary.
+            stdout: Boolean flag to show/hide standard output.
+            prefix: Prefix for each line of the output, to tell apart multiple binaries.
+        """
+        self.logger = logger
+        self.prefix = prefix
+        self.process = subprocess.Popen(
+            [
+                os.path.join(os.getcwd(), download.executable.filebrowser_bin),
+                *(arguments or []),
+            ],
+            stdout=subprocess.PIPE if stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        self.pumps = [
+            threading.Thread(target=self.pump, args=(stream, level), daemon=True)
+            for stream, level in (
+                (self.process.stdout, logging.INFO),
+                (self.process.stderr, logging.WARNING),
+            )
+            if stream
+        ]
+        for pump in self.pumps:
+            pump.start()
+
+    @property
+    def pid(self) -> int:
+        """Process ID of the binary."""
+        return self.process.pid
+
+    @property
+    def returncode(self) -> int | None:
+        """Exit status of the binary, or ``None`` while it is still running."""
+        return self.process.poll()
+
+    def pump(self, stream: BinaryIO, level: int) -> None:
+        """Logs the output from a pipe of the binary, until the pipe is closed.
+
+        Args:
+            stream: Standard output or error of the binary.
+            level: Level to log the output at.
+        """
+        partial = b""
+        # Returns as soon as there's any output, instead of waiting for the chunk to fill
+        while chunk := stream.read1(CHUNK_SIZE):
+            lines, _, partial = (partial + chunk).rpartition(b"\n")
+            if lines:
+                self.emit(lines, level)
+        if partial:
+            self.emit(partial, level)
+        stream.close()
+
+    def emit(self, lines: bytes, level: int) -> None:
+        """Logs a batch of lines as a single record, after removing the timestamps added by the binary.
+
+        Args:
+            lines: Complete lines of output.
+            level: Level to log the output at.
+        """
+        text = TIMESTAMP_PATTERN.sub("", lines.decode(errors="replace")).strip()
+        if not text:
+            return
+        if self.prefix:
+            text = self.prefix + text.replace("\n", "\n" + self.prefix)
+        self.logger.log(level, "%s", text)
+
+    def send_signal(self, signum: int) -> None:
+        """Forwards a signal to the binary, if it is still running.
+
+        Args:
+            signum: The signal number to forward.
+        """
+        if self.process.poll() is None:
+            self.logger.debug("Forwarding signal %d to PID: %d", signum, self.pid)
+            self.process.send_signal(signum)
+
+    def wait(self, timeout: float | None = None) -> int:
+        """Waits for the binary to exit, and for its remaining output to be logged.
+
+        Args:
+            timeout: Seconds to wait for the binary to exit.
+
+        Raises:
+            subprocess.TimeoutExpired:
+            If the binary is still running after the timeout.
+
+        Returns:
+            int:
+            Returns the exit status of the binary.
+        """
+        returncode = self.process.wait(timeout)
+        # Pipes may be held open by the commands the binary ran, so the pumps are not waited on indefinitely
+        for pump in self.pumps:
+            pump.join(timeout=1)
+        return returncode
+
+    def stop(self, timeout: float = 3) -> None:
+        """Terminates the binary, and kills it if it doesn't exit within the timeout.
+
+        Args:
+            timeout: Seconds to wait for the binary to exit gracefully.
+        """
+        self.send_signal(signal.SIGTERM)
+        try:
+            self.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.wait()
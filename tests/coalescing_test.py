@@ -0,0 +1,121 @@
+import asyncio
+from http import HTTPStatus
+from typing import AsyncIterator, Dict, List
+
+import httpx
+import pytest
+
+from pyfilebrowser.proxy import coalescing
+
+# Thumbnail served by the mock filebrowser server
+THUMBNAIL = b"\xff\xd8\xff" + bytes(4096)
+
+
+# Preview served by the mock filebrowser server in multiple chunks, and the size of each chunk
+PREVIEW = bytes(range(256)) * 1024
+CHUNK_SIZE = 16 * 1024
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """Upstream response body, that records each chunk it yields in the harness' timeline."""
+
+    def __init__(self, events: List[str]):
+        """Instantiates the object.
+
+        Args:
+            events: Timeline of the harness.
+        """
+        self.events = events
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Yields the preview in chunks, handing control back to the event loop between them."""
+        for start in range(0, len(PREVIEW), CHUNK_SIZE):
+            self.events.append("upstream")
+            stop = start + CHUNK_SIZE
+            yield PREVIEW[start:stop]
+            await asyncio.sleep(0)
+
+
+def harness_for(proxy, headers: Dict[str, str]):
+    """Creates the harness in front of a mock filebrowser server, that serves a thumbnail slowly."""
+
+    async def preview(request: httpx.Request) -> httpx.Response:
+        """Serves the thumbnail or the chunked preview, after the identical requests have arrived."""
+        await asyncio.sleep(0.05)
+        if request.url.path.startswith("/api/preview/big/"):
+            stream = ChunkedStream(instance.events)
+        else:
+            stream = httpx.ByteStream(THUMBNAIL)
+        return httpx.Response(
+            HTTPStatus.OK.value,
+            headers={"content-type": "image/jpeg", **headers},
+            stream=stream,
+        )
+
+    instance = proxy(preview)
+    return instance
+
+
+async def concurrently(harness, encodings: List[str]) -> List[bytes]:
+    """Sends identical requests for the thumbnail at the same time, each accepting the given encodings."""
+    responses = await asyncio.gather(
+        *(
+            harness.get("/api/preview/thumb/image.jpg", {"accept-encoding": encoding})
+            for encoding in encodings
+        )
+    )
+    return [body for _, _, body in responses]
+
+
+@pytest.fixture(autouse=True)
+def flights(monkeypatch: pytest.MonkeyPatch):
+    """Starts each test without any requests in flight."""
+    monkeypatch.setattr(coalescing, "flights", {})
+
+
+def test_same_encodings_shared(proxy):
+    """Identical requests that accept the same encodings, written differently, share a single upstream request."""
+    harness = harness_for(proxy, {})
+    bodies = asyncio.run(concurrently(harness, ["gzip, br", "br,gzip", "GZIP, BR"]))
+    assert bodies == [THUMBNAIL] * 3
+    assert len(harness.requests) == 1
+
+
+def test_different_encodings_not_shared(proxy):
+    """Requests that accept different encodings are sent on their own, as the upstream may encode them differently."""
+    harness = harness_for(proxy, {})
+    asyncio.run(concurrently(harness, ["gzip", "identity"]))
+    assert len(harness.requests) == 2
+
+
+def test_vary_not_shared(proxy):
+    """Responses that vary on a header outside the key are not shared with the waiting requests."""
+    harness = harness_for(proxy, {"vary": "accept-encoding, cookie"})
+    bodies = asyncio.run(concurrently(harness, ["gzip", "gzip"]))
+    assert bodies == [THUMBNAIL] * 2
+    assert len(harness.requests) == 2
+
+
+def test_leader_streamed(proxy):
+    """The first request's client receives the body as it is streamed, when no identical request joined it."""
+    harness = harness_for(proxy, {})
+    _, _, body = asyncio.run(harness.get("/api/preview/big/image.jpg"))
+    assert body == PREVIEW
+    last_upstream = len(harness.events) - 1 - harness.events[::-1].index("upstream")
+    assert harness.events.index("client") < last_upstream, harness.events
+
+
+def test_followers_teed(proxy):
+    """Identical requests receive the complete body teed from a single upstream response, streamed in chunks."""
+    harness = harness_for(proxy, {})
+
+    async def concurrent() -> List[bytes]:
+        """Sends identical requests for the preview at the same time."""
+        responses = await asyncio.gather(
+            *(harness.get("/api/preview/big/image.jpg") for _ in range(3))
+        )
+        return [body for _, _, body in responses]
+
+    assert asyncio.run(concurrent()) == [PREVIEW] * 3
+    assert len(harness.requests) == 1
+    assert not coalescing.flights
@@ -0,0 +1,77 @@
+import asyncio
+import gzip
+import json
+import threading
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from pyfilebrowser.proxy import compression
+
+# Search results served by the mock filebrowser server, several batches long
+RESULTS = json.dumps(
+    {"items": [{"name": f"file-{index}.txt", "size": index} for index in range(8192)]}
+).encode()
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """Streams the search results in small chunks, the way a chunked upstream response arrives."""
+
+    async def __aiter__(self):
+        """Yields 4 KB chunks of the search results."""
+        for start in range(0, len(RESULTS), 4096):
+            yield RESULTS[start:][:4096]
+
+
+def test_batched_off_loop(proxy, monkeypatch: pytest.MonkeyPatch):
+    """Small chunks are coalesced into batches, which are compressed in a worker thread."""
+    calls = []
+    encode = compression.GzipEncoder.compress
+
+    def record(self, chunk: bytes) -> bytes:
+        """Records the size of each chunk given to the encoder, and the thread that compresses it."""
+        calls.append((len(chunk), threading.current_thread()))
+        return encode(self, chunk)
+
+    monkeypatch.setattr(compression.GzipEncoder, "compress", record)
+
+    async def search(_: httpx.Request) -> httpx.Response:
+        """Serves the search results as a chunked response."""
+        return httpx.Response(
+            HTTPStatus.OK.value,
+            headers={"content-type": "application/json"},
+            stream=ChunkedStream(),
+        )
+
+    status, headers, body = asyncio.run(
+        proxy(search).get("/api/search/", {"accept-encoding": "gzip"})
+    )
+    assert status == HTTPStatus.OK.value
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == RESULTS
+    assert len(calls) == -(-len(RESULTS) // compression.BATCH_SIZE)
+    assert all(size >= compression.BATCH_SIZE for size, _ in calls[:-1])
+    assert all(thread is not threading.main_thread() for _, thread in calls)
+
+
+def test_vary_merged():
+    """``accept-encoding`` is merged into the upstream's ``vary``, instead of adding another header."""
+    headers = compression.encode_headers(
+        [(b"vary", b"Cookie"), (b"content-length", b"2048"), (b"etag", b'"abc"')],
+        "gzip",
+    )
+    assert headers == [
+        (b"content-encoding", b"gzip"),
+        (b"vary", b"Cookie, accept-encoding"),
+        (b"etag", b'W/"abc"'),
+    ]
+
+
+def test_vary_not_duplicated():
+    """Upstream responses that already vary on ``accept-encoding`` keep their ``vary`` as-is."""
+    for vary in (b"Accept-Encoding", b"cookie, accept-encoding", b"*"):
+        headers = compression.encode_headers([(b"vary", vary)], "gzip")
+        assert [value for key, value in headers if key == b"vary"] == [vary]
+    headers = compression.encode_headers([], "gzip")
+    assert [value for key, value in headers if key == b"vary"] == [b"accept-encoding"]
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import tempfile
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+import pytest
+
+# Settings are loaded when the package is imported, so the environment is prepared before any test module imports it
+WORKDIR = tempfile.mkdtemp(prefix="pyfb-tests-")
+os.environ.setdefault("ROOT", WORKDIR)
+os.environ.setdefault("SECRETS_PATH", WORKDIR)
+os.chdir(WORKDIR)
+
+from pyfilebrowser.proxy import server, settings, upstream  # noqa: E402
+
+Handler = Callable[[httpx.Request], Awaitable[httpx.Response]]
+
+
+class Harness:
+    """Proxy app in front of a mock filebrowser server, called directly through ASGI.
+
+    >>> Harness
+
+    See Also:
+        Events of the upstream stream and the messages to the client are recorded in a single timeline,
+        to tell whether the body was streamed or buffered by the proxy.
+    """
+
+    def __init__(self, handler: Handler):
+        """Instantiates the object.
+
+        Args:
+            handler: Handler of the mock filebrowser server.
+        """
+        self.events: List[str] = []
+        self.requests: List[httpx.Request] = []
+
+        async def record(request: httpx.Request) -> httpx.Response:
+            """Records the request sent to the mock filebrowser server, before handling it."""
+            self.requests.append(request)
+            return await handler(request)
+
+        upstream.server = upstream.Upstream("http://filebrowser")
+        upstream.server.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(record)
+        )
+        self.app = server.create_app()
+
+    async def get(
+        self, path: str, headers: Dict[str, str] | None = None
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Sends a GET request to the proxy.
+
+        Args:
+            path: Request path.
+            headers: Request headers.
+
+        Returns:
+            Tuple[int, Dict[str, str], bytes]:
+            Returns the status code, headers and body of the response.
+        """
+        done = asyncio.Event()
+        status, response_headers, body = 0, {}, []
+        received = False
+
+        async def receive() -> dict:
+            """Sends an empty request body, and disconnects once the response is complete."""
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message: dict) -> None:
+            """Records the messages sent to the client."""
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = {
+                    key.decode(): value.decode() for key, value in message["headers"]
+                }
+            elif message["type"] == "http.response.body":
+                if message.get("body"):
+                    self.events.append("client")
+                    body.append(message["body"])
+                if not message.get("more_body"):
+                    done.set()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (key.lower().encode(), value.encode())
+                for key, value in {"host": "testserver", **(headers or {})}.items()
+            ],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        await self.app(scope, receive, send)
+        return status, response_headers, b"".join(body)
+
+
+@pytest.fixture
+def proxy(monkeypatch: pytest.MonkeyPatch) -> Callable[[Handler], Harness]:
+    """Creates the proxy harness, with the test client's hostname allowed by the firewall."""
+    monkeypatch.setattr(settings.session, "allowed_origins", frozenset({"testserver"}))
+    monkeypatch.setattr(upstream, "server", None)
+    return Harness
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from pyfilebrowser.proxy import database, settings
+
+
+def test_import_creates_no_files():
+    """Importing the proxy doesn't create the database, or the sidecar files of its WAL mode."""
+    for suffix in ("", "-wal", "-shm"):
+        assert not os.path.exists(settings.env_config.database + suffix)
+
+
+def test_forbidden_from_memory(proxy, monkeypatch: pytest.MonkeyPatch):
+    """Requests from a banned host are rejected from the in-memory ban table, before reaching the upstream."""
+
+    async def handler(_: httpx.Request) -> httpx.Response:
+        """Serves an empty response, which must not be reached."""
+        return httpx.Response(HTTPStatus.OK.value)
+
+    harness = proxy(handler)
+    monkeypatch.setitem(database.bans, "127.0.0.1", int(time.time()) + 60)
+    status, _, _ = asyncio.run(harness.get("/api/resources/"))
+    assert status == HTTPStatus.FORBIDDEN.value
+    assert not harness.requests
+    assert not os.path.exists(settings.env_config.database)
+
+
+def test_purge_expired(monkeypatch: pytest.MonkeyPatch):
+    """Expired bans are purged from the in-memory ban table, while the unexpired ones are kept."""
+    now = int(time.time())
+    monkeypatch.setattr(database, "bans", {"10.0.0.1": now - 1, "10.0.0.2": now + 60})
+    monkeypatch.setattr(database, "writes", database.queue.Queue())
+    database.purge()
+    assert database.bans == {"10.0.0.2": now + 60}
+
+
+def test_refresh(tmp_path, monkeypatch: pytest.MonkeyPatch):
+    """Bans of the other workers are refreshed from the database, without dropping the ones yet to be written."""
+    now = int(time.time())
+    monkeypatch.setattr(
+        database, "database", database.Database(str(tmp_path / "auth.db"))
+    )
+    monkeypatch.setattr(database, "REFRESH_INTERVAL", 0)
+    monkeypatch.setattr(database, "bans", {"10.0.0.1": now + 60})
+    monkeypatch.setattr(database, "pending", {"10.0.0.1": now + 60})
+    database.database.create_table(
+        "auth_errors", ["host TEXT PRIMARY KEY", "block_until INTEGER NOT NULL"]
+    )
+    with database.database.connection:
+        database.database.connection.execute(
+            "INSERT INTO auth_errors VALUES (?,?)", ("10.0.0.2", now + 60)
+        )
+
+    async def refresh() -> None:
+        """Runs the refresh for a few iterations."""
+        task = asyncio.create_task(database.refresh())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(refresh())
+    assert database.bans == {"10.0.0.1": now + 60, "10.0.0.2": now + 60}
+    assert database.pending == {"10.0.0.1": now + 60}
+    # Once written through, the ban is left to the database, which then drops it when unbanned by another worker
+    with database.database.connection:
+        database.database.connection.execute(
+            "INSERT INTO auth_errors VALUES (?,?)", ("10.0.0.1", now + 60)
+        )
+    asyncio.run(refresh())
+    assert not database.pending
+    with database.database.connection:
+        database.database.connection.execute("DELETE FROM auth_errors")
+    asyncio.run(refresh())
+    assert not database.bans
@@ -0,0 +1,66 @@
+import asyncio
+import time
+from http import HTTPStatus
+
+import httpx
+import pydantic
+import pytest
+
+from pyfilebrowser.proxy import database, metrics, settings
+
+
+@pytest.fixture
+def harness(proxy, monkeypatch: pytest.MonkeyPatch):
+    """Proxy with the metrics enabled, in front of a mock filebrowser server."""
+    monkeypatch.setattr(settings.env_config, "metrics_path", "/proxy/metrics")
+
+    async def handler(_: httpx.Request) -> httpx.Response:
+        """Serves an empty response, which the metrics must never be proxied to."""
+        return httpx.Response(HTTPStatus.OK.value)
+
+    return proxy(handler)
+
+
+def test_export(harness):
+    """Metrics are served by the proxy itself, including the upstream server's own counters."""
+    status, headers, body = asyncio.run(harness.get("/proxy/metrics"))
+    assert status == HTTPStatus.OK.value
+    assert headers["content-type"].startswith("text/plain")
+    assert b"proxy_upstream_connections_opened_total 0" in body
+    assert not harness.requests
+
+
+def test_forbidden_host(harness, monkeypatch: pytest.MonkeyPatch):
+    """Hosts that are forbidden due to repeated login failures cannot scrape the metrics."""
+    monkeypatch.setitem(database.bans, "127.0.0.1", int(time.time()) + 60)
+    status, _, _ = asyncio.run(harness.get("/proxy/metrics"))
+    assert status == HTTPStatus.FORBIDDEN.value
+
+
+def test_token(harness, monkeypatch: pytest.MonkeyPatch):
+    """Metrics are served only to the scrapers that send the bearer token, when one is set."""
+    monkeypatch.setattr(settings.env_config, "metrics_token", "secret")
+    status, headers, _ = asyncio.run(harness.get("/proxy/metrics"))
+    assert status == HTTPStatus.UNAUTHORIZED.value
+    assert headers["www-authenticate"] == "Bearer"
+    status, _, _ = asyncio.run(
+        harness.get("/proxy/metrics", {"authorization": "Bearer wrong"})
+    )
+    assert status == HTTPStatus.UNAUTHORIZED.value
+    status, _, body = asyncio.run(
+        harness.get("/proxy/metrics", {"authorization": "Bearer secret"})
+    )
+    assert status == HTTPStatus.OK.value
+    assert b"proxy_requests_total" in body
+
+
+def test_abstract_metric():
+    """Metrics that don't yield their samples cannot be instantiated."""
+    with pytest.raises(TypeError):
+        metrics.Metric("proxy_test", "Abstract metric.")
+
+
+def test_multiple_workers():
+    """Metrics are refused with multiple workers, since each worker counts only its own requests."""
+    with pytest.raises(pydantic.ValidationError, match="single worker"):
+        settings.EnvConfig(metrics_path="/proxy/metrics", workers=2)
@@ -0,0 +1,114 @@
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Tuple
+
+import pytest
+
+from pyfilebrowser.proxy import settings
+
+# Path served by the mock endpoints, mapped to the delay in seconds, status code and body of the response
+ROUTES: Dict[str, Tuple[float, int, bytes]] = {
+    "/fast": (0, HTTPStatus.OK.value, b"203.0.113.1\n"),
+    "/slow": (0.5, HTTPStatus.OK.value, b"203.0.113.2\n"),
+    "/hang": (5, HTTPStatus.OK.value, b"203.0.113.3\n"),
+    "/error": (0, HTTPStatus.INTERNAL_SERVER_ERROR.value, b"203.0.113.4\n"),
+    "/invalid": (0, HTTPStatus.OK.value, b"not an address\n"),
+    "/json": (0, HTTPStatus.OK.value, b'{"origin": "203.0.113.5"}'),
+    "/ipv6": (0, HTTPStatus.OK.value, b"2001:db8::1\n"),
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Responds to the mock endpoints, and records the paths that were requested."""
+
+    hits: List[str] = []
+
+    def do_GET(self) -> None:
+        """Responds after the route's delay, with its status code and body."""
+        self.hits.append(self.path)
+        delay, status, body = ROUTES[self.path]
+        time.sleep(delay)
+        self.send_response(status)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        """Silences the access logs."""
+
+
+class Server(ThreadingHTTPServer):
+    """Server of the mock endpoints, whose handlers run in daemon threads."""
+
+    daemon_threads = True
+
+    def handle_error(self, *args) -> None:
+        """Silences the errors from the connections, that were abandoned by the resolver."""
+
+
+@pytest.fixture
+def endpoint(monkeypatch: pytest.MonkeyPatch) -> Iterator:
+    """Serves the mock endpoints, with an empty cache for the public IP address."""
+    monkeypatch.setattr(settings, "public_ip_cache", {})
+    monkeypatch.setattr(Handler, "hits", [])
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    yield lambda *paths, parser=settings._text: {base + path: parser for path in paths}
+    server.shutdown()
+    server.server_close()
+
+
+def test_first_responder_wins(endpoint):
+    """The first valid address is returned, without waiting for the slower endpoints."""
+    start = time.time()
+    assert (
+        settings.public_ip_address(endpoint("/hang", "/slow", "/fast")) == "203.0.113.1"
+    )
+    assert time.time() - start < 0.5
+
+
+def test_invalid_responses_skipped(endpoint):
+    """Errors and invalid addresses are skipped, in favor of a slower endpoint with a valid one."""
+    assert (
+        settings.public_ip_address(endpoint("/error", "/invalid", "/slow"))
+        == "203.0.113.2"
+    )
+
+
+def test_json_endpoint(endpoint):
+    """Endpoints that respond with JSON are parsed with their own function."""
+    assert (
+        settings.public_ip_address(endpoint("/json", parser=settings._json))
+        == "203.0.113.5"
+    )
+
+
+def test_all_endpoints_fail(endpoint):
+    """No address is returned, when all the endpoints fail."""
+    assert settings.public_ip_address(endpoint("/error", "/invalid")) is None
+    assert settings.public_ip_cache == {}
+
+
+def test_deadline(endpoint):
+    """Endpoints that don't respond are abandoned at the deadline of 3 seconds."""
+    start = time.time()
+    assert settings.public_ip_address(endpoint("/hang", "/error")) is None
+    assert 3 <= time.time() - start < 4
+
+
+def test_ttl_cache(endpoint):
+    """The resolved address is reused until its time-to-live expires."""
+    assert settings.public_ip_address(endpoint("/fast"), ttl=30) == "203.0.113.1"
+    assert settings.public_ip_address(endpoint("/slow")) == "203.0.113.1"
+    assert Handler.hits == ["/fast"]
+    settings.public_ip_cache["address"] = ("203.0.113.1", time.time() - 1)
+    assert settings.public_ip_address(endpoint("/slow")) == "203.0.113.2"
+    assert Handler.hits == ["/fast", "/slow"]
+
+
+def test_ipv6(endpoint):
+    """IPv6 addresses are valid answers as well."""
+    assert settings.public_ip_address(endpoint("/ipv6")) == "2001:db8::1"
@@ -0,0 +1,116 @@
+import asyncio
+from http import HTTPStatus
+from typing import AsyncIterator, List
+
+import httpx
+import pytest
+
+# Size of the video served by the mock filebrowser server, and the chunks it is streamed in
+VIDEO = bytes(range(256)) * 4096
+CHUNK_SIZE = 64 * 1024
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """Upstream response body, that records each chunk it yields in the harness' timeline."""
+
+    def __init__(self, body: bytes, events: List[str]):
+        """Instantiates the object.
+
+        Args:
+            body: Complete response body.
+            events: Timeline of the harness.
+        """
+        self.body = body
+        self.events = events
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Yields the body in chunks, handing control back to the event loop between them."""
+        for start in range(0, len(self.body), CHUNK_SIZE):
+            self.events.append("upstream")
+            stop = start + CHUNK_SIZE
+            yield self.body[start:stop]
+            await asyncio.sleep(0)
+
+
+@pytest.fixture
+def harness(proxy):
+    """Proxy in front of a mock filebrowser server, that serves byte ranges of a video like its raw endpoint."""
+
+    async def raw(request: httpx.Request) -> httpx.Response:
+        """Serves a single byte range of the video, or the complete video."""
+        headers = {"accept-ranges": "bytes", "content-type": "video/mp4"}
+        if not (byte_range := request.headers.get("range")):
+            return httpx.Response(
+                HTTPStatus.OK.value,
+                headers={**headers, "content-length": str(len(VIDEO))},
+                stream=ChunkedStream(VIDEO, instance.events),
+            )
+        start, _, end = byte_range.removeprefix("bytes=").partition("-")
+        start, end = int(start), int(end) if end else len(VIDEO) - 1
+        stop = end + 1
+        body = VIDEO[start:stop]
+        return httpx.Response(
+            HTTPStatus.PARTIAL_CONTENT.value,
+            headers={
+                **headers,
+                "content-length": str(len(body)),
+                "content-range": f"bytes {start}-{end}/{len(VIDEO)}",
+            },
+            stream=ChunkedStream(body, instance.events),
+        )
+
+    instance = proxy(raw)
+    return instance
+
+
+def assert_streamed(events: List[str]) -> None:
+    """Asserts that the client received the first chunk before the upstream server sent the last one."""
+    assert events.count("upstream") > 1
+    last_upstream = len(events) - 1 - events[::-1].index("upstream")
+    assert events.index("client") < last_upstream, events
+
+
+@pytest.mark.parametrize(
+    "byte_range, start, end",
+    [
+        ("bytes=0-1023", 0, 1023),
+        ("bytes=262144-524287", 262_144, 524_287),
+        ("bytes=786432-", 786_432, len(VIDEO) - 1),
+    ],
+    ids=["first-kilobyte", "middle", "open-ended"],
+)
+def test_range(harness, byte_range: str, start: int, end: int):
+    """Single and open-ended byte ranges are passed through with the upstream's content range."""
+    status, headers, body = asyncio.run(
+        harness.get(
+            "/api/raw/video.mp4",
+            {"range": byte_range, "accept-encoding": "gzip, br"},
+        )
+    )
+    assert status == HTTPStatus.PARTIAL_CONTENT.value
+    assert headers["content-range"] == f"bytes {start}-{end}/{len(VIDEO)}"
+    assert headers["content-length"] == str(end - start + 1)
+    assert "content-encoding" not in headers
+    stop = end + 1
+    assert body == VIDEO[start:stop]
+    (upstream_request,) = harness.requests
+    assert upstream_request.headers["range"] == byte_range
+    # Ranges must map onto the stored file, so the upstream is never asked for a compressed representation
+    assert upstream_request.headers["accept-encoding"] == "identity"
+
+
+@pytest.mark.parametrize("byte_range", ["bytes=0-", "bytes=65536-"])
+def test_range_streamed(harness, byte_range: str):
+    """Large ranges reach the client chunk by chunk, instead of being buffered by the proxy."""
+    status, _, _ = asyncio.run(harness.get("/api/raw/video.mp4", {"range": byte_range}))
+    assert status == HTTPStatus.PARTIAL_CONTENT.value
+    assert_streamed(harness.events)
+
+
+def test_without_range(harness):
+    """Requests without a range get the complete video, which is streamed as well."""
+    status, headers, body = asyncio.run(harness.get("/api/raw/video.mp4"))
+    assert status == HTTPStatus.OK.value
+    assert headers["accept-ranges"] == "bytes"
+    assert body == VIDEO
+    assert_streamed(harness.events)
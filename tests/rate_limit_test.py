@@ -0,0 +1,120 @@
+import base64
+import json
+import secrets
+import time
+from http import HTTPStatus
+
+import pytest
+from fastapi import HTTPException, Request
+
+from pyfilebrowser.proxy import rate_limit, settings, state
+
+
+def request(path: str, token: str | None = None, client: str = "10.0.0.1") -> Request:
+    """Creates a request object, with an optional auth token."""
+    headers = [(b"host", b"testserver")]
+    if token:
+        headers.append((b"x-auth", token.encode()))
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": headers,
+            "client": (client, 50000),
+            "server": ("testserver", 80),
+            "scheme": "http",
+        }
+    )
+
+
+def forged_token() -> str:
+    """Creates an unsigned token, with a random username in its payload."""
+    payload = json.dumps({"user": {"username": secrets.token_hex(8)}}).encode()
+    return f"e30.{base64.urlsafe_b64encode(payload).decode().rstrip('=')}.forged"
+
+
+def limiter(**kwargs) -> rate_limit.RateLimiter:
+    """Creates a rate limiter, with its own namespace so that the tests don't share counters."""
+    return rate_limit.RateLimiter(
+        settings.RateLimit(max_requests=3, seconds=60, **kwargs)
+    )
+
+
+def test_user_key_forged_tokens():
+    """A client cannot escape a user limit, by sending a different token with each request."""
+    rps = limiter(key="user", route="/api/forged")
+    for _ in range(3):
+        rps.init(request("/api/forged", forged_token()))
+    with pytest.raises(HTTPException) as error:
+        rps.init(request("/api/forged", forged_token()))
+    assert error.value.status_code == HTTPStatus.TOO_MANY_REQUESTS.value
+
+
+def test_user_key_shared_session():
+    """A session is limited across clients, when its token is used from multiple addresses."""
+    rps = limiter(key="user", route="/api/shared")
+    token = forged_token()
+    for index in range(3):
+        rps.init(request("/api/shared", token, client=f"10.0.1.{index}"))
+    with pytest.raises(HTTPException):
+        rps.init(request("/api/shared", token, client="10.0.1.9"))
+
+
+def test_route_boundary():
+    """Routes match the path and its sub-paths, but not the paths that merely share the prefix."""
+    rps = limiter(route="/api/raw")
+    for _ in range(10):
+        rps.init(request("/api/rawfoo"))
+    for path in ("/api/raw", "/api/raw/a.mp4", "/api/raw/b.mp4"):
+        rps.init(request(path, client="10.0.2.1"))
+    with pytest.raises(HTTPException):
+        rps.init(request("/api/raw/c.mp4", client="10.0.2.1"))
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Runs the test against each session state backend."""
+    if request.param == "sqlite":
+        backend = state.SQLiteState(str(tmp_path / "state.db"))
+    else:
+        backend = state.MemoryState()
+    monkeypatch.setattr(state, "store", backend)
+
+
+def test_sliding_window(store):
+    """Previous window's count is carried over by its overlap, and the rejected requests are not counted."""
+    rps = rate_limit.RateLimiter(settings.RateLimit(max_requests=10, seconds=60))
+    start = 600
+    admitted = [rps.admitted(["10.0.3.1"], start + 59) for _ in range(12)]
+    assert admitted.count(True) == 10
+    # A quarter into the next window, three quarters of the previous one still count: 7.5 + 2 <= 10
+    admitted = [rps.admitted(["10.0.3.1"], start + 75) for _ in range(5)]
+    assert admitted == [True, True, False, False, False]
+    # Three quarters into it, only a quarter of the previous one counts: 2.5 + 7 <= 10
+    admitted = [rps.admitted(["10.0.3.1"], start + 105) for _ in range(6)]
+    assert admitted == [True] * 5 + [False]
+
+
+def test_idle_expiry(store, monkeypatch: pytest.MonkeyPatch):
+    """Windows of an idle client expire, and nothing is carried over once a whole window has passed."""
+    rps = rate_limit.RateLimiter(settings.RateLimit(max_requests=3, seconds=60))
+    monkeypatch.setattr(time, "time", lambda: 1000.0)
+    assert all(rps.admitted(["10.0.3.2"], 1000.0) for _ in range(3))
+    assert not rps.admitted(["10.0.3.2"], 1000.0)
+    assert state.store.purge() == 0
+    # Keys live for two windows, so that they can be carried over into the next one
+    monkeypatch.setattr(time, "time", lambda: 1000.0 + 120)
+    assert state.store.purge() == 1
+    assert all(rps.admitted(["10.0.3.2"], 1000.0 + 120) for _ in range(3))
+
+
+def test_all_identifiers_admitted(store):
+    """A request rejected for one of its identifiers is not counted against the others."""
+    rps = rate_limit.RateLimiter(settings.RateLimit(max_requests=2, seconds=60))
+    assert rps.admitted(["session:a"], 0)
+    assert rps.admitted(["session:a"], 0)
+    assert not rps.admitted(["10.0.3.3", "session:a"], 0)
+    assert rps.admitted(["10.0.3.3", "session:b"], 0)
+    assert rps.admitted(["10.0.3.3", "session:b"], 0)
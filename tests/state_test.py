@@ -0,0 +1,29 @@
+import sqlite3
+import time
+
+from pyfilebrowser.proxy import state
+
+
+def test_sqlite_fails_open(tmp_path):
+    """Statements give up after the busy timeout while another worker holds the database, and let the request in."""
+    store = state.SQLiteState(str(tmp_path / "state.db"))
+    assert store.increment("auth_counter", "10.0.0.1", 60) == 1
+    other = sqlite3.connect(str(tmp_path / "state.db"), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.perf_counter()
+        assert store.increment("auth_counter", "10.0.0.1", 60) == 0
+        assert store.delete("auth_counter", "10.0.0.1") is None
+        assert time.perf_counter() - start < 1
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert store.increment("auth_counter", "10.0.0.1", 60) == 2
+
+
+def test_sqlite_lock_timeout(tmp_path):
+    """Statements give up after the busy timeout while another thread of the same worker holds the lock."""
+    store = state.SQLiteState(str(tmp_path / "state.db"))
+    with store.lock:
+        assert store.get("auth_counter", "10.0.0.1") is None
+        assert store.purge() == 0
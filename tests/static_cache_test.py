@@ -0,0 +1,61 @@
+import asyncio
+import gzip
+import threading
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from pyfilebrowser.proxy import cache
+
+# Script served by the mock filebrowser server, without an ETag
+SCRIPT = b"console.log('filebrowser');\n" * 512
+
+
+@pytest.fixture
+def harness(proxy, monkeypatch: pytest.MonkeyPatch):
+    """Proxy with an empty static cache, in front of a mock filebrowser server that serves a script."""
+    monkeypatch.setattr(cache, "store", cache.StaticCache(1_048_576))
+
+    async def static(_: httpx.Request) -> httpx.Response:
+        """Serves the script, without any validators."""
+        return httpx.Response(
+            HTTPStatus.OK.value,
+            headers={"content-type": "application/javascript"},
+            content=SCRIPT,
+        )
+
+    return proxy(static)
+
+
+def test_compressed_off_loop(harness, monkeypatch: pytest.MonkeyPatch):
+    """Variants are compressed in a worker thread, and served to the clients that accept them."""
+    threads = []
+    compress = cache.compress
+
+    def record(*args) -> dict:
+        """Records the thread that compresses the asset."""
+        threads.append(threading.current_thread())
+        return compress(*args)
+
+    monkeypatch.setattr(cache, "compress", record)
+    status, headers, body = asyncio.run(
+        harness.get("/static/js/app.js", {"accept-encoding": "gzip"})
+    )
+    assert status == HTTPStatus.OK.value
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.decompress(body) == SCRIPT
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_unchanged_body_reused(harness):
+    """Revalidations that return the same body keep the cached entry, instead of compressing it again."""
+    asyncio.run(harness.get("/static/js/app.js"))
+    entry = cache.store.get("/static/js/app.js")
+    entry.expiry = 0
+    status, headers, body = asyncio.run(harness.get("/static/js/app.js"))
+    assert status == HTTPStatus.OK.value
+    assert body == SCRIPT
+    assert len(harness.requests) == 2
+    assert cache.store.get("/static/js/app.js") is entry
+    assert entry.expiry > 0
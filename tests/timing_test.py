@@ -0,0 +1,65 @@
+import asyncio
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from pyfilebrowser.proxy import settings, state, timing
+
+
+@pytest.fixture
+def harness(proxy, monkeypatch: pytest.MonkeyPatch):
+    """Proxy with the timing and a rate limit enabled, in front of a mock filebrowser server."""
+    monkeypatch.setattr(settings.env_config.timing, "enabled", True)
+    monkeypatch.setattr(settings.env_config, "debug", True)
+    monkeypatch.setattr(
+        settings.env_config,
+        "rate_limit",
+        [settings.RateLimit(max_requests=1, seconds=60)],
+    )
+    monkeypatch.setattr(state, "store", state.MemoryState(1_000))
+    monkeypatch.setattr(timing, "records", timing.collections.deque(maxlen=2))
+
+    async def handler(_: httpx.Request) -> httpx.Response:
+        """Serves an empty listing."""
+        return httpx.Response(
+            HTTPStatus.OK.value,
+            headers={"content-type": "application/json"},
+            stream=httpx.ByteStream(b'{"items": []}'),
+        )
+
+    return proxy(handler)
+
+
+def phases(header: str) -> list:
+    """Returns the names of the phases in a ``Server-Timing`` header."""
+    return [entry.split(";")[0] for entry in header.split(", ")]
+
+
+def test_rate_limit_phase(harness):
+    """Time spent in the rate limits is a phase of its own, ahead of the endpoint's phases."""
+    status, headers, _ = asyncio.run(harness.get("/api/resources/"))
+    assert status == HTTPStatus.OK.value
+    names = phases(headers["server-timing"])
+    assert names[:2] == ["rate_limit", "agent"]
+    assert names[-2:] == ["response", "total"]
+
+
+def test_rejected_timed(harness):
+    """Requests rejected by the rate limits are timed and recorded, along with the ones that were served."""
+    asyncio.run(harness.get("/api/resources/"))
+    status, headers, _ = asyncio.run(harness.get("/api/resources/"))
+    assert status == HTTPStatus.TOO_MANY_REQUESTS.value
+    assert phases(headers["server-timing"]) == ["response", "total"]
+    assert [record[2] for record in timing.records] == ["/api/resources/"] * 2
+    assert set(timing.summary()) >= {"total", "rate_limit", "response"}
+
+
+def test_ring_buffer(harness):
+    """Only the most recent requests are retained in the ring buffer."""
+    for path in ("/api/resources/a", "/api/resources/b", "/api/resources/c"):
+        asyncio.run(harness.get(path))
+    assert [record[2] for record in timing.records] == [
+        "/api/resources/b",
+        "/api/resources/c",
+    ]
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import pathlib
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from pyfilebrowser.main import FileBrowser
+from pyfilebrowser.proxy import settings, upstream
+from pyfilebrowser.squire import download
+
+
+def test_fail_fast(proxy):
+    """Requests are answered with a 503 right away once the server failed to connect, without contacting it."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        """Refuses the connection, like a server that is down."""
+        raise httpx.ConnectError("Connection refused", request=request)
+
+    harness = proxy(handler)
+    asyncio.run(harness.get("/api/resources/"))
+    assert not upstream.server.healthy
+    status, headers, _ = asyncio.run(harness.get("/api/resources/"))
+    assert status == HTTPStatus.SERVICE_UNAVAILABLE.value
+    assert headers["retry-after"]
+    assert headers["cache-control"] == "no-store"
+    assert len(harness.requests) == 1
+
+
+def test_probe(proxy, monkeypatch: pytest.MonkeyPatch):
+    """The circuit opens after consecutive failed probes, and closes with the next successful one."""
+    monkeypatch.setattr(settings.env_config.health_check, "failures", 2)
+    statuses = [HTTPStatus.BAD_GATEWAY, HTTPStatus.BAD_GATEWAY, HTTPStatus.OK]
+
+    async def handler(_: httpx.Request) -> httpx.Response:
+        """Serves the health endpoint, failing until it recovers."""
+        return httpx.Response(statuses.pop(0).value)
+
+    harness = proxy(handler)
+    asyncio.run(upstream.server.probe())
+    assert upstream.server.healthy
+    asyncio.run(upstream.server.probe())
+    assert not upstream.server.healthy
+    asyncio.run(upstream.server.probe())
+    assert upstream.server.healthy
+    assert [request.url.path for request in harness.requests] == ["/health"] * 3
+
+
+def test_socket_transport(tmp_path: pathlib.Path):
+    """Requests to the upstream server are sent over its unix domain socket, when one is configured."""
+    path = str(tmp_path / "filebrowser.sock")
+    lines = []
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Records the request line, and answers like the server's health endpoint."""
+        lines.append(await reader.readline())
+        while await reader.readline() not in (b"\r\n", b""):
+            pass
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: 2\r\n\r\nOK")
+        await writer.drain()
+        writer.close()
+
+    async def probe() -> None:
+        """Probes the server through the socket."""
+        listener = await asyncio.start_unix_server(serve, path)
+        async with listener:
+            server = upstream.Upstream("http://localhost", path)
+            await server.probe()
+            await server.client.aclose()
+        assert server.healthy
+
+    asyncio.run(probe())
+    assert lines == [b"GET /health HTTP/1.1\r\n"]
+
+
+def test_auto_socket():
+    """The server listens on a socket next to its database when the proxy is enabled, and on its port otherwise."""
+    server = FileBrowser(proxy=True).env.config_settings.server
+    assert server.socket == os.path.abspath(download.executable.filebrowser_socket)
+    assert not FileBrowser().env.config_settings.server.socket
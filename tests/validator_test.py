@@ -0,0 +1,85 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from pyfilebrowser.proxy import cache, state
+
+# Directory listing served by the mock filebrowser server, which has no validators
+LISTING = json.dumps(
+    {"items": [{"name": f"file-{index}.txt", "size": index} for index in range(64)]}
+).encode()
+
+
+@pytest.fixture
+def harness(proxy, monkeypatch: pytest.MonkeyPatch):
+    """Proxy with an empty validator cache, in front of a mock filebrowser server that serves a listing."""
+    monkeypatch.setattr(cache, "validators", state.TTLCache(maxsize=16, ttl=60))
+
+    async def resources(request: httpx.Request) -> httpx.Response:
+        """Serves the listing to GET requests, and rejects HEAD requests like filebrowser does."""
+        if request.method != "GET":
+            return httpx.Response(HTTPStatus.METHOD_NOT_ALLOWED.value)
+        return httpx.Response(
+            HTTPStatus.OK.value,
+            headers={"content-type": "application/json; charset=utf-8"},
+            stream=httpx.ByteStream(LISTING),
+        )
+
+    return proxy(resources)
+
+
+def test_listing_tagged(harness):
+    """Listings get a strong ETag from the proxy, and revalidations are answered without contacting upstream."""
+    status, headers, body = asyncio.run(harness.get("/api/resources/"))
+    assert status == HTTPStatus.OK.value
+    assert body == LISTING
+    etag = headers["etag"]
+    assert not etag.startswith("W/")
+    status, headers, body = asyncio.run(
+        harness.get("/api/resources/", {"if-none-match": etag})
+    )
+    assert status == HTTPStatus.NOT_MODIFIED.value
+    assert headers["etag"] == etag
+    assert not body
+    assert len(harness.requests) == 1
+
+
+def test_learnt_from_get(harness):
+    """Conditional requests without cached validators are sent as GET, and answered with the validators learnt."""
+    _, headers, _ = asyncio.run(harness.get("/api/resources/"))
+    cache.validators.clear()
+    status, _, _ = asyncio.run(
+        harness.get("/api/resources/", {"if-none-match": headers["etag"]})
+    )
+    assert status == HTTPStatus.NOT_MODIFIED.value
+    assert [request.method for request in harness.requests] == ["GET", "GET"]
+
+
+def test_weak_etag_echoed(harness):
+    """Compressed listings carry a weak ETag, which is echoed in its weak form by the local 304."""
+    status, headers, _ = asyncio.run(
+        harness.get("/api/resources/", {"accept-encoding": "gzip"})
+    )
+    assert status == HTTPStatus.OK.value
+    assert headers["content-encoding"] == "gzip"
+    etag = headers["etag"]
+    assert etag.startswith("W/")
+    status, headers, _ = asyncio.run(
+        harness.get(
+            "/api/resources/", {"accept-encoding": "gzip", "if-none-match": etag}
+        )
+    )
+    assert status == HTTPStatus.NOT_MODIFIED.value
+    assert headers["etag"] == etag
+
+
+def test_modified_listing(harness):
+    """Clients holding a stale ETag get the complete listing."""
+    status, _, body = asyncio.run(
+        harness.get("/api/resources/", {"if-none-match": '"stale"'})
+    )
+    assert status == HTTPStatus.OK.value
+    assert body == LISTING